@@ -4,7 +4,6 @@ from dotenv import load_dotenv
 # Add references
 from azure.identity import DefaultAzureCredential
 from azure.ai.projects import AIProjectClient
-from openai import AzureOpenAI
 
 def main(): 
 
@@ -51,9 +50,17 @@ def main():
             prompt.append({"role": "user", "content": input_text})
             response = openai_client.chat.completions.create(
                     model=model_deployment,
-                    messages=prompt)
-            completion = response.choices[0].message.content
-            print(completion)
+                    messages=prompt,
+                    stream=True)
+
+            # Print tokens as they arrive
+            completion = ""
+            for chunk in response:
+                if not chunk.choices or not chunk.choices[0].delta.content:
+                    continue
+                print(chunk.choices[0].delta.content, end="", flush=True)
+                completion += chunk.choices[0].delta.content
+            print()
             prompt.append({"role": "assistant", "content": completion})
 
 
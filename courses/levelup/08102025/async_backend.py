@@ -0,0 +1,166 @@
+"""Async, non-blocking chat backend for the Gradio apps.
+
+Gradio runs ``async def`` handlers on its event loop, so a request waiting
+for the model no longer holds a worker thread. ``AsyncChatBackend`` adds:
+
+* a global limit of requests in flight to the model (``CHAT_MAX_CONCURRENCY``),
+* at most one request in flight per session (a browser tab),
+* counters for requests in flight and waiting for a slot.
+
+Remember to lift Gradio's own per-event limit with
+``demo.queue(default_concurrency_limit=None)``, otherwise Gradio runs one
+handler at a time and this backend never sees concurrent requests.
+"""
+import asyncio
+import os
+from contextlib import AsyncExitStack, asynccontextmanager
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Set
+
+from ratelimit import estimate_tokens, get_limiter, usage_tokens
+from streaming import STREAM_OPTIONS, aiter_deltas
+from telemetry import track
+
+ClientFactory = Callable[[], Awaitable[Any]]
+
+
+class SessionBusyError(RuntimeError):
+    """Raised when a session already has a request in flight."""
+
+
+@dataclass
+class BackendStats:
+    max_concurrency: int
+    in_flight: int
+    waiting: int
+    busy_sessions: int
+    completed: int
+    failed: int
+
+    def to_markdown(self) -> str:
+        return (f"**In flight:** {self.in_flight} / {self.max_concurrency} · "
+                f"**Waiting:** {self.waiting} · **Busy sessions:** {self.busy_sessions} · "
+                f"**Completed:** {self.completed} · **Failed:** {self.failed}\n\n"
+                f"Rate limits – {get_limiter().stats}")
+
+
+class AsyncChatBackend:
+    def __init__(self, client_factory: ClientFactory, max_concurrency: int = 64):
+        self._client_factory = client_factory
+        self._client: Optional[Any] = None
+        self._client_lock = asyncio.Lock()
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self.max_concurrency = max_concurrency
+        self._busy: Set[str] = set()
+        self._in_flight = 0
+        self._waiting = 0
+        self._completed = 0
+        self._failed = 0
+
+    @classmethod
+    def from_env(cls, client_factory: ClientFactory) -> "AsyncChatBackend":
+        return cls(client_factory, max_concurrency=int(os.getenv("CHAT_MAX_CONCURRENCY", "64")))
+
+    async def client(self) -> Any:
+        # Built on first use, inside the running event loop
+        if self._client is None:
+            async with self._client_lock:
+                if self._client is None:
+                    self._client = await self._client_factory()
+        return self._client
+
+    @asynccontextmanager
+    async def session(self, session_id: str) -> AsyncIterator[None]:
+        """Hold the session only; raises ``SessionBusyError`` at once if it is taken.
+
+        Handlers that do paid work before the model call (summarizing old
+        turns, describing images) take the session first, so a double submit
+        is rejected before that work, and pass ``hold_session=False`` below.
+        """
+        if session_id in self._busy:
+            raise SessionBusyError("A previous request in this session is still running.")
+        self._busy.add(session_id)
+        try:
+            yield
+        finally:
+            self._busy.discard(session_id)
+
+    @asynccontextmanager
+    async def slot(self, session_id: str, hold_session: bool = True) -> AsyncIterator[None]:
+        """Hold the session (unless the caller already does) and one global slot for the duration of a request."""
+        async with AsyncExitStack() as stack:
+            if hold_session:
+                await stack.enter_async_context(self.session(session_id))
+            self._waiting += 1
+            try:
+                await self._semaphore.acquire()
+            finally:
+                self._waiting -= 1
+            self._in_flight += 1
+            try:
+                yield
+                self._completed += 1
+            except BaseException:
+                self._failed += 1
+                raise
+            finally:
+                self._in_flight -= 1
+                self._semaphore.release()
+
+    async def stream(self,
+                     session_id: str,
+                     model: str,
+                     messages: List[Dict[str, Any]],
+                     stream: bool = True,
+                     operation: str = "chat",
+                     hold_session: bool = True,
+                     **params: Any) -> AsyncIterator[str]:
+        """Yield the assistant answer as deltas (one piece when ``stream`` is off).
+
+        ``operation`` labels the call in telemetry (``chat``, ``vision``, ...);
+        ``hold_session=False`` when the caller holds ``session(session_id)``.
+        """
+        async with self.slot(session_id, hold_session):
+            client = await self.client()
+            limiter = get_limiter()
+            tokens = estimate_tokens(messages)
+            with track(operation, model, messages) as call:
+                if not stream:
+                    resp = await limiter.acall(
+                        model, lambda: client.chat.completions.create(model=model, messages=messages, **params), tokens
+                    )
+                    call.usage(resp.usage)
+                    limiter.settle(model, tokens, usage_tokens(resp))
+                    yield resp.choices[0].message.content or ""
+                    return
+                response = await limiter.acall(
+                    model,
+                    lambda: client.chat.completions.create(
+                        model=model, messages=messages, stream=True, stream_options=STREAM_OPTIONS, **params
+                    ),
+                    tokens,
+                )
+                async for delta in aiter_deltas(response, call):
+                    yield delta
+                limiter.settle(model, tokens, call.total_tokens)
+
+    async def complete(self,
+                       session_id: str,
+                       model: str,
+                       messages: List[Dict[str, Any]],
+                       operation: str = "chat",
+                       hold_session: bool = True,
+                       **params: Any) -> str:
+        parts = [delta async for delta in self.stream(session_id, model, messages, stream=False, operation=operation,
+                                                      hold_session=hold_session, **params)]
+        return "".join(parts)
+
+    def stats(self) -> BackendStats:
+        return BackendStats(
+            max_concurrency=self.max_concurrency,
+            in_flight=self._in_flight,
+            waiting=self._waiting,
+            busy_sessions=len(self._busy),
+            completed=self._completed,
+            failed=self._failed,
+        )
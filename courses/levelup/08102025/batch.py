@@ -0,0 +1,233 @@
+"""Run a JSONL file of prompts through the chat model, concurrently.
+
+Input, one JSON object per line::
+
+    {"id": "q1", "prompt": "Classify this ticket: ..."}
+    {"id": "q2", "messages": [{"role": "user", "content": "..."}], "system": "optional override"}
+
+Output, one line per finished request, written as soon as it finishes::
+
+    {"id": "q1", "answer": "...", "usage": {"prompt_tokens": 31, "completion_tokens": 7}, "latency_s": 0.81}
+    {"id": "q2", "error": "RateLimitError: ..."}
+
+The output file is also the checkpoint: run the same command again after a
+crash and the prompts that already have an answer are skipped (failed ones
+are retried; a last line cut short by the crash is removed first). An input
+line that is not a JSON object gets an error record, like a failed request,
+and the run goes on. Uses the same ``.env`` settings and pooled client as
+the chat apps. Usage::
+
+    python batch.py prompts.jsonl results.jsonl --concurrency 16
+    python -m levelup batch prompts.jsonl results.jsonl
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+from pathlib import Path
+from typing import Any, Dict, Iterator, Optional, Set
+
+from dotenv import load_dotenv
+
+from clients import get_async_project_openai_client
+from ratelimit import estimate_tokens, get_limiter, usage_tokens
+from telemetry import track
+
+# Same persona as the chat apps
+SYSTEM_DEFAULT = "You are a helpful AI assistant that answers questions clearly and concisely."
+
+FSYNC_EVERY = 100   # lines between fsyncs of the output/checkpoint file
+PROGRESS_EVERY = 5  # seconds between progress lines
+
+
+def drop_partial_line(output_path: Path, terminator: bytes = b"\n") -> int:
+    """Cut off a last line left unfinished by a crash; returns the bytes dropped.
+
+    Appending after such a fragment would glue the next record onto it and
+    leave a corrupt line behind for good. The item it belonged to has no
+    answer on record, so it is simply run again. ``terminator`` is what ends
+    a record: CRLF for CSV, whose quoted fields may hold newlines.
+    """
+    if not output_path.exists():
+        return 0
+    with open(output_path, "rb+") as f:
+        size = end = f.seek(0, os.SEEK_END)
+        while end > 0:
+            start = max(end - 64 * 1024, 0)
+            f.seek(start)
+            found = f.read(end - start).rfind(terminator)
+            if found >= 0:
+                end = start + found + len(terminator)
+                break
+            # Overlap the next window so a terminator split across the boundary is still found
+            end = start + len(terminator) - 1 if start > 0 else 0
+        if end < size:
+            f.truncate(end)
+            os.fsync(f.fileno())
+        return size - end
+
+
+def done_ids(output_path: Path) -> Set[str]:
+    """Ids that already have an answer in the output file."""
+    done: Set[str] = set()
+    if not output_path.exists():
+        return done
+    with open(output_path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue  # a line cut short by a crash
+            if "answer" in record:
+                done.add(str(record["id"]))
+    return done
+
+
+def read_items(input_path: Path) -> Iterator[Dict[str, Any]]:
+    with open(input_path, encoding="utf-8") as f:
+        for number, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+            try:
+                item = json.loads(line)
+                if not isinstance(item, dict):
+                    raise ValueError("not a JSON object")
+            except ValueError as e:
+                # Reported in the output like a failed request; the rest of the file still runs
+                yield {"id": str(number), "_invalid": f"input line {number}: {e}"}
+                continue
+            item["id"] = str(item.get("id", number))
+            yield item
+
+
+def build_messages(item: Dict[str, Any], system: str):
+    if "messages" in item:
+        messages = list(item["messages"])
+    else:
+        messages = [{"role": "user", "content": item["prompt"]}]
+    if not messages or messages[0].get("role") != "system":
+        messages.insert(0, {"role": "system", "content": item.get("system") or system})
+    return messages
+
+
+class Throughput:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.requests = 0
+        self.errors = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+
+    def line(self) -> str:
+        elapsed = max(time.perf_counter() - self.started, 1e-9)
+        tokens = self.prompt_tokens + self.completion_tokens
+        return (f"{self.requests} done, {self.errors} failed in {elapsed:.1f}s · "
+                f"{self.requests / elapsed:.2f} req/s · {tokens / elapsed:.0f} tokens/s "
+                f"({self.completion_tokens / elapsed:.0f} completion tokens/s)")
+
+
+async def run_batch(input_path: Path,
+                    output_path: Path,
+                    concurrency: int = 16,
+                    system: str = SYSTEM_DEFAULT,
+                    deployment: Optional[str] = None) -> Throughput:
+    load_dotenv()
+    deployment = deployment or os.getenv("MODEL_DEPLOYMENT")
+    endpoint = os.getenv("PROJECT_ENDPOINT")
+    if not endpoint or not deployment:
+        raise RuntimeError("Missing PROJECT_ENDPOINT or MODEL_DEPLOYMENT in .env")
+    client = await get_async_project_openai_client(endpoint, deployment)
+    limiter = get_limiter()
+
+    dropped = drop_partial_line(output_path)
+    if dropped:
+        print(f"Dropped an unfinished last line ({dropped} bytes) from {output_path}")
+    skip = done_ids(output_path)
+    if skip:
+        print(f"Resuming: {len(skip)} prompts already answered in {output_path}")
+    stats = Throughput()
+    queue: "asyncio.Queue[Optional[Dict[str, Any]]]" = asyncio.Queue(maxsize=concurrency * 2)
+
+    with open(output_path, "a", encoding="utf-8") as out:
+        def write(record: Dict[str, Any]) -> None:
+            out.write(json.dumps(record, ensure_ascii=False) + "\n")
+            out.flush()
+            if (stats.requests + stats.errors) % FSYNC_EVERY == 0:
+                os.fsync(out.fileno())
+
+        async def worker() -> None:
+            while True:
+                item = await queue.get()
+                if item is None:
+                    return
+                start = time.perf_counter()
+                try:
+                    messages = build_messages(item, system)
+                    tokens = estimate_tokens(messages)
+                    # Stays under AOAI_RPM/AOAI_TPM and retries 429s instead of failing the item
+                    with track("batch", deployment, messages) as call:
+                        resp = await limiter.acall(
+                            deployment,
+                            lambda: client.chat.completions.create(model=deployment, messages=messages),
+                            tokens,
+                        )
+                        call.usage(resp.usage)
+                    limiter.settle(deployment, tokens, usage_tokens(resp))
+                    usage = resp.usage
+                    stats.requests += 1
+                    stats.prompt_tokens += usage.prompt_tokens if usage else 0
+                    stats.completion_tokens += usage.completion_tokens if usage else 0
+                    write({
+                        "id": item["id"],
+                        "answer": resp.choices[0].message.content,
+                        "usage": {"prompt_tokens": usage.prompt_tokens, "completion_tokens": usage.completion_tokens} if usage else None,
+                        "latency_s": round(time.perf_counter() - start, 3),
+                    })
+                except Exception as e:
+                    stats.errors += 1
+                    write({"id": item["id"], "error": f"{type(e).__name__}: {e}"})
+
+        async def progress() -> None:
+            while True:
+                await asyncio.sleep(PROGRESS_EVERY)
+                print(stats.line(), flush=True)
+
+        workers = [asyncio.create_task(worker()) for _ in range(concurrency)]
+        reporter = asyncio.create_task(progress())
+        try:
+            # Reading is lazy and the queue is bounded, so huge inputs stay out of memory
+            for item in read_items(input_path):
+                if item["id"] in skip:
+                    continue
+                if "_invalid" in item:
+                    stats.errors += 1
+                    write({"id": item["id"], "error": item["_invalid"]})
+                    continue
+                await queue.put(item)
+            for _ in workers:
+                await queue.put(None)
+            await asyncio.gather(*workers)
+        finally:
+            reporter.cancel()
+            os.fsync(out.fileno())
+    return stats
+
+
+def main(argv: Optional[list] = None) -> int:
+    parser = argparse.ArgumentParser(description="Run a JSONL file of prompts through the chat model.")
+    parser.add_argument("input", type=Path)
+    parser.add_argument("output", type=Path)
+    parser.add_argument("--concurrency", type=int, default=16, help="requests in flight (default: 16)")
+    parser.add_argument("--system", default=SYSTEM_DEFAULT, help="system message for prompts without one")
+    parser.add_argument("--deployment", default=None, help="model deployment (default: MODEL_DEPLOYMENT)")
+    args = parser.parse_args(argv)
+
+    stats = asyncio.run(run_batch(args.input, args.output, args.concurrency, args.system, args.deployment))
+    print(stats.line())
+    print(get_limiter().stats)
+    return 1 if stats.errors else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
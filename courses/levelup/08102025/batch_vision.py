@@ -0,0 +1,318 @@
+"""Ask the same question about every image in a folder or manifest, concurrently.
+
+Input is a directory (searched recursively for .jpg/.jpeg/.png/.webp/.gif)
+or a manifest, either one path per line or JSONL::
+
+    {"id": "sku-1001", "path": "photos/1001.jpg"}
+    {"id": "sku-1002", "path": "photos/1002.jpg", "question": "optional override"}
+
+(relative paths are relative to the manifest). Output is JSONL, or CSV when
+the file name ends in ``.csv``; one row per image, written as it finishes::
+
+    {"id": "sku-1001", "path": "...", "answer": "{\\"ripe\\": true}", "dhash": "f0e1...", "bytes": 48211, ...}
+    {"id": "sku-1002", "path": "...", "duplicate_of": "sku-1001", "dhash": "f0e1..."}
+
+* images within ``--duplicate-bits`` of an earlier one (64-bit dHash, see
+  image_hash.py) are not sent; the row names the image that was answered
+  (copies wait while it is in flight, and if it fails one of them is sent),
+* every image goes through ``image_prep.prepare_file`` (downscaled to the
+  detail policy, or passed through when it already fits),
+* ``--concurrency`` workers send requests, and the base64 payloads in flight
+  never add up to more than ``--max-inflight-mb``,
+* like batch.py the output is the checkpoint: run the command again and the
+  answered images (and their hashes) are skipped; a row cut short by a crash
+  is dropped first.
+
+Usage::
+
+    python batch_vision.py photos/ results.csv --question "Is this fruit ripe? Answer JSON"
+    python -m levelup vision-batch manifest.jsonl results.jsonl --concurrency 8
+"""
+import argparse
+import asyncio
+import csv
+import json
+import os
+import time
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, Optional, Set
+
+from dotenv import load_dotenv
+
+from batch import FSYNC_EVERY, PROGRESS_EVERY, Throughput, drop_partial_line
+from clients import get_async_project_openai_client
+from image_hash import DuplicateIndex, dhash_file
+from image_prep import ImagePolicy, image_part, prepare_file
+from ratelimit import estimate_tokens, get_limiter, usage_tokens
+from telemetry import track
+
+SYSTEM_DEFAULT = (
+    "You are an AI assistant in a grocery store that sells fruit. "
+    "Describe only what is visible in the image."
+)
+QUESTION_DEFAULT = 'Is this fruit ripe? Answer only with JSON: {"fruit": "...", "ripe": true|false, "confidence": 0-1}'
+IMAGE_SUFFIXES = {".jpg", ".jpeg", ".png", ".webp", ".gif"}
+CSV_FIELDS = ["id", "path", "answer", "duplicate_of", "error", "dhash", "bytes",
+              "prompt_tokens", "completion_tokens", "latency_s"]
+
+
+class ByteBudget:
+    """Caps the bytes held by requests in flight; one oversized item may still go alone."""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.used = 0
+        self._changed = asyncio.Condition()
+
+    async def acquire(self, size: int) -> None:
+        async with self._changed:
+            await self._changed.wait_for(lambda: self.used == 0 or self.used + size <= self.limit)
+            self.used += size
+
+    async def release(self, size: int) -> None:
+        async with self._changed:
+            self.used -= size
+            self._changed.notify_all()
+
+
+class VisionThroughput(Throughput):
+    def __init__(self):
+        super().__init__()
+        self.duplicates = 0
+        self.sent_bytes = 0
+
+    def line(self) -> str:
+        elapsed = max(time.perf_counter() - self.started, 1e-9)
+        images = self.requests + self.duplicates
+        return (f"{self.requests} answered, {self.duplicates} duplicates, {self.errors} failed in {elapsed:.1f}s · "
+                f"{images / elapsed:.2f} images/s · {self.sent_bytes / 1024 / 1024 / elapsed:.1f} MB/s sent · "
+                f"{(self.prompt_tokens + self.completion_tokens) / elapsed:.0f} tokens/s")
+
+
+def read_images(source: Path) -> Iterator[Dict[str, Any]]:
+    """Items with ``id`` and ``path`` from a directory or a manifest, lazily and in a stable order."""
+    if source.is_dir():
+        for root, dirs, files in os.walk(source):
+            dirs.sort()
+            for name in sorted(files):
+                path = Path(root) / name
+                if path.suffix.lower() in IMAGE_SUFFIXES:
+                    yield {"id": path.relative_to(source).as_posix(), "path": path}
+        return
+    with open(source, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            item = json.loads(line) if line.startswith("{") else {"path": line}
+            item.setdefault("id", item["path"])
+            item["id"] = str(item["id"])
+            item["path"] = source.parent / Path(item["path"]).expanduser()
+            yield item
+
+
+def _json_rows(lines: Iterable[str]) -> Iterator[Dict[str, Any]]:
+    for line in lines:
+        try:
+            row = json.loads(line)
+        except ValueError:
+            continue  # not a record (a hand edit, or a line glued together by an older version)
+        if isinstance(row, dict):
+            yield row
+
+
+def load_checkpoint(output_path: Path, index: DuplicateIndex) -> Set[str]:
+    """Ids already answered (or skipped as duplicates); their hashes go into ``index``."""
+    done: Set[str] = set()
+    if not output_path.exists():
+        return done
+    with open(output_path, encoding="utf-8", newline="") as f:
+        if output_path.suffix.lower() == ".csv":
+            rows: Iterator[Dict[str, Any]] = csv.DictReader(f)
+        else:
+            rows = _json_rows(f)
+        for row in rows:
+            if row.get("answer") or row.get("duplicate_of"):
+                done.add(str(row["id"]))
+                if row.get("answer") and row.get("dhash"):
+                    index.add(int(row["dhash"], 16), str(row["id"]))
+    return done
+
+
+async def run_batch(source: Path,
+                    output_path: Path,
+                    question: str = QUESTION_DEFAULT,
+                    concurrency: int = 8,
+                    max_inflight_bytes: int = 64 * 1024 * 1024,
+                    duplicate_bits: int = 4,
+                    system: str = SYSTEM_DEFAULT,
+                    deployment: Optional[str] = None) -> VisionThroughput:
+    load_dotenv()
+    deployment = deployment or os.getenv("MODEL_DEPLOYMENT")
+    endpoint = os.getenv("PROJECT_ENDPOINT")
+    if not endpoint or not deployment:
+        raise RuntimeError("Missing PROJECT_ENDPOINT or MODEL_DEPLOYMENT in .env")
+    client = await get_async_project_openai_client(endpoint, deployment)
+    limiter = get_limiter()
+    policy = ImagePolicy.from_env()
+    budget = ByteBudget(max_inflight_bytes)
+
+    # A row cut short by a crash would swallow the first row appended now
+    dropped = drop_partial_line(output_path, b"\r\n" if output_path.suffix.lower() == ".csv" else b"\n")
+    if dropped:
+        print(f"Dropped an unfinished last row ({dropped} bytes) from {output_path}")
+    index = DuplicateIndex(duplicate_bits) if duplicate_bits >= 0 else None
+    skip = load_checkpoint(output_path, index or DuplicateIndex(0))
+    if skip:
+        print(f"Resuming: {len(skip)} images already done in {output_path}")
+    stats = VisionThroughput()
+    queue: "asyncio.Queue[Optional[Dict[str, Any]]]" = asyncio.Queue(maxsize=concurrency * 2)
+    as_csv = output_path.suffix.lower() == ".csv"
+    new_file = not output_path.exists() or output_path.stat().st_size == 0
+
+    with open(output_path, "a", encoding="utf-8", newline="") as out:
+        writer = csv.DictWriter(out, CSV_FIELDS, extrasaction="ignore") if as_csv else None
+        if writer is not None and new_file:
+            writer.writeheader()
+
+        def write(record: Dict[str, Any]) -> None:
+            record["path"] = str(record["path"])
+            if writer is not None:
+                writer.writerow(record)
+            else:
+                out.write(json.dumps(record, ensure_ascii=False) + "\n")
+            out.flush()
+            if (stats.requests + stats.duplicates + stats.errors) % FSYNC_EVERY == 0:
+                os.fsync(out.fileno())
+
+        # Originals still in flight -> future that says whether they got an answer
+        pending: Dict[str, "asyncio.Future[bool]"] = {}
+
+        async def find_original(value: int, item_id: str) -> Optional[str]:
+            """An answered near-duplicate, or None after registering ``item_id`` as the one to send."""
+            while True:
+                # Checked and added in one step on the event loop: the first copy to get here is sent
+                original = index.find(value)
+                if original is None:
+                    index.add(value, item_id)
+                    pending[item_id] = asyncio.get_running_loop().create_future()
+                    return None
+                outcome = pending.get(original)
+                # Only an answered image counts: if it fails, its copies look again (and one is sent)
+                if outcome is None or await asyncio.shield(outcome):
+                    return original
+
+        async def process(item: Dict[str, Any]) -> None:
+            start = time.perf_counter()
+            record: Dict[str, Any] = {"id": item["id"], "path": item["path"]}
+            value: Optional[int] = None
+            answered = False
+            try:
+                if index is not None:
+                    value = await asyncio.to_thread(dhash_file, item["path"])
+                    record["dhash"] = f"{value:016x}"
+                    original = await find_original(value, item["id"])
+                    if original is not None:
+                        stats.duplicates += 1
+                        write({**record, "duplicate_of": original})
+                        return
+
+                # Reserve the payload before decoding, so waiting items hold no image data
+                estimate = min(item["path"].stat().st_size, policy.max_bytes) * 4 // 3
+                await budget.acquire(estimate)
+                try:
+                    prepared = await asyncio.to_thread(prepare_file, item["path"], policy)
+                    data_url = prepared.data_url
+                    messages = [
+                        {"role": "system", "content": system},
+                        {"role": "user", "content": [
+                            {"type": "text", "text": item.get("question") or question},
+                            image_part(data_url, prepared.report.detail),
+                        ]},
+                    ]
+                    tokens = estimate_tokens(messages)
+                    with track("vision-batch", deployment, messages) as call:
+                        resp = await limiter.acall(
+                            deployment,
+                            lambda: client.chat.completions.create(model=deployment, messages=messages),
+                            tokens,
+                        )
+                        call.usage(resp.usage)
+                    limiter.settle(deployment, tokens, usage_tokens(resp))
+                finally:
+                    await budget.release(estimate)
+                usage = resp.usage
+                stats.requests += 1
+                stats.sent_bytes += len(data_url)
+                stats.prompt_tokens += usage.prompt_tokens if usage else 0
+                stats.completion_tokens += usage.completion_tokens if usage else 0
+                write({
+                    **record,
+                    "answer": resp.choices[0].message.content,
+                    "bytes": prepared.report.bytes,
+                    "prompt_tokens": usage.prompt_tokens if usage else None,
+                    "completion_tokens": usage.completion_tokens if usage else None,
+                    "latency_s": round(time.perf_counter() - start, 3),
+                })
+                answered = True
+            except Exception as e:
+                stats.errors += 1
+                write({**record, "error": f"{type(e).__name__}: {e}"})
+            finally:
+                outcome = pending.pop(item["id"], None)
+                if outcome is not None:
+                    if not answered:
+                        index.remove(value, item["id"])
+                    outcome.set_result(answered)
+
+        async def worker() -> None:
+            while True:
+                item = await queue.get()
+                if item is None:
+                    return
+                await process(item)
+
+        async def progress() -> None:
+            while True:
+                await asyncio.sleep(PROGRESS_EVERY)
+                print(stats.line(), flush=True)
+
+        workers = [asyncio.create_task(worker()) for _ in range(concurrency)]
+        reporter = asyncio.create_task(progress())
+        try:
+            # Walking is lazy and the queue is bounded, so huge folders stay out of memory
+            for item in read_images(source):
+                if item["id"] not in skip:
+                    await queue.put(item)
+            for _ in workers:
+                await queue.put(None)
+            await asyncio.gather(*workers)
+        finally:
+            reporter.cancel()
+            os.fsync(out.fileno())
+    return stats
+
+
+def main(argv: Optional[list] = None) -> int:
+    parser = argparse.ArgumentParser(description="Ask the same question about every image in a folder or manifest.")
+    parser.add_argument("source", type=Path, help="directory of images, or a manifest (paths or JSONL)")
+    parser.add_argument("output", type=Path, help="results, JSONL or .csv")
+    parser.add_argument("--question", default=QUESTION_DEFAULT)
+    parser.add_argument("--concurrency", type=int, default=8, help="requests in flight (default: 8)")
+    parser.add_argument("--max-inflight-mb", type=float, default=64, help="base64 payload in flight (default: 64)")
+    parser.add_argument("--duplicate-bits", type=int, default=4,
+                        help="dHash distance counted as a duplicate (default: 4, -1 = send every image)")
+    parser.add_argument("--system", default=SYSTEM_DEFAULT)
+    parser.add_argument("--deployment", default=None, help="model deployment (default: MODEL_DEPLOYMENT)")
+    args = parser.parse_args(argv)
+
+    stats = asyncio.run(run_batch(args.source, args.output, args.question, args.concurrency,
+                                  int(args.max_inflight_mb * 1024 * 1024), args.duplicate_bits,
+                                  args.system, args.deployment))
+    print(stats.line())
+    print(get_limiter().stats)
+    return 1 if stats.errors else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -2,9 +2,10 @@ import os
 from dotenv import load_dotenv
 
 # Add references
-from azure.identity import DefaultAzureCredential
-from azure.ai.projects import AIProjectClient
-from openai import AzureOpenAI
+from clients import get_project_openai_client
+from completion_cache import CompletionCache, cache_key
+from conversation import ConversationWindow, ModelSummarizer
+from streaming import stream_chat, streaming_enabled
 
 def main(): 
 
@@ -18,19 +19,15 @@ def main():
         project_endpoint = os.getenv("PROJECT_ENDPOINT")
         model_deployment =  os.getenv("MODEL_DEPLOYMENT")
 
-        # Initialize the project client
-        project_client = AIProjectClient(            
-                credential=DefaultAzureCredential(
-                    exclude_environment_credential=True,
-                    exclude_managed_identity_credential=True
-                ),
-                endpoint=project_endpoint,
-            )
-        
+        # Get a chat client (shared, pooled connection)
+        openai_client = get_project_openai_client(project_endpoint, model_deployment, api_version="2024-10-21")
+
 
-        # Get a chat client
-        openai_client = project_client.get_openai_client(api_version="2024-10-21")
+        # Keep the prompt within a token budget, older turns are summarized
+        window = ConversationWindow.from_env(summarizer=ModelSummarizer(openai_client, model_deployment))
 
+        # Optional answer cache (CHAT_CACHE=1 in .env)
+        cache = CompletionCache.from_env()
 
         # Initialize prompt with system message
         prompt = [
@@ -49,11 +46,21 @@ def main():
             
             # Get a chat completion
             prompt.append({"role": "user", "content": input_text})
-            response = openai_client.chat.completions.create(
-                    model=model_deployment,
-                    messages=prompt)
-            completion = response.choices[0].message.content
-            print(completion)
+            payload, metrics = window.prepare(prompt)
+            key = cache_key(model_deployment, payload) if cache else None
+            completion = cache.get(key) if cache else None
+            if completion is not None:
+                print(completion)
+                print(f"[cached answer, {metrics}]")
+            else:
+                completion = ""
+                for delta in stream_chat(openai_client, model_deployment, payload, stream=streaming_enabled()):
+                    print(delta, end="", flush=True)
+                    completion += delta
+                print()
+                print(f"[{metrics}]")
+                if cache:
+                    cache.put(key, completion)
             prompt.append({"role": "assistant", "content": completion})
 
 
@@ -1,19 +1,28 @@
 # gradio_text_chat.py
 import os
-from typing import List, Dict, Any, Tuple
+import asyncio
+from functools import lru_cache
+from typing import List, Dict, Any, AsyncIterator, Tuple
 
 from dotenv import load_dotenv
 import gradio as gr
 
-from azure.identity import DefaultAzureCredential
-from azure.ai.projects import AIProjectClient
+from async_backend import AsyncChatBackend, SessionBusyError
+from clients import get_async_project_openai_client, get_project_openai_client
+from completion_cache import CompletionCache, cache_key
+from conversation import ConversationWindow, ModelSummarizer
+from session_store import SessionStore
+from streaming import streaming_enabled
+from telemetry import stats_panel, stats_tab_enabled
 
 # To instrukcja dla modelu („bądź pomocny, odpowiadaj krótko”). Możesz ją zmienić w UI. Czyli jak ma się zachowywać asystent
 SYSTEM_DEFAULT = (
     "You are a helpful AI assistant that answers questions clearly and concisely."
 )
 
-# Budowanie klienta do Azure – połączenie i model
+# Budowanie klienta do Azure – połączenie i model.
+# Klient powstaje przy pierwszym pytaniu, a nie przy imporcie – import modułu nie czeka na logowanie do Azure.
+@lru_cache(maxsize=None)
 def _build_client():
     load_dotenv()
     endpoint = os.getenv("PROJECT_ENDPOINT")
@@ -22,91 +31,162 @@ def _build_client():
         raise RuntimeError(
             "Missing PROJECT_ENDPOINT or MODEL_DEPLOYMENT in .env"
         )
-# Tworzy klienta Projektu.
-    project_client = AIProjectClient(
-        credential=DefaultAzureCredential(
-            exclude_environment_credential=True,
-            exclude_managed_identity_credential=True
-        ),
-        endpoint=endpoint,
-    )
-    openai_client = project_client.get_openai_client(api_version="2024-10-21")
+# Wspólny klient z puli połączeń (clients.py) – jeden na endpoint/model/wersję API.
+    openai_client = get_project_openai_client(endpoint, deployment, api_version="2024-10-21")
     return openai_client, deployment
 
-openai_client, MODEL_DEPLOYMENT = _build_client()
-
-# Funkcja, która gada z modelem
-def _chat(messages: List[Dict[str, Any]]) -> str:
-    resp = openai_client.chat.completions.create(
-        model=MODEL_DEPLOYMENT,
-        messages=messages
-    )
-    return resp.choices[0].message.content
+# Okno rozmowy – wysyłamy system + ostatnie tury w budżecie tokenów, starsze tury trafiają do podsumowania
+@lru_cache(maxsize=None)
+def _window() -> ConversationWindow:
+    openai_client, deployment = _build_client()
+    return ConversationWindow.from_env(summarizer=ModelSummarizer(openai_client, deployment))
+
+async def _build_async_client():
+    _, deployment = _build_client()
+    return await get_async_project_openai_client(os.getenv("PROJECT_ENDPOINT"), deployment, api_version="2024-10-21")
+
+load_dotenv()
+
+# Asynchroniczny backend – czekanie na model nie blokuje wątku Gradio
+BACKEND = AsyncChatBackend.from_env(_build_async_client)
+
+# Pamięć podręczna odpowiedzi (włączana przez CHAT_CACHE=1) – te same pytania nie idą drugi raz do modelu
+CACHE = CompletionCache.from_env()
+
+# Historia rozmów po stronie serwera – limit pamięci, bezczynne sesje lądują na dysku (CHAT_SESSIONS_*)
+SESSIONS = SessionStore.from_env()
+
+def _new_session() -> List[Dict[str, Any]]:
+    return [{"role": "system", "content": SYSTEM_DEFAULT}]
+
+# Funkcja, która gada z modelem – zwraca odpowiedź kawałkami (delty), gdy tylko przychodzą
+async def _chat(session_id: str, messages: List[Dict[str, Any]]) -> AsyncIterator[str]:
+    _, deployment = _build_client()
+    async for delta in BACKEND.stream(
+        session_id,
+        deployment,
+        messages,
+        stream=streaming_enabled(),
+        hold_session=False,  # send_message już trzyma sesję
+    ):
+        yield delta
 # Co się dzieje po kliknięciu „Send” – obsługa jednej tury czatu
-def send_message(user_msg: str,
-                 chat_history: List[Tuple[str, str]],
-                 system_msg: str,
-                 messages_state: List[Dict[str, Any]]):
+async def send_message(user_msg: str,
+                       chat_history: List[Tuple[str, str]],
+                       system_msg: str,
+                       request: gr.Request):
     if not user_msg.strip():
-        return gr.update(), messages_state
+        yield gr.update(), gr.update()
+        return
+
+    # Kopia rozmowy z magazynu sesji – zapisujemy ją z powrotem dopiero po udanej turze
+    session_id = request.session_hash
+    messages = [dict(m) for m in SESSIONS.get(session_id, _new_session)]
+    if messages and messages[0].get("role") == "system":
+        messages[0]["content"] = system_msg or SYSTEM_DEFAULT
 
     # Append user turn
-    messages_state.append({"role": "user", "content": user_msg})
+    messages.append({"role": "user", "content": user_msg})
 
+    # Stream the answer into the Chatbot as it arrives
+    assistant = ""
+    context_info = ""
     try:
-        assistant = _chat(messages_state)
+        # Najpierw rezerwujemy sesję: podwójne kliknięcie nie zapłaci za podsumowanie starszych tur
+        async with BACKEND.session(session_id):
+            # Podsumowanie starszych tur to zwykłe (blokujące) wywołanie – robimy je w wątku
+            payload, metrics = await asyncio.to_thread(_window().prepare, messages)
+            context_info = str(metrics)
+            key = cache_key(_build_client()[1], payload) if CACHE else None
+            cached = CACHE.get(key) if CACHE else None
+            if cached is not None:
+                assistant = cached
+                context_info = f"⚡ cached answer · {context_info}"
+            else:
+                async for delta in _chat(session_id, payload):
+                    assistant += delta
+                    yield chat_history + [(user_msg, assistant)], context_info
+                if CACHE:
+                    CACHE.put(key, assistant)
+    except SessionBusyError as e:
+        # Poprzednie pytanie z tej karty jeszcze się liczy – nie zapisujemy nowej tury
+        gr.Warning(str(e))
+        yield gr.update(), gr.update()
+        return
     except Exception as e:
-        assistant = f"Error: {e}"
+        assistant = f"{assistant}\n\nError: {e}" if assistant else f"Error: {e}"
 
-    # Append assistant turn
-    messages_state.append({"role": "assistant", "content": assistant})
+    # Append assistant turn (once, with the full text)
+    messages.append({"role": "assistant", "content": assistant})
+    SESSIONS.put(session_id, messages)
     chat_history = chat_history + [(user_msg, assistant)]
-    return chat_history, messages_state
+    yield chat_history, context_info
+
+# Stan backendu – ile zapytań jest w toku i ile czeka w kolejce
+def backend_status():
+    status = BACKEND.stats().to_markdown()
+    if CACHE:
+        status += f"\n\n{CACHE.stats}"
+    return f"{status}\n\n{SESSIONS.to_markdown()}"
 
 # „Wyczyść rozmowę” – start od nowa
-def reset_chat(system_msg: str):
+def reset_chat(system_msg: str, request: gr.Request):
     # (re)seed message list with system message
-    return [], [{"role": "system", "content": system_msg or SYSTEM_DEFAULT}]
+    SESSIONS.put(request.session_hash, [{"role": "system", "content": system_msg or SYSTEM_DEFAULT}])
+    return [], ""
 
 # Budowa okienka w Gradio (UI)
 with gr.Blocks(css="footer {visibility: hidden}") as demo:
     gr.Markdown("# Project LevelUP Generative AI Chat")
     gr.Markdown("Type a question and get an answer using your configured Azure model deployment.")
 
-    system_box = gr.Textbox(
-        label="System message (optional)",
-        value=SYSTEM_DEFAULT,
-        lines=3
-    )
-
-    chatbot = gr.Chatbot(height=420)
-    user_box = gr.Textbox(
-        label="Your message",
-        placeholder="Ask anything…",
-    )
-
-    messages_state = gr.State(value=[{"role": "system", "content": SYSTEM_DEFAULT}])
-
-    with gr.Row():
-        send_btn = gr.Button("Send", variant="primary")
-        clear_btn = gr.Button("Clear")
-
-    # co ma się stać po kliknięciu/enterze
-    send_btn.click(
-        send_message,
-        inputs=[user_box, chatbot, system_box, messages_state],
-        outputs=[chatbot, messages_state]
-    )
-    user_box.submit(
-        send_message,
-        inputs=[user_box, chatbot, system_box, messages_state],
-        outputs=[chatbot, messages_state]
-    )
-    clear_btn.click(
-        reset_chat,
-        inputs=[system_box],
-        outputs=[chatbot, messages_state]
-    )
+    with gr.Tab("Chat"):
+        system_box = gr.Textbox(
+            label="System message (optional)",
+            value=SYSTEM_DEFAULT,
+            lines=3
+        )
+
+        chatbot = gr.Chatbot(height=420)
+        context_info = gr.Markdown()
+        user_box = gr.Textbox(
+            label="Your message",
+            placeholder="Ask anything…",
+        )
+
+        with gr.Row():
+            send_btn = gr.Button("Send", variant="primary")
+            clear_btn = gr.Button("Clear")
+
+        # co ma się stać po kliknięciu/enterze
+        send_btn.click(
+            send_message,
+            inputs=[user_box, chatbot, system_box],
+            outputs=[chatbot, context_info]
+        )
+        user_box.submit(
+            send_message,
+            inputs=[user_box, chatbot, system_box],
+            outputs=[chatbot, context_info]
+        )
+        clear_btn.click(
+            reset_chat,
+            inputs=[system_box],
+            outputs=[chatbot, context_info]
+        )
+
+        with gr.Accordion("Backend status", open=False):
+            status_md = gr.Markdown()
+            refresh_btn = gr.Button("Refresh")
+        refresh_btn.click(backend_status, outputs=[status_md])
+
+    # Zakładka ze statystykami wywołań modelu (STATS_TAB=0 ją ukrywa)
+    if stats_tab_enabled():
+        with gr.Tab("Stats"):
+            stats_panel()
+
+# Limit równoległości pilnuje BACKEND, więc Gradio nie ogranicza liczby handlerów
+demo.queue(default_concurrency_limit=None)
 # Start aplikacji
 if __name__ == "__main__":
     demo.launch()
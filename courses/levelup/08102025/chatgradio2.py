@@ -1,9 +1,16 @@
 import os
-from typing import List, Dict, Any, Tuple
+import asyncio
+from functools import lru_cache
+from typing import List, Dict, Any, AsyncIterator, Tuple
 from dotenv import load_dotenv
 import gradio as gr
-from azure.identity import DefaultAzureCredential
-from azure.ai.projects import AIProjectClient
+from async_backend import AsyncChatBackend, SessionBusyError
+from clients import get_async_project_openai_client, get_project_openai_client
+from completion_cache import CompletionCache, cache_key
+from conversation import ConversationWindow, ModelSummarizer
+from session_store import SessionStore
+from streaming import streaming_enabled
+from telemetry import stats_panel, stats_tab_enabled
 
 THEME = gr.themes.Base()
 
@@ -29,58 +36,115 @@ footer { visibility: hidden; }
 
 SYSTEM_DEFAULT = "You are a helpful AI assistant that answers questions clearly and concisely."
 
+@lru_cache(maxsize=None)
 def _build_client():
     load_dotenv()
     endpoint = os.getenv("PROJECT_ENDPOINT")
     deployment = os.getenv("MODEL_DEPLOYMENT")
     if not endpoint or not deployment:
         raise RuntimeError("Missing PROJECT_ENDPOINT or MODEL_DEPLOYMENT in .env")
-    project_client = AIProjectClient(
-        credential=DefaultAzureCredential(exclude_environment_credential=True, exclude_managed_identity_credential=True),
-        endpoint=endpoint,
-    )
-    openai_client = project_client.get_openai_client(api_version="2024-10-21")
+    openai_client = get_project_openai_client(endpoint, deployment, api_version="2024-10-21")
     return openai_client, deployment
 
-openai_client, MODEL_DEPLOYMENT = _build_client()
+@lru_cache(maxsize=None)
+def _window() -> ConversationWindow:
+    openai_client, deployment = _build_client()
+    return ConversationWindow.from_env(summarizer=ModelSummarizer(openai_client, deployment))
 
-def _chat(messages: List[Dict[str, Any]]) -> str:
-    resp = openai_client.chat.completions.create(model=MODEL_DEPLOYMENT, messages=messages)
-    return resp.choices[0].message.content
+async def _build_async_client():
+    _, deployment = _build_client()
+    return await get_async_project_openai_client(os.getenv("PROJECT_ENDPOINT"), deployment, api_version="2024-10-21")
 
-def send_message(user_msg: str, chat_history: List[Dict[str, str]], system_msg: str, messages_state: List[Dict[str, Any]]):
+load_dotenv()
+CACHE = CompletionCache.from_env()
+BACKEND = AsyncChatBackend.from_env(_build_async_client)
+SESSIONS = SessionStore.from_env()
+
+def _new_session() -> List[Dict[str, Any]]:
+    return [{"role": "system", "content": SYSTEM_DEFAULT}]
+
+async def _chat(session_id: str, messages: List[Dict[str, Any]]) -> AsyncIterator[str]:
+    _, deployment = _build_client()
+    async for delta in BACKEND.stream(session_id, deployment, messages, stream=streaming_enabled(),
+                                     hold_session=False):
+        yield delta
+
+async def send_message(user_msg: str, chat_history: List[Dict[str, str]], system_msg: str, request: gr.Request):
     if not user_msg.strip():
-        return gr.update(), messages_state
-    if messages_state and messages_state[0].get("role") == "system":
-        messages_state[0]["content"] = system_msg or SYSTEM_DEFAULT
-    messages_state.append({"role": "user", "content": user_msg})
+        yield gr.update(), gr.update()
+        return
+    session_id = request.session_hash
+    # Work on a copy; the store only sees the turn once it has finished
+    messages = [dict(m) for m in SESSIONS.get(session_id, _new_session)]
+    if messages and messages[0].get("role") == "system":
+        messages[0]["content"] = system_msg or SYSTEM_DEFAULT
+    messages.append({"role": "user", "content": user_msg})
+    chat_history = chat_history + [{"role": "user", "content": user_msg}]
+    assistant = ""
+    context_info = ""
     try:
-        assistant = _chat(messages_state)
+        # Take the session first: a double submit must not pay for summarizing old turns
+        async with BACKEND.session(session_id):
+            payload, metrics = await asyncio.to_thread(_window().prepare, messages)
+            context_info = str(metrics)
+            key = cache_key(_build_client()[1], payload) if CACHE else None
+            cached = CACHE.get(key) if CACHE else None
+            if cached is not None:
+                assistant = cached
+                context_info = f"⚡ cached answer · {context_info}"
+            else:
+                async for delta in _chat(session_id, payload):
+                    assistant += delta
+                    yield chat_history + [{"role": "assistant", "content": assistant}], context_info
+                if CACHE:
+                    CACHE.put(key, assistant)
+    except SessionBusyError as e:
+        gr.Warning(str(e))
+        yield gr.update(), gr.update()
+        return
     except Exception as e:
-        assistant = f"Error: {e}"
-    messages_state.append({"role": "assistant", "content": assistant})
-    chat_history = chat_history + [{"role": "user", "content": user_msg}, {"role": "assistant", "content": assistant}]
-    return chat_history, messages_state
+        assistant = f"{assistant}\n\nError: {e}" if assistant else f"Error: {e}"
+    messages.append({"role": "assistant", "content": assistant})
+    SESSIONS.put(session_id, messages)
+    chat_history = chat_history + [{"role": "assistant", "content": assistant}]
+    yield chat_history, context_info
 
-def reset_chat(system_msg: str):
-    return [], [{"role": "system", "content": system_msg or SYSTEM_DEFAULT}]
+def backend_status():
+    status = BACKEND.stats().to_markdown()
+    if CACHE:
+        status += f"\n\n{CACHE.stats}"
+    return f"{status}\n\n{SESSIONS.to_markdown()}"
+
+def reset_chat(system_msg: str, request: gr.Request):
+    SESSIONS.put(request.session_hash, [{"role": "system", "content": system_msg or SYSTEM_DEFAULT}])
+    return [], ""
 
 with gr.Blocks(css=CUSTOM_CSS, theme=THEME, elem_id="root") as demo:
     with gr.Column(elem_id="shell"):
         with gr.Column(elem_id="card"):
             gr.Markdown("# Project LevelUP – Generative AI Chat", elem_id="title")
             gr.Markdown("Type a question and get an answer using your configured Azure model deployment.", elem_id="subtitle")
-            with gr.Column(elem_id="stack"):
-                system_box = gr.Textbox(label="System message (optional)", value=SYSTEM_DEFAULT, lines=3, elem_id="system-box")
-                chatbot = gr.Chatbot(height=520, elem_id="chatbot", type="messages")
-                user_box = gr.Textbox(label="Your message", placeholder="Ask anything…", lines=3, elem_id="user-box")
-                messages_state = gr.State(value=[{"role": "system", "content": SYSTEM_DEFAULT}])
-                with gr.Row(elem_id="actions"):
-                    clear_btn = gr.Button("Clear", elem_id="clear-btn")
-                    send_btn = gr.Button("Send", elem_id="send-btn")
-                send_btn.click(send_message, inputs=[user_box, chatbot, system_box, messages_state], outputs=[chatbot, messages_state])
-                user_box.submit(send_message, inputs=[user_box, chatbot, system_box, messages_state], outputs=[chatbot, messages_state])
-                clear_btn.click(reset_chat, inputs=[system_box], outputs=[chatbot, messages_state])
+            with gr.Tab("Chat"):
+                with gr.Column(elem_id="stack"):
+                    system_box = gr.Textbox(label="System message (optional)", value=SYSTEM_DEFAULT, lines=3, elem_id="system-box")
+                    chatbot = gr.Chatbot(height=520, elem_id="chatbot", type="messages")
+                    context_info = gr.Markdown(elem_id="context-info")
+                    user_box = gr.Textbox(label="Your message", placeholder="Ask anything…", lines=3, elem_id="user-box")
+                    with gr.Row(elem_id="actions"):
+                        clear_btn = gr.Button("Clear", elem_id="clear-btn")
+                        send_btn = gr.Button("Send", elem_id="send-btn")
+                    send_btn.click(send_message, inputs=[user_box, chatbot, system_box], outputs=[chatbot, context_info])
+                    user_box.submit(send_message, inputs=[user_box, chatbot, system_box], outputs=[chatbot, context_info])
+                    clear_btn.click(reset_chat, inputs=[system_box], outputs=[chatbot, context_info])
+                    with gr.Accordion("Backend status", open=False):
+                        status_md = gr.Markdown()
+                        refresh_btn = gr.Button("Refresh")
+                    refresh_btn.click(backend_status, outputs=[status_md])
+            if stats_tab_enabled():
+                with gr.Tab("Stats"):
+                    stats_panel()
+
+demo.queue(default_concurrency_limit=None)
 
 if __name__ == "__main__":
     demo.launch()  # zmiana portu
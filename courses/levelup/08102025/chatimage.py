@@ -1,13 +1,13 @@
 import os
-from urllib.request import urlopen, Request
-import base64
 from pathlib import Path
 from dotenv import load_dotenv
 
 # Add references
-from azure.identity import DefaultAzureCredential
-from azure.ai.projects import AIProjectClient
-from openai import AzureOpenAI
+from clients import get_project_openai_client
+from image_cache import get_image_cache
+from image_prep import ImagePolicy
+from ratelimit import estimate_tokens, get_limiter
+from telemetry import track
 
 
 def main(): 
@@ -22,23 +22,18 @@ def main():
         project_endpoint = os.getenv("PROJECT_ENDPOINT")
         model_deployment =  os.getenv("MODEL_DEPLOYMENT")
 
-        # Initialize the project client
-        project_client = AIProjectClient(            
-                credential=DefaultAzureCredential(
-                    exclude_environment_credential=True,
-                    exclude_managed_identity_credential=True
-                ),
-                endpoint=project_endpoint,
-            )
-
-
-        # Get a chat client
-        openai_client = project_client.get_openai_client(api_version="2024-10-21")
+        # Get a chat client (shared, pooled connection)
+        openai_client = get_project_openai_client(project_endpoint, model_deployment, api_version="2024-10-21")
         
         # Initialize prompts
         system_message = "You are an AI assistant in a grocery store that sells fruit. You provide detailed answers to questions about produce."
         prompt = ""
 
+        # The image is the same for every question: fetch, downscale and encode it once (cached across runs too)
+        image_url = "https://github.com/MicrosoftLearning/mslearn-ai-vision/raw/refs/heads/main/Labfiles/gen-ai-vision/orange.jpeg"
+        image = get_image_cache().url_image(image_url, ImagePolicy.from_env())
+        print(image.report)
+
         # Loop until the user types 'quit'
         while True:
             prompt = input("\nAsk a question about the image\n(or type 'quit' to exit)\n")
@@ -50,22 +45,20 @@ def main():
                 print("Getting a response ...\n")
 
                 # Get a response to image input
-                image_url = "https://github.com/MicrosoftLearning/mslearn-ai-vision/raw/refs/heads/main/Labfiles/gen-ai-vision/orange.jpeg"
-                image_format = "jpeg"
-                request = Request(image_url, headers={"User-Agent": "Mozilla/5.0"})
-                image_data = base64.b64encode(urlopen(request).read()).decode("utf-8")
-                data_url = f"data:image/{image_format};base64,{image_data}"
-
-                response = openai_client.chat.completions.create(
-                    model=model_deployment,
-                    messages=[
-                        {"role": "system", "content": system_message},
-                        { "role": "user", "content": [  
-                            { "type": "text", "text": prompt},
-                            { "type": "image_url", "image_url": {"url": data_url}}
-                        ] } 
-                    ]
-                )
+                messages = [
+                    {"role": "system", "content": system_message},
+                    { "role": "user", "content": [  
+                        { "type": "text", "text": prompt},
+                        image.part()
+                    ] } 
+                ]
+                with track("vision", model_deployment, messages) as call:
+                    response = get_limiter().call(
+                        model_deployment,
+                        lambda: openai_client.chat.completions.create(model=model_deployment, messages=messages),
+                        estimate_tokens(messages),
+                    )
+                    call.usage(response.usage)
                 print(response.choices[0].message.content)
                     
 
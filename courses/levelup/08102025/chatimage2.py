@@ -1,16 +1,24 @@
 import os
-import base64
 import mimetypes
-from urllib.request import urlopen, Request
 from pathlib import Path
 from dotenv import load_dotenv
 
 # Azure
-from azure.identity import DefaultAzureCredential
-from azure.ai.projects import AIProjectClient
+from clients import get_project_openai_client
+from image_cache import CachedImage, get_image_cache
+from image_prep import ImagePolicy
+from vision_session import VisionConversation, describe_messages
+from ratelimit import estimate_tokens, get_limiter
+from telemetry import track
 
 
-def _image_file_to_data_url(file_path: Path) -> str:
+DEFAULT_IMAGE_URL = (
+    "https://github.com/MicrosoftLearning/mslearn-ai-vision/raw/refs/heads/main/"
+    "Labfiles/gen-ai-vision/orange.jpeg"
+)
+
+
+def _load_image_file(file_path: Path, policy: ImagePolicy) -> CachedImage:
     if not file_path.exists() or not file_path.is_file():
         raise FileNotFoundError(f"Nie znaleziono pliku: {file_path}")
 
@@ -25,22 +33,23 @@ def _image_file_to_data_url(file_path: Path) -> str:
             )
         mime = f"image/{ext if ext != 'jpg' else 'jpeg'}"
 
-    with open(file_path, "rb") as f:
-        encoded = base64.b64encode(f.read()).decode("utf-8")
-    return f"data:{mime};base64,{encoded}"
+    # Kodujemy tylko raz – cache rozpoznaje plik po ścieżce, dacie modyfikacji i rozmiarze;
+    # zdjęcie jest zmniejszane do rozmiaru, którego model i tak używa (patrz image_prep.py)
+    return get_image_cache().file_image(file_path, mime, policy)
 
 
-def _image_url_to_data_url(url: str) -> str:
+def _load_image_url(url: str, policy: ImagePolicy) -> CachedImage:
     # Zachowujemy możliwość użycia URL jako fallback (przydatne w testach)
-    req = Request(url, headers={"User-Agent": "Mozilla/5.0"})
-    data = urlopen(req).read()
-    # Zgadujemy MIME prosto po rozszerzeniu
-    mime, _ = mimetypes.guess_type(url)
-    if not mime or not mime.startswith("image/"):
-        # jeśli nie da się zgadnąć, przyjmujemy jpeg (najczęściej)
-        mime = "image/jpeg"
-    encoded = base64.b64encode(data).decode("utf-8")
-    return f"data:{mime};base64,{encoded}"
+    # Cache trzyma gotowy data URL i sprawdza ETag/Last-Modified, zamiast pobierać obraz ponownie;
+    # MIME bierzemy z Content-Type, a gdy go brak – z rozszerzenia (domyślnie jpeg)
+    return get_image_cache().url_image(url, policy)
+
+
+def _load_image(ref: str, policy: ImagePolicy) -> CachedImage:
+    # Obraz z cache – kolejne pytania nie pobierają ani nie kodują go ponownie
+    if ref.lower().startswith(("http://", "https://")):
+        return _load_image_url(ref, policy)
+    return _load_image_file(Path(ref).expanduser(), policy)
 
 
 def main():
@@ -58,15 +67,8 @@ def main():
                 "Dodaj je do pliku .env."
             )
 
-        # Klient projektu + klient OpenAI
-        project_client = AIProjectClient(
-            credential=DefaultAzureCredential(
-                exclude_environment_credential=True,
-                exclude_managed_identity_credential=True,
-            ),
-            endpoint=project_endpoint,
-        )
-        openai_client = project_client.get_openai_client(api_version="2024-10-21")
+        # Klient OpenAI (wspólna pula połączeń, patrz clients.py)
+        openai_client = get_project_openai_client(project_endpoint, model_deployment, api_version="2024-10-21")
 
         # Persona systemowa
         system_message = (
@@ -81,46 +83,55 @@ def main():
             "albo wklej URL obrazu. Pozostaw puste, aby użyć domyślnego zdjęcia pomarańczy.\n> "
         ).strip()
 
-        if img_input:
-            if img_input.lower().startswith(("http://", "https://")):
-                data_url = _image_url_to_data_url(img_input)
-            else:
-                data_url = _image_file_to_data_url(Path(img_input).expanduser())
-        else:
-            # Domyślne zdjęcie (fallback)
-            default_url = (
-                "https://github.com/MicrosoftLearning/mslearn-ai-vision/raw/refs/heads/main/"
-                "Labfiles/gen-ai-vision/orange.jpeg"
-            )
-            data_url = _image_url_to_data_url(default_url)
+        # Poziom szczegółów i budżet bajtów z .env (VISION_DETAIL, VISION_MAX_KB, VISION_MIN_QUALITY)
+        policy = ImagePolicy.from_env()
+        # Domyślne zdjęcie (fallback)
+        ref = img_input or DEFAULT_IMAGE_URL
+        print(_load_image(ref, policy).report)
+
+        def ask(messages):
+            # Wywołanie chat completions (limity RPM/TPM + ponawianie po 429)
+            with track("vision", model_deployment, messages) as call:
+                response = get_limiter().call(
+                    model_deployment,
+                    lambda: openai_client.chat.completions.create(model=model_deployment, messages=messages),
+                    estimate_tokens(messages),
+                )
+                call.usage(response.usage)
+            return response.choices[0].message.content
+
+        # Rozmowa z historią: obraz trafia do żądania tylko raz, starsze obrazy zastępuje ich opis
+        conversation = VisionConversation.new(system_message)
+        new_image = True
 
         # Pętla QA
         while True:
-            prompt = input("\nZadaj pytanie o obraz (lub wpisz 'quit' aby wyjść)\n> ")
+            prompt = input("\nZadaj pytanie o obraz ('obraz <ścieżka|URL>' zmienia obraz, 'quit' kończy)\n> ")
             if prompt.lower() == "quit":
                 break
+            if prompt.lower().startswith("obraz "):
+                try:
+                    print(_load_image(prompt[len("obraz "):].strip(), policy).report)
+                except Exception as ex:
+                    print("[BŁĄD]", ex)
+                    continue
+                ref = prompt[len("obraz "):].strip()
+                new_image = True
+                continue
             if not prompt.strip():
                 print("Podaj treść pytania.")
                 continue
 
             print("\nPobieram odpowiedź...\n")
 
-            # Wywołanie chat completions z tekstem i obrazem
-            response = openai_client.chat.completions.create(
-                model=model_deployment,
-                messages=[
-                    {"role": "system", "content": system_message},
-                    {
-                        "role": "user",
-                        "content": [
-                            {"type": "text", "text": prompt},
-                            {"type": "image_url", "image_url": {"url": data_url}},
-                        ],
-                    },
-                ],
-            )
+            conversation.add_user(prompt, ref if new_image else None)
+            new_image = False
+            for old_ref in conversation.undescribed():
+                conversation.describe(old_ref, ask(describe_messages(_load_image(old_ref, policy).part())))
+            answer = ask(conversation.build(lambda r: _load_image(r, policy).part()))
+            conversation.add_assistant(answer)
 
-            print(response.choices[0].message.content)
+            print(answer)
 
     except Exception as ex:
         print("[BŁĄD]", ex)
@@ -1,36 +1,43 @@
 import os
-import io
-import base64
+import asyncio
+import copy
+from functools import lru_cache
 from typing import Optional, List, Dict, Any
 
 from dotenv import load_dotenv
-from PIL import Image
 import gradio as gr
 
-from azure.identity import DefaultAzureCredential
-from azure.ai.projects import AIProjectClient
+from async_backend import AsyncChatBackend, SessionBusyError
+from clients import get_async_project_openai_client
+from image_cache import CachedImage, get_image_cache
+from image_prep import ImagePolicy
+from session_store import SessionStore
+from telemetry import payload_sizes, stats_panel, stats_tab_enabled
+from vision_session import VisionConversation, describe_messages
 
 
-def _load_clients():
+@lru_cache(maxsize=None)
+def _load_settings():
     load_dotenv()
     endpoint = os.getenv("PROJECT_ENDPOINT")
     deployment = os.getenv("MODEL_DEPLOYMENT")
 
     if not endpoint or not deployment:
         raise RuntimeError("Missing PROJECT_CONNECTION or MODEL_DEPLOYMENT in .env")
+    return endpoint, deployment
 
-    project_client = AIProjectClient(
-        credential=DefaultAzureCredential(
-            exclude_environment_credential=True,
-            exclude_managed_identity_credential=True,
-        ),
-        endpoint=endpoint,
-    )
-    openai_client = project_client.get_openai_client(api_version="2024-10-21")
-    return openai_client, deployment
 
+async def _load_client():
+    endpoint, deployment = _load_settings()
+    return await get_async_project_openai_client(endpoint, deployment, api_version="2024-10-21")
 
-openai_client, MODEL_DEPLOYMENT = _load_clients()
+
+# The client is created on the first request, inside Gradio's event loop,
+# so importing this module never waits on Azure sign-in
+load_dotenv()
+BACKEND = AsyncChatBackend.from_env(_load_client)
+IMAGE_POLICY = ImagePolicy.from_env()
+SESSIONS = SessionStore.from_env()
 
 SYSTEM_DEFAULT = (
     "You are an AI assistant in a grocery store that sells fruit. "
@@ -39,51 +46,111 @@ SYSTEM_DEFAULT = (
 )
 
 
-def _to_data_url(img: Image.Image, fmt: str = "JPEG") -> str:
-    buf = io.BytesIO()
-    img.convert("RGB").save(buf, format=fmt)
-    b64 = base64.b64encode(buf.getvalue()).decode("utf-8")
-    mime = "image/jpeg" if fmt.upper() == "JPEG" else f"image/{fmt.lower()}"
-    return f"data:{mime};base64,{b64}"
+def _prepare(path: str) -> CachedImage:
+    # The upload as Gradio saved it: sent as-is when it already fits the policy, otherwise
+    # downscaled to the model's tile geometry; asking again about the same file reuses the result
+    return get_image_cache().file_image(path, policy=IMAGE_POLICY)
 
 
-def answer(question: str, image: Optional[Image.Image], system_msg: str) -> str:
-    if not question and image is None:
-        return "Please provide a question and/or upload an image."
+def _new_session() -> List[Dict[str, Any]]:
+    return VisionConversation.new(SYSTEM_DEFAULT).messages
 
-    content: List[Dict[str, Any]] = []
-    if question:
-        content.append({"type": "text", "text": question})
-    if image is not None:
-        content.append({"type": "image_url", "image_url": {"url": _to_data_url(image)}})
 
-    try:
-        resp = openai_client.chat.completions.create(
-            model=MODEL_DEPLOYMENT,
-            messages=[
-                {"role": "system", "content": system_msg or SYSTEM_DEFAULT},
-                {"role": "user", "content": content or [{"type": "text", "text": question}]},
-            ],
+async def _describe(session_id: str, deployment: str, conversation: VisionConversation) -> None:
+    # Once a newer image is in use, older ones are sent as text: the model describes each one once
+    for ref in conversation.undescribed():
+        try:
+            prepared = await asyncio.to_thread(_prepare, ref)
+        except FileNotFoundError:
+            conversation.describe(ref, "the image file is no longer available")
+            continue
+        description = await BACKEND.complete(
+            session_id, deployment, describe_messages(prepared.part()), operation="vision-describe",
+            hold_session=False,
         )
-        return resp.choices[0].message.content
+        conversation.describe(ref, description)
+
+
+async def answer(question: str, image: Optional[str], system_msg: str, request: gr.Request):
+    if not question and image is None:
+        gr.Warning("Please provide a question and/or upload an image.")
+        return gr.update(), gr.update()
+
+    session_id = request.session_hash
+    deployment = _load_settings()[1]
+    # Work on a copy; the store only sees the turn once it has finished
+    conversation = VisionConversation(copy.deepcopy(SESSIONS.get(session_id, _new_session)))
+    conversation.set_system(system_msg or SYSTEM_DEFAULT)
+    # The upload stays in the box between questions; it is only a new image when it changes
+    conversation.add_user(question, image if image != conversation.active else None)
+    info = ""
+    try:
+        # Take the session first: a double submit must not pay for describing images
+        async with BACKEND.session(session_id):
+            await _describe(session_id, deployment, conversation)
+            prepared = None
+            if conversation.active is not None:
+                # Resizing and encoding is CPU work, keep it off the event loop
+                prepared = await asyncio.to_thread(_prepare, conversation.active)
+            messages = conversation.build(lambda ref: prepared.part())
+            reply = await BACKEND.complete(session_id, deployment, messages, operation="vision", hold_session=False)
+            request_bytes, image_bytes = payload_sizes(messages)
+            info = (f"request {request_bytes / 1024:.0f} kB (image {image_bytes / 1024:.0f} kB) · "
+                    f"{len(conversation.refs())} image(s) in the conversation")
+            if prepared is not None and prepared.report is not None:
+                info += f"\n\n{prepared.report}"
+    except SessionBusyError as e:
+        gr.Warning(str(e))
+        return gr.update(), gr.update()
     except Exception as e:
-        return f"Error: {e}"
+        reply = f"Error: {e}"
+    conversation.add_assistant(reply)
+    SESSIONS.put(session_id, conversation.messages)
+    return conversation.chat_history(), info
 
 
-with gr.Blocks(css="footer {visibility: hidden}") as demo:
-    gr.Markdown("# Develop a Vision-Enabled Chat App (LevelUp Project)")
-    gr.Markdown("Upload an image and ask a question. Uses your configured model deployment via Azure AI Projects.")
+def reset_chat(system_msg: str, request: gr.Request):
+    SESSIONS.put(request.session_hash, VisionConversation.new(system_msg or SYSTEM_DEFAULT).messages)
+    return [], "", None
 
-    with gr.Row():
-        image = gr.Image(type="pil", label="Upload image (optional)")
-        with gr.Column():
-            system_box = gr.Textbox(label="System message", value=SYSTEM_DEFAULT, lines=3)
-            question = gr.Textbox(label="Your question", placeholder="e.g., What fruit is this? Is it ripe?")
 
-    ask = gr.Button("Ask")
-    output = gr.Markdown()
+def backend_status() -> str:
+    return f"{BACKEND.stats().to_markdown()}\n\n{get_image_cache().stats}\n\n{SESSIONS.to_markdown()}"
 
-    ask.click(answer, inputs=[question, image, system_box], outputs=[output])
+
+with gr.Blocks(css="footer {visibility: hidden}") as demo:
+    gr.Markdown("# Develop a Vision-Enabled Chat App (LevelUp Project)")
+    gr.Markdown("Upload an image and ask questions about it; follow-up questions keep the conversation. "
+                "Uses your configured model deployment via Azure AI Projects.")
+
+    with gr.Tab("Ask"):
+        with gr.Row():
+            # A file path, not a PIL image: Gradio then keeps the uploaded bytes instead of decoding them
+            image = gr.Image(type="filepath", image_mode=None, label="Upload image (optional)")
+            with gr.Column():
+                system_box = gr.Textbox(label="System message", value=SYSTEM_DEFAULT, lines=3)
+                question = gr.Textbox(label="Your question", placeholder="e.g., What fruit is this? Is it ripe?")
+
+        with gr.Row():
+            clear = gr.Button("New conversation")
+            ask = gr.Button("Ask", variant="primary")
+        chatbot = gr.Chatbot(type="messages", height=480, label="Conversation")
+        request_info = gr.Markdown()
+
+        ask.click(answer, inputs=[question, image, system_box], outputs=[chatbot, request_info])
+        question.submit(answer, inputs=[question, image, system_box], outputs=[chatbot, request_info])
+        clear.click(reset_chat, inputs=[system_box], outputs=[chatbot, request_info, image])
+
+        with gr.Accordion("Backend status", open=False):
+            status_md = gr.Markdown()
+            refresh_btn = gr.Button("Refresh")
+        refresh_btn.click(backend_status, outputs=[status_md])
+
+    if stats_tab_enabled():
+        with gr.Tab("Stats"):
+            stats_panel()
+
+demo.queue(default_concurrency_limit=None)
 
 if __name__ == "__main__":
     demo.launch()
@@ -0,0 +1,212 @@
+"""Shared Azure OpenAI clients on one pooled HTTP transport.
+
+Every entry point used to build its own client, and with it its own HTTP
+connection pool, so each app paid for fresh TLS handshakes. This module owns
+a single keep-alive pool (sync and async) and hands out cached clients per
+endpoint / deployment / api-version.
+
+``AIProjectClient.get_openai_client`` cannot be given an HTTP client, so for
+project endpoints we build the ``AzureOpenAI`` client ourselves the same way
+it does: the inference endpoint is the scheme and host of the project
+endpoint, and the token comes from the shared, cached credential.
+
+Pool settings (``.env``):
+
+* ``HTTP_MAX_CONNECTIONS`` (100) and ``HTTP_MAX_KEEPALIVE`` (20)
+* ``HTTP_KEEPALIVE_EXPIRY`` seconds (30)
+* ``HTTP_CONNECT_TIMEOUT`` (5) and ``HTTP_READ_TIMEOUT`` (120) seconds
+* ``HTTP2`` – ``auto`` (default, on when the ``h2`` package is installed), ``1`` or ``0``
+
+For local runs against a stand-in server (see ``benchmarks/mock_server.py``)
+``AOAI_ENDPOINT_OVERRIDE`` replaces every endpoint and ``AOAI_API_KEY``
+authenticates with a key instead of Entra ID, so no Azure sign-in happens.
+"""
+import asyncio
+import os
+import threading
+from dataclasses import dataclass
+from typing import Any, Dict, Optional, Tuple
+from urllib.parse import urlsplit
+
+DEFAULT_API_VERSION = "2024-10-21"
+TOKEN_SCOPE = "https://cognitiveservices.azure.com/.default"
+
+_lock = threading.RLock()
+_clients: Dict[Tuple[Any, ...], Any] = {}
+_shared: Dict[str, Any] = {}
+
+
+@dataclass(frozen=True)
+class PoolSettings:
+    max_connections: int = 100
+    max_keepalive: int = 20
+    keepalive_expiry: float = 30.0
+    connect_timeout: float = 5.0
+    read_timeout: float = 120.0
+    http2: bool = False
+
+    @classmethod
+    def from_env(cls) -> "PoolSettings":
+        http2 = os.getenv("HTTP2", "auto").strip().lower()
+        return cls(
+            max_connections=int(os.getenv("HTTP_MAX_CONNECTIONS", "100")),
+            max_keepalive=int(os.getenv("HTTP_MAX_KEEPALIVE", "20")),
+            keepalive_expiry=float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "30")),
+            connect_timeout=float(os.getenv("HTTP_CONNECT_TIMEOUT", "5")),
+            read_timeout=float(os.getenv("HTTP_READ_TIMEOUT", "120")),
+            http2=_h2_available() if http2 == "auto" else http2 in {"1", "true", "yes", "on"},
+        )
+
+    def httpx_kwargs(self) -> Dict[str, Any]:
+        import httpx
+
+        return {
+            "limits": httpx.Limits(
+                max_connections=self.max_connections,
+                max_keepalive_connections=self.max_keepalive,
+                keepalive_expiry=self.keepalive_expiry,
+            ),
+            "timeout": httpx.Timeout(self.read_timeout, connect=self.connect_timeout),
+            "http2": self.http2,
+        }
+
+
+def _h2_available() -> bool:
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+def _shared_value(name: str, factory):
+    with _lock:
+        if name not in _shared:
+            _shared[name] = factory()
+        return _shared[name]
+
+
+def pool_settings() -> PoolSettings:
+    return _shared_value("settings", PoolSettings.from_env)
+
+
+def http_client():
+    """The process-wide ``httpx.Client`` every sync OpenAI client uses."""
+    import httpx
+
+    return _shared_value("http", lambda: httpx.Client(**pool_settings().httpx_kwargs()))
+
+
+def _async_http_client():
+    import httpx
+
+    # An AsyncClient belongs to the event loop it first runs on
+    loop = asyncio.get_running_loop()
+    return _shared_value(f"async-http-{id(loop)}", lambda: httpx.AsyncClient(**pool_settings().httpx_kwargs()))
+
+
+def credential():
+    """``DefaultAzureCredential`` behind the shared token cache (see credentials.py)."""
+    from azure.identity import DefaultAzureCredential
+    from credentials import CachedTokenCredential, default_cache_path
+
+    return _shared_value("credential", lambda: CachedTokenCredential(
+        DefaultAzureCredential(
+            exclude_environment_credential=True,
+            exclude_managed_identity_credential=True,
+        ),
+        cache_path=default_cache_path(),
+    ))
+
+
+def _async_credential():
+    from credentials import AsyncCachedTokenCredential
+
+    # Same cache as the sync clients, so both share one token per scope
+    return _shared_value("async-credential", lambda: AsyncCachedTokenCredential(credential()))
+
+
+def project_inference_endpoint(project_endpoint: str) -> str:
+    """``https://<host>/api/projects/<name>`` -> ``https://<host>``"""
+    parts = urlsplit(project_endpoint)
+    return f"{parts.scheme}://{parts.netloc}"
+
+
+def _endpoint(azure_endpoint: str) -> str:
+    return os.getenv("AOAI_ENDPOINT_OVERRIDE") or azure_endpoint
+
+
+def get_azure_openai_client(azure_endpoint: str,
+                            deployment: Optional[str] = None,
+                            api_version: str = DEFAULT_API_VERSION):
+    """Cached ``AzureOpenAI`` client for an Azure OpenAI / AI Services endpoint."""
+    azure_endpoint = _endpoint(azure_endpoint)
+    key = ("sync", azure_endpoint, deployment, api_version)
+    with _lock:
+        client = _clients.get(key)
+    if client is not None:
+        return client
+
+    from openai import AzureOpenAI
+
+    api_key = os.getenv("AOAI_API_KEY")
+    if api_key:
+        auth: Dict[str, Any] = {"api_key": api_key}
+    else:
+        from azure.identity import get_bearer_token_provider
+
+        auth = {"azure_ad_token_provider": get_bearer_token_provider(credential(), TOKEN_SCOPE)}
+    client = AzureOpenAI(
+        api_version=api_version,
+        azure_endpoint=azure_endpoint,
+        http_client=http_client(),
+        max_retries=0,  # retries are done by ratelimit.py
+        **auth,
+    )
+    with _lock:
+        return _clients.setdefault(key, client)
+
+
+def get_project_openai_client(project_endpoint: str,
+                              deployment: Optional[str] = None,
+                              api_version: str = DEFAULT_API_VERSION):
+    """Cached client for the models deployed in an AI Foundry project."""
+    return get_azure_openai_client(project_inference_endpoint(project_endpoint), deployment, api_version)
+
+
+async def get_async_azure_openai_client(azure_endpoint: str,
+                                        deployment: Optional[str] = None,
+                                        api_version: str = DEFAULT_API_VERSION):
+    """Cached ``AsyncAzureOpenAI`` client, one per event loop."""
+    loop = asyncio.get_running_loop()
+    azure_endpoint = _endpoint(azure_endpoint)
+    key = ("async", id(loop), azure_endpoint, deployment, api_version)
+    with _lock:
+        client = _clients.get(key)
+    if client is not None:
+        return client
+
+    from openai import AsyncAzureOpenAI
+
+    api_key = os.getenv("AOAI_API_KEY")
+    if api_key:
+        auth: Dict[str, Any] = {"api_key": api_key}
+    else:
+        from azure.identity.aio import get_bearer_token_provider
+
+        auth = {"azure_ad_token_provider": get_bearer_token_provider(_async_credential(), TOKEN_SCOPE)}
+    client = AsyncAzureOpenAI(
+        api_version=api_version,
+        azure_endpoint=azure_endpoint,
+        http_client=_async_http_client(),
+        max_retries=0,
+        **auth,
+    )
+    with _lock:
+        return _clients.setdefault(key, client)
+
+
+async def get_async_project_openai_client(project_endpoint: str,
+                                          deployment: Optional[str] = None,
+                                          api_version: str = DEFAULT_API_VERSION):
+    return await get_async_azure_openai_client(project_inference_endpoint(project_endpoint), deployment, api_version)
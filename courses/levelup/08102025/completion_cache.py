@@ -0,0 +1,145 @@
+"""Opt-in cache of chat completions.
+
+A support deployment answers the same few questions over and over; each one
+used to cost a full model round trip. ``CompletionCache`` maps a canonical
+hash of (deployment, messages incl. the system message, sampling params) to
+the answer, with two tiers:
+
+* an in-memory LRU (``CHAT_CACHE_MEMORY_ENTRIES``, default 512),
+* a SQLite file with a TTL and a row cap (``CHAT_CACHE_PATH``,
+  ``CHAT_CACHE_TTL`` seconds, ``CHAT_CACHE_MAX_ENTRIES``).
+
+Enable it with ``CHAT_CACHE=1`` in ``.env``. Only successful answers are
+stored; hits and misses are counted per tier.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+DEFAULT_PATH = Path.home() / ".cache" / "levelup" / "completions.sqlite"
+
+
+@dataclass
+class CacheStats:
+    memory_hits: int = 0
+    disk_hits: int = 0
+    misses: int = 0
+
+    @property
+    def hits(self) -> int:
+        return self.memory_hits + self.disk_hits
+
+    def __str__(self) -> str:
+        total = self.hits + self.misses
+        rate = f"{100 * self.hits / total:.0f}%" if total else "n/a"
+        return f"cache hits: {self.hits} (memory {self.memory_hits}, disk {self.disk_hits}), misses: {self.misses}, hit rate: {rate}"
+
+
+def _normalize(message: Dict[str, Any]) -> Dict[str, Any]:
+    content = message.get("content")
+    if isinstance(content, str):
+        content = " ".join(content.split())
+    normalized = {k: v for k, v in message.items() if not k.startswith("_")}
+    normalized["content"] = content
+    return normalized
+
+
+def cache_key(deployment: str, messages: List[Dict[str, Any]], **params: Any) -> str:
+    """Canonical hash of a request; whitespace and key order do not matter."""
+    canonical = json.dumps(
+        {"deployment": deployment, "messages": [_normalize(m) for m in messages], "params": params},
+        sort_keys=True,
+        separators=(",", ":"),
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class CompletionCache:
+    def __init__(self,
+                 path: Optional[Path] = DEFAULT_PATH,
+                 memory_entries: int = 512,
+                 ttl: float = 24 * 3600,
+                 max_entries: int = 10_000):
+        self.memory_entries = memory_entries
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.stats = CacheStats()
+        self._memory: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+        if path is not None:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            self._db = sqlite3.connect(str(path), check_same_thread=False, isolation_level=None)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS completions ("
+                " key TEXT PRIMARY KEY, answer TEXT NOT NULL,"
+                " created REAL NOT NULL, last_access REAL NOT NULL)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS completions_last_access ON completions(last_access)")
+
+    @classmethod
+    def from_env(cls) -> Optional["CompletionCache"]:
+        """The cache configured in ``.env``, or None when ``CHAT_CACHE`` is off."""
+        if os.getenv("CHAT_CACHE", "0").strip().lower() not in {"1", "true", "yes", "on"}:
+            return None
+        path = os.getenv("CHAT_CACHE_PATH")
+        return cls(
+            path=Path(path).expanduser() if path else DEFAULT_PATH,
+            memory_entries=int(os.getenv("CHAT_CACHE_MEMORY_ENTRIES", "512")),
+            ttl=float(os.getenv("CHAT_CACHE_TTL", str(24 * 3600))),
+            max_entries=int(os.getenv("CHAT_CACHE_MAX_ENTRIES", "10000")),
+        )
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None and now - entry[1] < self.ttl:
+                self._memory.move_to_end(key)
+                self.stats.memory_hits += 1
+                return entry[0]
+            if self._db is not None:
+                row = self._db.execute(
+                    "SELECT answer, created FROM completions WHERE key = ? AND created > ?",
+                    (key, now - self.ttl),
+                ).fetchone()
+                if row is not None:
+                    self._db.execute("UPDATE completions SET last_access = ? WHERE key = ?", (now, key))
+                    self._remember(key, row[0], row[1])
+                    self.stats.disk_hits += 1
+                    return row[0]
+            self.stats.misses += 1
+            return None
+
+    def put(self, key: str, answer: str) -> None:
+        now = time.time()
+        with self._lock:
+            self._remember(key, answer, now)
+            if self._db is None:
+                return
+            self._db.execute(
+                "INSERT OR REPLACE INTO completions (key, answer, created, last_access) VALUES (?, ?, ?, ?)",
+                (key, answer, now, now),
+            )
+            self._db.execute("DELETE FROM completions WHERE created <= ?", (now - self.ttl,))
+            # Keep the most recently used rows under the cap
+            self._db.execute(
+                "DELETE FROM completions WHERE key IN ("
+                " SELECT key FROM completions ORDER BY last_access DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+
+    def _remember(self, key: str, answer: str, created: float) -> None:
+        self._memory[key] = (answer, created)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
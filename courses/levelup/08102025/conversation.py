@@ -0,0 +1,223 @@
+"""Token-budgeted conversation window with a rolling summary.
+
+Without a window every request resends the whole conversation, so the
+tokens sent grow quadratically over a session until the model's context
+limit is hit. ``ConversationWindow.prepare`` keeps the message list small:
+
+* the system message is always kept,
+* the most recent turns are kept while they fit in ``budget_tokens``,
+* older turns are evicted and folded into a single summary message that
+  is updated incrementally (only the newly evicted turns are summarized).
+
+The summary message lives in the same list as the other messages. It is
+marked with private ``_``-prefixed keys, which ``prepare`` strips from the
+payload it returns, so always send the payload and keep the list as state.
+
+Token counts are estimated offline: with ``tiktoken`` when it is installed,
+otherwise with a simple word/punctuation heuristic.
+"""
+import os
+import re
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+Message = Dict[str, Any]
+Summarizer = Callable[[str, List[Message]], str]
+
+SUMMARY_PREFIX = "Summary of the earlier conversation:\n"
+IMAGE_TOKENS_ESTIMATE = 85   # a low-detail image; enough for budgeting
+MESSAGE_OVERHEAD_TOKENS = 4  # role and separators added by the chat format
+
+_WORD_RE = re.compile(r"\w+|[^\w\s]", re.UNICODE)
+
+
+_encoding: Any = False  # False = not loaded yet, None = tiktoken unavailable
+
+
+def _get_encoding():
+    # Loaded on first use: importing tiktoken is slow and not needed at startup
+    global _encoding
+    if _encoding is False:
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding("o200k_base")
+        except Exception:
+            _encoding = None
+    return _encoding
+
+
+def count_text_tokens(text: str) -> int:
+    if not text:
+        return 0
+    encoding = _get_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text))
+    # Heuristic: one token per short word or punctuation mark, long words
+    # are split roughly every 4 characters.
+    return sum(1 + (len(piece) - 1) // 4 for piece in _WORD_RE.findall(text))
+
+
+def message_text(message: Message) -> str:
+    content = message.get("content") or ""
+    if isinstance(content, str):
+        return content
+    return " ".join(part.get("text", "") for part in content if part.get("type") == "text")
+
+
+def count_message_tokens(message: Message) -> int:
+    tokens = MESSAGE_OVERHEAD_TOKENS + count_text_tokens(message_text(message))
+    content = message.get("content")
+    if isinstance(content, list):
+        tokens += IMAGE_TOKENS_ESTIMATE * sum(1 for part in content if part.get("type") == "image_url")
+    return tokens
+
+
+def count_tokens(messages: List[Message]) -> int:
+    return sum(count_message_tokens(m) for m in messages)
+
+
+def strip_private(messages: List[Message]) -> List[Message]:
+    """Return the messages without the ``_``-prefixed bookkeeping keys."""
+    return [{k: v for k, v in m.items() if not k.startswith("_")} for m in messages]
+
+
+def extractive_summarizer(previous: str, evicted: List[Message], max_chars: int = 1500) -> str:
+    """Summarizer that needs no model call: keeps the start of each evicted message."""
+    lines = [previous] if previous else []
+    for message in evicted:
+        text = " ".join(message_text(message).split())
+        if len(text) > 160:
+            text = text[:160] + "…"
+        lines.append(f"{message['role']}: {text}")
+    summary = "\n".join(lines)
+    return summary[-max_chars:]
+
+
+class ModelSummarizer:
+    """Folds evicted turns into the running summary with one chat completion."""
+
+    INSTRUCTIONS = (
+        "You maintain a running summary of a conversation between a user and an assistant. "
+        "Update the summary with the new messages. Keep facts, names, decisions and open "
+        "questions; drop small talk. Answer with the updated summary only, at most 200 words."
+    )
+
+    def __init__(self, client: Any, model: str):
+        self.client = client
+        self.model = model
+
+    def __call__(self, previous: str, evicted: List[Message]) -> str:
+        from ratelimit import estimate_tokens, get_limiter
+        from telemetry import track
+
+        transcript = "\n".join(f"{m['role']}: {message_text(m)}" for m in evicted)
+        messages = [
+            {"role": "system", "content": self.INSTRUCTIONS},
+            {"role": "user", "content": f"Current summary:\n{previous or '(none)'}\n\nNew messages:\n{transcript}"},
+        ]
+        try:
+            with track("summary", self.model, messages) as call:
+                resp = get_limiter().call(
+                    self.model,
+                    lambda: self.client.chat.completions.create(model=self.model, messages=messages),
+                    estimate_tokens(messages, completion_tokens=300),
+                )
+                call.usage(resp.usage)
+            return (resp.choices[0].message.content or "").strip()
+        except Exception:
+            # A failed summary must not fail the user's turn
+            return extractive_summarizer(previous, evicted)
+
+
+@dataclass
+class TurnMetrics:
+    sent_tokens: int       # prompt tokens actually sent this turn
+    full_tokens: int       # prompt tokens the full, unwindowed history would cost
+    summary_tokens: int
+    evicted_messages: int  # messages folded into the summary this turn
+
+    @property
+    def saved_tokens(self) -> int:
+        return max(self.full_tokens - self.sent_tokens, 0)
+
+    def __str__(self) -> str:
+        return (f"prompt tokens: {self.sent_tokens} "
+                f"(full history: {self.full_tokens}, saved: {self.saved_tokens})")
+
+
+class ConversationWindow:
+    def __init__(self,
+                 budget_tokens: int = 6000,
+                 keep_recent: int = 2,
+                 low_water: float = 0.75,
+                 summarizer: Optional[Summarizer] = None):
+        """
+        ``budget_tokens`` caps the prompt size. When it is exceeded, turns are
+        evicted until the prompt is below ``low_water * budget_tokens`` so the
+        summarizer runs once per batch of turns, not on every message. The last
+        ``keep_recent`` turns (a user message and its reply) are never evicted;
+        at least 1, so the message being answered is never summarized away.
+        """
+        if keep_recent < 1:
+            raise ValueError(f"keep_recent (CHAT_KEEP_RECENT) must be at least 1, not {keep_recent}")
+        self.budget_tokens = budget_tokens
+        self.keep_recent = keep_recent
+        self.low_water = low_water
+        self.summarizer = summarizer or extractive_summarizer
+
+    @classmethod
+    def from_env(cls, summarizer: Optional[Summarizer] = None) -> "ConversationWindow":
+        return cls(
+            budget_tokens=int(os.getenv("CHAT_CONTEXT_BUDGET", "6000")),
+            keep_recent=int(os.getenv("CHAT_KEEP_RECENT", "2")),
+            summarizer=summarizer,
+        )
+
+    def prepare(self, messages: List[Message]) -> Tuple[List[Message], TurnMetrics]:
+        """Compact ``messages`` in place and return (request payload, metrics)."""
+        start = 1 if messages and messages[0].get("role") == "system" else 0
+        summary = messages[start] if len(messages) > start and messages[start].get("_summary") else None
+        first_turn = start + (1 if summary is not None else 0)
+
+        counts = [count_message_tokens(m) for m in messages]
+        total = sum(counts)
+        evict_upto = first_turn
+        if total > self.budget_tokens:
+            target = int(self.budget_tokens * self.low_water)
+            # The last ``keep_recent`` turns are kept whatever their size
+            user_turns = [i for i in range(first_turn, len(messages)) if messages[i].get("role") == "user"]
+            boundary = user_turns[-self.keep_recent] if len(user_turns) >= self.keep_recent else first_turn
+            while evict_upto < boundary and total > target:
+                total -= counts[evict_upto]
+                evict_upto += 1
+            # Never start the window with an orphaned assistant reply
+            while evict_upto < boundary and messages[evict_upto].get("role") != "user":
+                total -= counts[evict_upto]
+                evict_upto += 1
+
+        evicted = messages[first_turn:evict_upto]
+        if evicted:
+            evicted_tokens = sum(counts[first_turn:evict_upto])
+            previous = summary["_text"] if summary is not None else ""
+            text = self.summarizer(previous, evicted)
+            if summary is None:
+                summary = {"role": "system", "_summary": True, "_evicted_tokens": 0}
+                messages.insert(start, summary)
+                first_turn += 1
+                evict_upto += 1
+            summary["_text"] = text
+            summary["content"] = SUMMARY_PREFIX + text
+            summary["_evicted_tokens"] += evicted_tokens
+            del messages[first_turn:evict_upto]
+
+        payload = strip_private(messages)
+        sent = count_tokens(payload)
+        summary_tokens = count_message_tokens(summary) if summary is not None else 0
+        evicted_total = summary["_evicted_tokens"] if summary is not None else 0
+        metrics = TurnMetrics(
+            sent_tokens=sent,
+            full_tokens=sent - summary_tokens + evicted_total,
+            summary_tokens=summary_tokens,
+            evicted_messages=len(evicted),
+        )
+        return payload, metrics
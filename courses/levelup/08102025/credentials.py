@@ -0,0 +1,224 @@
+"""Token caching wrapper for Azure credentials.
+
+``DefaultAzureCredential`` usually ends up on the Azure CLI / developer
+credential here, which starts a subprocess and takes seconds per token, at
+startup and again whenever the token expires in the middle of traffic.
+
+``CachedTokenCredential`` wraps any credential with a ``get_token`` method:
+
+* tokens are kept in memory and in a JSON file readable only by the owner
+  (``~/.cache/levelup/azure-tokens.json``), so other processes and the next
+  start reuse them; writes are atomic and, on POSIX, guarded by a file lock,
+* a daemon thread refreshes each token ``refresh_margin`` seconds before it
+  expires, so request paths only wait for a token on a cold start.
+
+``AZURE_TOKEN_CACHE`` sets the cache file; ``AZURE_TOKEN_CACHE=0`` keeps the
+cache in memory only. The inner credential and the clock are injectable, so
+the wrapper can be exercised with a fake credential.
+"""
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, Optional, Tuple
+
+from azure.core.credentials import AccessToken
+
+try:
+    import fcntl
+except ImportError:  # Windows: atomic replace only, no cross-process lock
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_PATH = Path.home() / ".cache" / "levelup" / "azure-tokens.json"
+MIN_VALIDITY = 60  # never hand out a token that expires within a minute
+RETRY_DELAY = 30   # wait before retrying a failed background refresh
+
+
+def default_cache_path() -> Optional[Path]:
+    value = os.getenv("AZURE_TOKEN_CACHE", "")
+    if value.strip().lower() in {"0", "off", "false", "no"}:
+        return None
+    return Path(value).expanduser() if value else DEFAULT_CACHE_PATH
+
+
+class TokenFileCache:
+    """Tokens by scope key in one owner-only JSON file, shared across processes."""
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._lock_path = path.with_suffix(path.suffix + ".lock")
+
+    @contextmanager
+    def _locked(self) -> Iterator[None]:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        if fcntl is None:
+            yield
+            return
+        fd = os.open(self._lock_path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            yield
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+            os.close(fd)
+
+    def _read(self) -> Dict[str, Dict[str, Any]]:
+        try:
+            return json.loads(self.path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return {}
+
+    def load(self, key: str) -> Optional[AccessToken]:
+        entry = self._read().get(key)
+        if not entry:
+            return None
+        return AccessToken(entry["token"], int(entry["expires_on"]))
+
+    def store(self, key: str, token: AccessToken, now: float) -> None:
+        with self._locked():
+            data = {k: v for k, v in self._read().items() if v.get("expires_on", 0) > now}
+            data[key] = {"token": token.token, "expires_on": token.expires_on}
+            tmp = self.path.with_suffix(f".{os.getpid()}.tmp")
+            fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(data, f)
+            os.replace(tmp, self.path)
+
+
+class CachedTokenCredential:
+    def __init__(self,
+                 inner: Any,
+                 cache_path: Optional[Path] = None,
+                 refresh_margin: float = 300,
+                 background_refresh: bool = True,
+                 clock: Callable[[], float] = time.time):
+        self.inner = inner
+        self.refresh_margin = refresh_margin
+        self.background_refresh = background_refresh
+        self._clock = clock
+        self._file = TokenFileCache(cache_path) if cache_path else None
+        self._tokens: Dict[str, AccessToken] = {}
+        self._requests: Dict[str, Tuple[Tuple[str, ...], Dict[str, Any]]] = {}
+        self._lock = threading.Lock()
+        self._key_locks: Dict[str, threading.Lock] = {}
+        self._wake = threading.Event()
+        self._stopped = False
+        self._thread: Optional[threading.Thread] = None
+
+    @staticmethod
+    def _key(scopes: Tuple[str, ...], kwargs: Dict[str, Any]) -> str:
+        tenant = kwargs.get("tenant_id") or ""
+        return f"{tenant}|{' '.join(sorted(scopes))}"
+
+    def _fresh(self, token: Optional[AccessToken], margin: float = MIN_VALIDITY) -> bool:
+        return token is not None and token.expires_on - self._clock() > margin
+
+    def get_token(self, *scopes: str, claims: Optional[str] = None, **kwargs: Any) -> AccessToken:
+        if claims:
+            # A claims challenge needs a brand new token, never a cached one
+            return self.inner.get_token(*scopes, claims=claims, **kwargs)
+        key = self._key(scopes, kwargs)
+        token = self._tokens.get(key)
+        if self._fresh(token):
+            return token
+
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+        with key_lock:
+            token = self._tokens.get(key)
+            if not self._fresh(token) and self._file is not None:
+                token = self._file.load(key)
+            if not self._fresh(token):
+                token = self._acquire(key, scopes, kwargs)
+            self._remember(key, scopes, kwargs, token)
+        return token
+
+    def _acquire(self, key: str, scopes: Tuple[str, ...], kwargs: Dict[str, Any]) -> AccessToken:
+        token = self.inner.get_token(*scopes, **kwargs)
+        if self._file is not None:
+            try:
+                self._file.store(key, token, self._clock())
+            except OSError as e:
+                logger.warning("Could not write token cache %s: %s", self._file.path, e)
+        return token
+
+    def _remember(self, key: str, scopes: Tuple[str, ...], kwargs: Dict[str, Any], token: AccessToken) -> None:
+        self._tokens[key] = token
+        self._requests[key] = (scopes, dict(kwargs))
+        if self.background_refresh and self._thread is None and not self._stopped:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._refresh_loop, name="token-refresh", daemon=True)
+                    self._thread.start()
+        self._wake.set()
+
+    def _refresh_loop(self) -> None:
+        while not self._stopped:
+            delay = 3600.0
+            for key, token in list(self._tokens.items()):
+                due = token.expires_on - self.refresh_margin - self._clock()
+                if due > 0:
+                    delay = min(delay, due)
+                    continue
+                scopes, kwargs = self._requests[key]
+                try:
+                    with self._key_locks[key]:
+                        # Another process may already have refreshed it
+                        token = self._file.load(key) if self._file is not None else None
+                        if not self._fresh(token, self.refresh_margin):
+                            token = self._acquire(key, scopes, kwargs)
+                        self._tokens[key] = token
+                    # Wake up again before the new token is due, not after the default hour
+                    # (a token that is due at once is retried like a failure, not in a tight loop)
+                    delay = min(delay, max(token.expires_on - self.refresh_margin - self._clock(), RETRY_DELAY))
+                except Exception as e:
+                    logger.warning("Background token refresh failed, retrying in %ss: %s", RETRY_DELAY, e)
+                    delay = min(delay, RETRY_DELAY)
+            self._wake.wait(timeout=max(delay, 1.0))
+            self._wake.clear()
+
+    def close(self) -> None:
+        self._stopped = True
+        self._wake.set()
+        close = getattr(self.inner, "close", None)
+        if close is not None:
+            close()
+
+    def __enter__(self) -> "CachedTokenCredential":
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self.close()
+
+
+class AsyncCachedTokenCredential:
+    """Async face of a ``CachedTokenCredential`` for the ``AsyncAzureOpenAI`` clients.
+
+    A cached token is returned without leaving the event loop; a cold
+    acquisition runs in a worker thread.
+    """
+
+    def __init__(self, cached: CachedTokenCredential):
+        self.cached = cached
+
+    async def get_token(self, *scopes: str, **kwargs: Any) -> AccessToken:
+        token = self.cached._tokens.get(self.cached._key(scopes, kwargs))
+        if not kwargs.get("claims") and self.cached._fresh(token):
+            return token
+        return await asyncio.to_thread(self.cached.get_token, *scopes, **kwargs)
+
+    async def close(self) -> None:
+        # The sync credential is shared with the sync clients; it is closed there
+        pass
+
+    async def __aenter__(self) -> "AsyncCachedTokenCredential":
+        return self
+
+    async def __aexit__(self, *exc: Any) -> None:
+        await self.close()
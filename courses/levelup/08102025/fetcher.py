@@ -0,0 +1,270 @@
+"""Shared, bounded HTTP fetcher for images referenced by URL.
+
+``urlopen(url).read()`` and ``requests.get(url).content`` have no timeout,
+open a new connection every time and read whatever the server sends, so
+one slow or huge URL could hold a worker forever. ``Fetcher`` instead:
+
+* keeps one keep-alive pool (``httpx``, sync and one async client per event
+  loop), separate from the Azure OpenAI pool in clients.py,
+* applies a connect and a per-read timeout and an overall deadline, so a
+  server dripping one byte at a time is cut off as well,
+* streams the body and aborts as soon as it passes the size limit (checked
+  against ``Content-Length`` first, when there is one),
+* sends ``If-None-Match`` / ``If-Modified-Since`` when asked and reports a
+  ``304`` instead of a body,
+* can stream straight into a file (``download``).
+
+Settings (``.env``): ``FETCH_CONNECT_TIMEOUT`` (5 s), ``FETCH_READ_TIMEOUT``
+(15 s), ``FETCH_TOTAL_TIMEOUT`` (60 s), ``FETCH_MAX_MB`` (20) and
+``FETCH_MAX_CONNECTIONS`` (20).
+"""
+import asyncio
+import os
+import threading
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Callable, Dict, Mapping, Optional
+
+USER_AGENT = "Mozilla/5.0"
+CHUNK = 64 * 1024
+
+
+class FetchTooLargeError(ValueError):
+    pass
+
+
+@dataclass(frozen=True)
+class FetchSettings:
+    connect_timeout: float = 5.0
+    read_timeout: float = 15.0
+    total_timeout: float = 60.0
+    max_bytes: int = 20 * 1024 * 1024
+    max_connections: int = 20
+
+    @classmethod
+    def from_env(cls) -> "FetchSettings":
+        return cls(
+            connect_timeout=float(os.getenv("FETCH_CONNECT_TIMEOUT", "5")),
+            read_timeout=float(os.getenv("FETCH_READ_TIMEOUT", "15")),
+            total_timeout=float(os.getenv("FETCH_TOTAL_TIMEOUT", "60")),
+            max_bytes=int(float(os.getenv("FETCH_MAX_MB", "20")) * 1024 * 1024),
+            max_connections=int(os.getenv("FETCH_MAX_CONNECTIONS", "20")),
+        )
+
+    def httpx_kwargs(self) -> Dict[str, Any]:
+        import httpx
+
+        return {
+            "limits": httpx.Limits(max_connections=self.max_connections, max_keepalive_connections=self.max_connections),
+            "timeout": httpx.Timeout(self.read_timeout, connect=self.connect_timeout),
+            "follow_redirects": True,
+            "headers": {"User-Agent": USER_AGENT},
+        }
+
+
+@dataclass
+class FetchResult:
+    url: str
+    status: int
+    content: bytes = b""
+    headers: Mapping[str, str] = field(default_factory=dict)
+
+    @property
+    def not_modified(self) -> bool:
+        return self.status == 304
+
+    @property
+    def content_type(self) -> str:
+        return (self.headers.get("Content-Type") or "").split(";")[0].strip()
+
+
+@dataclass
+class FetchStats:
+    requests: int = 0
+    not_modified: int = 0
+    bytes: int = 0
+    too_large: int = 0
+    timeouts: int = 0
+
+    def __str__(self) -> str:
+        return (f"fetches: {self.requests} ({self.not_modified} not modified), "
+                f"{self.bytes / 1024 / 1024:.1f} MB, aborted: {self.too_large} too large, {self.timeouts} timed out")
+
+
+def _mb(n: int) -> str:
+    return f"{n / 1024 / 1024:.1f} MB"
+
+
+class _Body:
+    """Counts streamed bytes against the size limit and the overall deadline."""
+
+    def __init__(self, fetcher: "Fetcher", url: str, limit: int, write: Callable[[bytes], Any]):
+        self.fetcher = fetcher
+        self.url = url
+        self.limit = limit
+        self.write = write
+        self.size = 0
+        self.deadline = time.monotonic() + fetcher.settings.total_timeout
+
+    def start(self, response: Any) -> None:
+        response.raise_for_status()
+        length = response.headers.get("Content-Length")
+        if length is not None and length.isdigit() and int(length) > self.limit:
+            self.fetcher._count("too_large")
+            raise FetchTooLargeError(f"{self.url} is {_mb(int(length))}, the limit is {_mb(self.limit)}")
+
+    def feed(self, chunk: bytes) -> None:
+        self.size += len(chunk)
+        if self.size > self.limit:
+            self.fetcher._count("too_large")
+            raise FetchTooLargeError(f"{self.url} is larger than {_mb(self.limit)}")
+        if time.monotonic() > self.deadline:
+            self.fetcher._count("timeouts")
+            raise TimeoutError(f"{self.url} took longer than {self.fetcher.settings.total_timeout:g}s")
+        self.write(chunk)
+
+
+class Fetcher:
+    def __init__(self, settings: Optional[FetchSettings] = None):
+        self.settings = settings or FetchSettings()
+        self.stats = FetchStats()
+        self._lock = threading.Lock()
+        self._client: Any = None
+        self._async_clients: Dict[int, Any] = {}
+
+    @classmethod
+    def from_env(cls) -> "Fetcher":
+        return cls(FetchSettings.from_env())
+
+    def _count(self, name: str, amount: int = 1) -> None:
+        with self._lock:
+            setattr(self.stats, name, getattr(self.stats, name) + amount)
+
+    def _sync_client(self) -> Any:
+        import httpx
+
+        with self._lock:
+            if self._client is None:
+                self._client = httpx.Client(**self.settings.httpx_kwargs())
+            return self._client
+
+    def _async_client(self) -> Any:
+        import httpx
+
+        # An AsyncClient belongs to the event loop it first runs on
+        loop = id(asyncio.get_running_loop())
+        with self._lock:
+            if loop not in self._async_clients:
+                self._async_clients[loop] = httpx.AsyncClient(**self.settings.httpx_kwargs())
+            return self._async_clients[loop]
+
+    @staticmethod
+    def _headers(etag: Optional[str], last_modified: Optional[str]) -> Dict[str, str]:
+        headers = {}
+        if etag:
+            headers["If-None-Match"] = etag
+        if last_modified:
+            headers["If-Modified-Since"] = last_modified
+        return headers
+
+    def _finish(self, url: str, response: Any, body: Optional[_Body], content: bytes = b"") -> FetchResult:
+        if body is None:
+            self._count("not_modified")
+            return FetchResult(url, 304, b"", response.headers)
+        self._count("bytes", body.size)
+        return FetchResult(url, response.status_code, content, response.headers)
+
+    # --- sync --------------------------------------------------------------
+
+    def get(self,
+            url: str,
+            etag: Optional[str] = None,
+            last_modified: Optional[str] = None,
+            max_bytes: Optional[int] = None) -> FetchResult:
+        """The body of ``url``, or a ``304`` result when the validators still match."""
+        buf = bytearray()
+        response, body = self._stream(url, self._headers(etag, last_modified), max_bytes, buf.extend)
+        return self._finish(url, response, body, bytes(buf))
+
+    def download(self, url: str, path: Path, max_bytes: Optional[int] = None) -> FetchResult:
+        """Stream ``url`` into ``path`` (written to a temporary name and renamed when complete)."""
+        path = Path(path)
+        tmp = path.with_name(f".{path.name}.part")
+        try:
+            with open(tmp, "wb") as f:
+                response, body = self._stream(url, {}, max_bytes, f.write)
+            os.replace(tmp, path)
+        finally:
+            tmp.unlink(missing_ok=True)
+        return self._finish(url, response, body)
+
+    def _stream(self, url: str, headers: Dict[str, str], max_bytes: Optional[int], write: Callable[[bytes], Any]):
+        import httpx
+
+        self._count("requests")
+        try:
+            with self._sync_client().stream("GET", url, headers=headers) as response:
+                if response.status_code == 304:
+                    return response, None
+                body = _Body(self, url, max_bytes or self.settings.max_bytes, write)
+                body.start(response)
+                for chunk in response.iter_bytes(CHUNK):
+                    body.feed(chunk)
+                return response, body
+        except httpx.TimeoutException as e:
+            self._count("timeouts")
+            raise TimeoutError(f"{url}: {type(e).__name__}") from e
+
+    # --- async -------------------------------------------------------------
+
+    async def aget(self,
+                   url: str,
+                   etag: Optional[str] = None,
+                   last_modified: Optional[str] = None,
+                   max_bytes: Optional[int] = None) -> FetchResult:
+        buf = bytearray()
+        response, body = await self._astream(url, self._headers(etag, last_modified), max_bytes, buf.extend)
+        return self._finish(url, response, body, bytes(buf))
+
+    async def adownload(self, url: str, path: Path, max_bytes: Optional[int] = None) -> FetchResult:
+        path = Path(path)
+        tmp = path.with_name(f".{path.name}.part")
+        try:
+            # Chunks are small; writing them from the event loop is cheaper than a thread per chunk
+            with open(tmp, "wb") as f:
+                response, body = await self._astream(url, {}, max_bytes, f.write)
+            os.replace(tmp, path)
+        finally:
+            tmp.unlink(missing_ok=True)
+        return self._finish(url, response, body)
+
+    async def _astream(self, url: str, headers: Dict[str, str], max_bytes: Optional[int], write: Callable[[bytes], Any]):
+        import httpx
+
+        self._count("requests")
+        try:
+            async with self._async_client().stream("GET", url, headers=headers) as response:
+                if response.status_code == 304:
+                    return response, None
+                body = _Body(self, url, max_bytes or self.settings.max_bytes, write)
+                body.start(response)
+                async for chunk in response.aiter_bytes(CHUNK):
+                    body.feed(chunk)
+                return response, body
+        except httpx.TimeoutException as e:
+            self._count("timeouts")
+            raise TimeoutError(f"{url}: {type(e).__name__}") from e
+
+
+_fetcher: Optional[Fetcher] = None
+_fetcher_lock = threading.Lock()
+
+
+def get_fetcher() -> Fetcher:
+    """The process-wide fetcher, configured from the environment on first use."""
+    global _fetcher
+    with _fetcher_lock:
+        if _fetcher is None:
+            _fetcher = Fetcher.from_env()
+        return _fetcher
@@ -0,0 +1,190 @@
+"""Index of generated images by prompt, with reuse and request coalescing.
+
+A generation takes 10-30 s and is billed, yet in a demo several people type
+the same prompt, and a refreshed page submits it again. ``GenerationCache``:
+
+* records every image saved under ``images/`` in a SQLite index
+  (``images/index.sqlite``), keyed by the normalized prompt (whitespace
+  collapsed, case folded) plus the generation parameters (deployment,
+  variant number),
+* with reuse on (``IMAGE_REUSE=1`` in ``.env``, or the checkbox in the app)
+  answers a prompt it has already generated from the saved file, without
+  calling the model; rows whose file has been deleted are dropped,
+* coalesces identical requests in flight: the first one generates, the
+  others wait for it and get the same image (``IMAGE_COALESCE=0`` turns
+  this off).
+
+``IMAGE_INDEX_PATH`` moves the index (``0`` = memory only). Reused,
+coalesced and generated requests are counted in ``stats``.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+DEFAULT_PATH = Path("images") / "index.sqlite"  # relative to the working directory, next to the images
+
+REUSED = "reused"
+COALESCED = "coalesced"
+GENERATED = "generated"
+
+
+def _on(value: str) -> bool:
+    return value.strip().lower() in {"1", "true", "yes", "on"}
+
+
+@dataclass
+class GenerationStats:
+    reused: int = 0
+    coalesced: int = 0
+    generated: int = 0
+    stale: int = 0  # index rows whose file was gone
+
+    def __str__(self) -> str:
+        total = self.reused + self.coalesced + self.generated
+        saved = f"{100 * (self.reused + self.coalesced) / total:.0f}%" if total else "n/a"
+        return (f"generations: {self.generated}, reused: {self.reused}, coalesced: {self.coalesced} "
+                f"(saved {saved}), stale index rows: {self.stale}")
+
+
+@dataclass
+class GenerationResult:
+    path: str
+    source: str         # REUSED, COALESCED or GENERATED
+    value: Any = None   # whatever ``generate`` returned; None when reused from the index
+
+
+def normalize_prompt(prompt: str) -> str:
+    return " ".join(prompt.split()).casefold()
+
+
+def generation_key(prompt: str, **params: Any) -> str:
+    """Canonical hash of a generation request; whitespace, case and key order do not matter."""
+    canonical = json.dumps({"prompt": normalize_prompt(prompt), "params": params},
+                           sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class GenerationCache:
+    def __init__(self, path: Optional[Path] = DEFAULT_PATH, reuse: bool = False, coalesce: bool = True):
+        self.reuse = reuse
+        self.coalesce = coalesce
+        self.stats = GenerationStats()
+        self._lock = threading.Lock()
+        self._inflight: Dict[Tuple[int, str], "asyncio.Future"] = {}
+        if path is not None:
+            path.parent.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(str(path) if path is not None else ":memory:",
+                                   check_same_thread=False, isolation_level=None)
+        if path is not None:
+            self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS generations ("
+            " key TEXT PRIMARY KEY, prompt TEXT NOT NULL, params TEXT NOT NULL,"
+            " path TEXT NOT NULL, created REAL NOT NULL)"
+        )
+
+    @classmethod
+    def from_env(cls) -> "GenerationCache":
+        path = os.getenv("IMAGE_INDEX_PATH", "")
+        if path.strip().lower() in {"0", "off", "false", "no"}:
+            db_path = None
+        else:
+            db_path = Path(path).expanduser() if path else DEFAULT_PATH
+        return cls(
+            path=db_path,
+            reuse=_on(os.getenv("IMAGE_REUSE", "0")),
+            coalesce=_on(os.getenv("IMAGE_COALESCE", "1")),
+        )
+
+    def _count(self, name: str) -> None:
+        with self._lock:
+            setattr(self.stats, name, getattr(self.stats, name) + 1)
+
+    def lookup(self, key: str) -> Optional[str]:
+        """Path of the saved image for ``key``, if it is still on disk."""
+        with self._lock:
+            row = self._db.execute("SELECT path FROM generations WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            if not os.path.exists(row[0]):
+                self._db.execute("DELETE FROM generations WHERE key = ?", (key,))
+                self.stats.stale += 1
+                return None
+            return row[0]
+
+    def record(self, key: str, prompt: str, params: Dict[str, Any], path: str) -> None:
+        with self._lock:
+            # The newest image for a key wins; regenerating a prompt replaces the row
+            self._db.execute(
+                "INSERT OR REPLACE INTO generations (key, prompt, params, path, created) VALUES (?, ?, ?, ?, ?)",
+                (key, prompt, json.dumps(params, sort_keys=True), os.path.abspath(path), time.time()),
+            )
+
+    async def get_or_generate(self,
+                              prompt: str,
+                              generate: Callable[[], Awaitable[Tuple[Any, str]]],
+                              reuse: Optional[bool] = None,
+                              **params: Any) -> GenerationResult:
+        """The image for ``prompt`` + ``params``: from the index, from a request in flight, or ``generate()``.
+
+        ``generate`` returns ``(value, file_path)``; ``reuse`` overrides the configured default.
+        """
+        key = generation_key(prompt, **params)
+        if self.reuse if reuse is None else reuse:
+            path = self.lookup(key)
+            if path is not None:
+                self._count("reused")
+                return GenerationResult(path, REUSED)
+        if not self.coalesce:
+            value, path = await self._generate(key, prompt, params, generate)
+            return GenerationResult(path, GENERATED, value)
+
+        # Futures belong to one event loop, so requests are only joined within a loop
+        inflight = (id(asyncio.get_running_loop()), key)
+        task = self._inflight.get(inflight)
+        if task is not None:
+            self._count("coalesced")
+            value, path = await asyncio.shield(task)
+            return GenerationResult(path, COALESCED, value)
+
+        task = asyncio.ensure_future(self._generate(key, prompt, params, generate))
+        self._inflight[inflight] = task
+        task.add_done_callback(lambda done: self._finished(inflight, done))
+        # Shielded: a closed tab cancels its own wait, not the generation others are waiting for
+        value, path = await asyncio.shield(task)
+        return GenerationResult(path, GENERATED, value)
+
+    async def _generate(self,
+                        key: str,
+                        prompt: str,
+                        params: Dict[str, Any],
+                        generate: Callable[[], Awaitable[Tuple[Any, str]]]) -> Tuple[Any, str]:
+        value, path = await generate()
+        self._count("generated")
+        self.record(key, prompt, params, path)
+        return value, path
+
+    def _finished(self, inflight: Tuple[int, str], task: "asyncio.Future") -> None:
+        self._inflight.pop(inflight, None)
+        if not task.cancelled():
+            task.exception()  # retrieved here, so a failure nobody waited for is not logged as unhandled
+
+
+_cache: Optional[GenerationCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_generation_cache() -> GenerationCache:
+    """The process-wide index, configured from the environment on first use."""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = GenerationCache.from_env()
+        return _cache
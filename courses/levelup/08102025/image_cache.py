@@ -0,0 +1,335 @@
+"""Cache of images already encoded as base64 ``data:`` URLs.
+
+The vision apps used to download and base64-encode the same picture for
+every question. ``ImageCache`` keeps the finished data URL, keyed by where
+the image came from:
+
+* a URL – reused without any request for ``IMAGE_CACHE_FRESH`` seconds (or
+  the response's ``max-age``), then revalidated with ``If-None-Match`` /
+  ``If-Modified-Since``; a ``304`` keeps the cached copy (downloads go
+  through fetcher.py: pooled, with timeouts and a size limit),
+* a local file – path + mtime + size, so an edited file is encoded again,
+* an uploaded PIL image – a hash of its pixels.
+
+Pass an ``ImagePolicy`` (see image_prep.py) to cache the resized, re-encoded
+image and its ``ImageReport`` instead of the original bytes; the policy is
+part of the key.
+
+Entries live in an in-memory LRU bounded in bytes (``IMAGE_CACHE_MEMORY_MB``)
+and, optionally, in a SQLite file (``IMAGE_CACHE_PATH``, ``0`` = memory only,
+``IMAGE_CACHE_DISK_MB``) so the next run starts warm.
+"""
+import asyncio
+import hashlib
+import io
+import json
+import mimetypes
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from email.utils import formatdate
+from pathlib import Path
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from fetcher import FetchResult, get_fetcher
+from image_prep import (ImagePolicy, ImageReport, PreparedImage, file_to_data_url, image_part, prepare_bytes,
+                        prepare_file, prepare_image, to_data_url)
+
+DEFAULT_PATH = Path.home() / ".cache" / "levelup" / "images.sqlite"
+
+
+@dataclass
+class ImageCacheStats:
+    memory_hits: int = 0
+    disk_hits: int = 0
+    revalidated: int = 0   # 304 Not Modified
+    misses: int = 0
+    encoded_bytes: int = 0  # base64 produced on misses
+
+    def __str__(self) -> str:
+        return (f"image cache hits: {self.memory_hits + self.disk_hits} "
+                f"(memory {self.memory_hits}, disk {self.disk_hits}), revalidated: {self.revalidated}, "
+                f"misses: {self.misses}, encoded: {self.encoded_bytes / 1024:.0f} kB")
+
+
+@dataclass
+class CachedImage:
+    data_url: str
+    report: Optional[ImageReport] = None  # set when the image went through an ImagePolicy
+
+    @property
+    def detail(self) -> Optional[str]:
+        return self.report.detail if self.report is not None else None
+
+    def part(self) -> Dict[str, Any]:
+        """The chat ``content`` part for this image."""
+        return image_part(self.data_url, self.detail)
+
+
+@dataclass
+class _Entry:
+    data_url: str
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+    fresh_until: float = float("inf")
+    meta: Optional[str] = None  # ImageReport as JSON
+
+    def image(self) -> CachedImage:
+        return CachedImage(self.data_url, ImageReport(**json.loads(self.meta)) if self.meta else None)
+
+
+def guess_mime(name: str, default: str = "image/jpeg") -> str:
+    mime, _ = mimetypes.guess_type(name)
+    return mime if mime and mime.startswith("image/") else default
+
+
+def _key(source: str, policy: Optional[ImagePolicy]) -> str:
+    return f"{source}|{policy.key()}" if policy is not None else source
+
+
+def _encoded(data: bytes, mime: str, policy: Optional[ImagePolicy]) -> _Entry:
+    """The bytes as sent (no policy) or resized and re-encoded by ``image_prep``."""
+    if policy is None:
+        return _Entry(data_url=to_data_url(data, mime))
+    return _prepared(prepare_bytes(data, policy))
+
+
+def _prepared(prepared: PreparedImage) -> _Entry:
+    return _Entry(prepared.data_url, meta=json.dumps(prepared.report.to_dict()))
+
+
+def _validators(entry: Optional[_Entry]) -> Tuple[Optional[str], Optional[str]]:
+    return (entry.etag, entry.last_modified) if entry is not None else (None, None)
+
+
+def _max_input(policy: Optional[ImagePolicy]) -> Optional[int]:
+    # A policy's input limit; without one the fetcher's own FETCH_MAX_MB applies
+    return policy.max_input_bytes if policy is not None else None
+
+
+def _max_age(cache_control: Optional[str]) -> Optional[float]:
+    match = re.search(r"max-age=(\d+)", cache_control or "")
+    return float(match.group(1)) if match else None
+
+
+class ImageCache:
+    def __init__(self,
+                 memory_bytes: int = 64 * 1024 * 1024,
+                 path: Optional[Path] = DEFAULT_PATH,
+                 disk_bytes: int = 256 * 1024 * 1024,
+                 fresh_seconds: float = 300,
+                 clock: Callable[[], float] = time.time):
+        self.memory_bytes = memory_bytes
+        self.disk_bytes = disk_bytes
+        self.fresh_seconds = fresh_seconds
+        self.stats = ImageCacheStats()
+        self._clock = clock
+        self._memory: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._memory_used = 0
+        self._lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+        if path is not None:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            self._db = sqlite3.connect(str(path), check_same_thread=False, isolation_level=None)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS images ("
+                " key TEXT PRIMARY KEY, data_url TEXT NOT NULL, etag TEXT, last_modified TEXT,"
+                " fresh_until REAL NOT NULL, size INTEGER NOT NULL, last_access REAL NOT NULL, meta TEXT)"
+            )
+            columns = {row[1] for row in self._db.execute("PRAGMA table_info(images)")}
+            if "meta" not in columns:  # cache files from before image_prep
+                self._db.execute("ALTER TABLE images ADD COLUMN meta TEXT")
+            self._db.execute("CREATE INDEX IF NOT EXISTS images_last_access ON images(last_access)")
+
+    @classmethod
+    def from_env(cls) -> "ImageCache":
+        path = os.getenv("IMAGE_CACHE_PATH", "")
+        if path.strip().lower() in {"0", "off", "false", "no"}:
+            db_path = None
+        else:
+            db_path = Path(path).expanduser() if path else DEFAULT_PATH
+        return cls(
+            memory_bytes=int(float(os.getenv("IMAGE_CACHE_MEMORY_MB", "64")) * 1024 * 1024),
+            path=db_path,
+            disk_bytes=int(float(os.getenv("IMAGE_CACHE_DISK_MB", "256")) * 1024 * 1024),
+            fresh_seconds=float(os.getenv("IMAGE_CACHE_FRESH", "300")),
+        )
+
+    # --- sources -----------------------------------------------------------
+
+    def url_image(self, url: str, policy: Optional[ImagePolicy] = None) -> CachedImage:
+        """A remote image; no request while the cached copy is fresh."""
+        key, entry, cached = self._url_lookup(url, policy)
+        if cached is not None:
+            return cached
+        result = get_fetcher().get(url, *_validators(entry), max_bytes=_max_input(policy))
+        return self._url_store(key, entry, result, policy)
+
+    async def aurl_image(self, url: str, policy: Optional[ImagePolicy] = None) -> CachedImage:
+        """``url_image`` for async handlers: the download does not block the event loop."""
+        key, entry, cached = await asyncio.to_thread(self._url_lookup, url, policy)
+        if cached is not None:
+            return cached
+        result = await get_fetcher().aget(url, *_validators(entry), max_bytes=_max_input(policy))
+        # Decoding and resizing is CPU work
+        return await asyncio.to_thread(self._url_store, key, entry, result, policy)
+
+    def _url_lookup(self, url: str, policy: Optional[ImagePolicy]) -> Tuple[str, Optional[_Entry], Optional[CachedImage]]:
+        key = _key(f"url:{url}", policy)
+        entry, tier = self._lookup(key)
+        if entry is not None and self._clock() < entry.fresh_until:
+            self._hit(tier)
+            return key, entry, entry.image()
+        return key, entry, None
+
+    def _fresh_for(self, result: FetchResult) -> float:
+        max_age = _max_age(result.headers.get("Cache-Control"))
+        return self.fresh_seconds if max_age is None else max_age
+
+    def _url_store(self, key: str, entry: Optional[_Entry], result: FetchResult, policy: Optional[ImagePolicy]) -> CachedImage:
+        now = self._clock()
+        if result.not_modified and entry is not None:
+            # Not modified: keep the encoded copy and start a new freshness window
+            entry.fresh_until = now + self._fresh_for(result)
+            with self._lock:
+                self.stats.revalidated += 1
+            self._store(key, entry)
+            return entry.image()
+
+        mime = result.content_type
+        if not mime.startswith("image/"):
+            mime = guess_mime(result.url)
+        entry = _encoded(result.content, mime, policy)
+        entry.etag = result.headers.get("ETag")
+        entry.last_modified = result.headers.get("Last-Modified") or formatdate(now, usegmt=True)
+        entry.fresh_until = now + self._fresh_for(result)
+        self._miss(key, entry)
+        return entry.image()
+
+    def file_image(self, path: Path, mime: Optional[str] = None, policy: Optional[ImagePolicy] = None) -> CachedImage:
+        """A local file; encoded again only when the file changes, streamed rather than read whole."""
+        path = Path(path).resolve()
+        stat = path.stat()
+        key = _key(f"file:{path}:{stat.st_mtime_ns}:{stat.st_size}", policy)
+        entry, tier = self._lookup(key)
+        if entry is not None:
+            self._hit(tier)
+            return entry.image()
+        if policy is None:
+            entry = _Entry(data_url=file_to_data_url(path, mime or guess_mime(path.name)))
+        else:
+            entry = _prepared(prepare_file(path, policy))
+        self._miss(key, entry)
+        return entry.image()
+
+    def pil_image(self, image: Any, policy: Optional[ImagePolicy] = None, fmt: str = "JPEG") -> CachedImage:
+        """An uploaded PIL image, keyed by a hash of its pixels."""
+        digest = hashlib.sha256()
+        digest.update(f"{image.mode}:{image.size}:{fmt}".encode("ascii"))
+        digest.update(image.tobytes())
+        key = _key(f"pil:{digest.hexdigest()}", policy)
+        entry, tier = self._lookup(key)
+        if entry is not None:
+            self._hit(tier)
+            return entry.image()
+        if policy is not None:
+            entry = _prepared(prepare_image(image, policy))
+        else:
+            buf = io.BytesIO()
+            image.convert("RGB").save(buf, format=fmt)
+            mime = "image/jpeg" if fmt.upper() == "JPEG" else f"image/{fmt.lower()}"
+            entry = _Entry(data_url=to_data_url(buf.getvalue(), mime))
+        self._miss(key, entry)
+        return entry.image()
+
+    def url_data_url(self, url: str) -> str:
+        return self.url_image(url).data_url
+
+    def file_data_url(self, path: Path, mime: Optional[str] = None) -> str:
+        return self.file_image(path, mime).data_url
+
+    def pil_data_url(self, image: Any, fmt: str = "JPEG") -> str:
+        return self.pil_image(image, fmt=fmt).data_url
+
+    # --- tiers -------------------------------------------------------------
+
+    def _lookup(self, key: str) -> Tuple[Optional[_Entry], str]:
+        """(entry, "memory" or "disk"), or (None, "") when the key is not cached."""
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                self._memory.move_to_end(key)
+                return entry, "memory"
+            if self._db is None:
+                return None, ""
+            row = self._db.execute(
+                "SELECT data_url, etag, last_modified, fresh_until, meta FROM images WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None, ""
+            self._db.execute("UPDATE images SET last_access = ? WHERE key = ?", (self._clock(), key))
+            entry = _Entry(*row)
+            self._remember(key, entry)
+            return entry, "disk"
+
+    def _hit(self, tier: str) -> None:
+        with self._lock:
+            if tier == "disk":
+                self.stats.disk_hits += 1
+            else:
+                self.stats.memory_hits += 1
+
+    def _miss(self, key: str, entry: _Entry) -> None:
+        with self._lock:
+            self.stats.misses += 1
+            self.stats.encoded_bytes += len(entry.data_url)
+        self._store(key, entry)
+
+    def _store(self, key: str, entry: _Entry) -> None:
+        with self._lock:
+            self._remember(key, entry)
+            if self._db is None:
+                return
+            size = len(entry.data_url)
+            self._db.execute(
+                "INSERT OR REPLACE INTO images (key, data_url, etag, last_modified, fresh_until, size, last_access, meta)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, entry.data_url, entry.etag, entry.last_modified, entry.fresh_until, size, self._clock(), entry.meta),
+            )
+            total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM images").fetchone()[0]
+            if total <= self.disk_bytes:
+                return
+            # Drop the least recently used rows until the file is back under budget
+            for old_key, old_size in self._db.execute("SELECT key, size FROM images ORDER BY last_access").fetchall():
+                if total <= self.disk_bytes or old_key == key:
+                    break
+                self._db.execute("DELETE FROM images WHERE key = ?", (old_key,))
+                total -= old_size
+
+    def _remember(self, key: str, entry: _Entry) -> None:
+        old = self._memory.pop(key, None)
+        if old is not None:
+            self._memory_used -= len(old.data_url)
+        self._memory[key] = entry
+        self._memory_used += len(entry.data_url)
+        while self._memory_used > self.memory_bytes and len(self._memory) > 1:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_used -= len(evicted.data_url)
+
+
+_cache: Optional[ImageCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_image_cache() -> ImageCache:
+    """The process-wide cache, configured from the environment on first use."""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = ImageCache.from_env()
+        return _cache
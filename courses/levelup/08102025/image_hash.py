@@ -0,0 +1,76 @@
+"""Perceptual hashes for spotting near-duplicate images.
+
+``dhash`` is the 64-bit difference hash: the image shrunk to 9 x 8 grey
+pixels, one bit per pair of horizontal neighbours (is the left one
+brighter?). Re-encoding, resizing or small colour changes flip only a few
+bits, so two photos are near-duplicates when their hashes differ in at most
+a handful of bits (``hamming``).
+
+``DuplicateIndex`` finds such a match without comparing against every hash
+seen so far: the 64 bits are split into ``threshold + 1`` bands, and two
+hashes within ``threshold`` bits of each other must agree exactly on at least
+one band, so only hashes sharing a band are compared.
+"""
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+HASH_BITS = 64
+
+
+def dhash(image: Any) -> int:
+    from PIL import Image
+
+    small = image.convert("L").resize((9, 8), Image.BILINEAR)
+    pixels = list(small.getdata())
+    value = 0
+    for row in range(8):
+        for col in range(8):
+            left, right = pixels[row * 9 + col], pixels[row * 9 + col + 1]
+            value = (value << 1) | (left > right)
+    return value
+
+
+def dhash_file(path: Path) -> int:
+    from PIL import Image
+
+    with Image.open(path) as image:
+        # JPEG: decode at 1/8 scale at most, the hash only needs 9 x 8 pixels
+        image.draft("L", (64, 64))
+        return dhash(image)
+
+
+def hamming(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+class DuplicateIndex:
+    def __init__(self, threshold: int = 4):
+        self.threshold = threshold
+        self._bands = threshold + 1
+        self._width = HASH_BITS // self._bands
+        self._buckets: List[Dict[int, List[Tuple[int, str]]]] = [{} for _ in range(self._bands)]
+        self._mask = (1 << self._width) - 1
+
+    def _keys(self, value: int) -> List[int]:
+        return [(value >> (band * self._width)) & self._mask for band in range(self._bands)]
+
+    def find(self, value: int) -> Optional[str]:
+        """Id of an added hash within ``threshold`` bits of ``value``, if any."""
+        for band, key in enumerate(self._keys(value)):
+            for other, item_id in self._buckets[band].get(key, ()):
+                if hamming(value, other) <= self.threshold:
+                    return item_id
+        return None
+
+    def add(self, value: int, item_id: str) -> None:
+        for band, key in enumerate(self._keys(value)):
+            self._buckets[band].setdefault(key, []).append((value, item_id))
+
+    def remove(self, value: int, item_id: str) -> None:
+        """Take back an ``add`` (for an original whose request failed)."""
+        for band, key in enumerate(self._keys(value)):
+            bucket = self._buckets[band].get(key)
+            if bucket and (value, item_id) in bucket:
+                bucket.remove((value, item_id))
+                if not bucket:
+                    del self._buckets[band][key]
@@ -0,0 +1,275 @@
+"""Downscaling and detail policy for images sent to the vision model.
+
+The service bills an image by its tiles: with ``detail="low"`` it is a flat
+85 tokens at 512 px, with ``"high"`` the image is fitted into 2048 x 2048,
+its short side scaled to 768 px, and every 512 px tile costs 170 tokens more.
+Pixels beyond that geometry are thrown away server-side, so sending a 12 MP
+phone photo only buys a bigger upload. ``prepare_image``:
+
+* picks the detail level (``VISION_DETAIL``: ``low``, ``high``, ``auto`` or
+  ``adaptive`` = low for images that fit one low-detail tile, high otherwise),
+* resizes to exactly what that detail level will use (never upscales),
+* encodes PNG for images with transparency or few colours, JPEG otherwise,
+  lowering JPEG quality (down to ``VISION_MIN_QUALITY``) and then the size
+  until the result fits ``VISION_MAX_KB``,
+* returns an ``ImageReport`` with bytes and estimated tokens before/after.
+
+``prepare_file`` is the path for local files and uploads: it reads only the
+header first, passes a JPEG/PNG/WebP/GIF that already fits the policy through
+byte for byte, lets the JPEG decoder scale down while decoding otherwise, and
+refuses files over ``VISION_MAX_INPUT_MB``. Data URLs are base64-encoded in
+chunks into one preallocated buffer, which is decoded once into the ``str``
+the SDK needs: two copies of the payload at the peak (buffer and string)
+instead of four with ``read`` + ``b64encode`` + ``decode`` + string
+concatenation.
+"""
+import binascii
+import io
+import math
+import os
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+LOW_DETAIL_TOKENS = 85
+TILE_TOKENS = 170
+TILE = 512
+HIGH_MAX_SIDE = 2048
+HIGH_SHORT_SIDE = 768
+JPEG_QUALITIES = (85, 75, 65, 55, 45, 35)
+PASSTHROUGH_MIMES = {"image/jpeg", "image/png", "image/webp", "image/gif"}
+B64_CHUNK = 3 * 256 * 1024  # a multiple of 3, so chunks encode without padding in between
+EXIF_ORIENTATION = 274
+
+
+class ImageTooLargeError(ValueError):
+    pass
+
+
+def estimate_image_tokens(width: int, height: int, detail: str = "high") -> int:
+    """Prompt tokens the service charges for an image of this size."""
+    if detail == "low":
+        return LOW_DETAIL_TOKENS
+    width, height = detail_size(width, height, "high")
+    return LOW_DETAIL_TOKENS + TILE_TOKENS * math.ceil(width / TILE) * math.ceil(height / TILE)
+
+
+def detail_size(width: int, height: int, detail: str) -> Tuple[int, int]:
+    """The size the service works with at this detail level (never larger than the input)."""
+    if detail == "low":
+        scale = min(1.0, TILE / max(width, height))
+    else:
+        scale = min(1.0, HIGH_MAX_SIDE / max(width, height), HIGH_SHORT_SIDE / min(width, height))
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+@dataclass(frozen=True)
+class ImagePolicy:
+    detail: str = "adaptive"   # low | high | auto | adaptive
+    max_bytes: int = 400 * 1024
+    min_quality: int = 45
+    max_input_bytes: int = 20 * 1024 * 1024  # the service's own limit per image
+
+    @classmethod
+    def from_env(cls) -> "ImagePolicy":
+        detail = os.getenv("VISION_DETAIL", "adaptive").strip().lower()
+        if detail not in {"low", "high", "auto", "adaptive"}:
+            raise RuntimeError(f"VISION_DETAIL must be low, high, auto or adaptive, not {detail!r}")
+        return cls(
+            detail=detail,
+            max_bytes=int(float(os.getenv("VISION_MAX_KB", "400")) * 1024),
+            min_quality=int(os.getenv("VISION_MIN_QUALITY", "45")),
+            max_input_bytes=int(float(os.getenv("VISION_MAX_INPUT_MB", "20")) * 1024 * 1024),
+        )
+
+    def key(self) -> str:
+        """Stable text for cache keys: a different policy gives a different encoding."""
+        return f"{self.detail}:{self.max_bytes}:{self.min_quality}"
+
+    def choose_detail(self, width: int, height: int) -> str:
+        if self.detail != "adaptive":
+            return self.detail
+        return "low" if max(width, height) <= TILE else "high"
+
+    def check_size(self, size: int) -> None:
+        if size > self.max_input_bytes:
+            raise ImageTooLargeError(
+                f"Image is {size / 1024 / 1024:.1f} MB, the limit is {self.max_input_bytes / 1024 / 1024:.0f} MB"
+            )
+
+
+@dataclass
+class ImageReport:
+    detail: str
+    mime: str
+    width: int
+    height: int
+    bytes: int
+    original_width: int
+    original_height: int
+    original_bytes: Optional[int] = None  # unknown for images that arrive decoded (Gradio uploads)
+
+    @property
+    def tokens_before(self) -> int:
+        # Sent as-is with the default detail, a large image is billed like "high"
+        return estimate_image_tokens(self.original_width, self.original_height, "high")
+
+    @property
+    def tokens_after(self) -> int:
+        # "auto" lets the service decide; count it as high to stay on the safe side
+        return estimate_image_tokens(self.width, self.height, "low" if self.detail == "low" else "high")
+
+    def to_dict(self) -> Dict[str, Any]:
+        return asdict(self)
+
+    def __str__(self) -> str:
+        before = f"{self.original_bytes / 1024:.0f} kB " if self.original_bytes is not None else ""
+        return (f"image {self.original_width}x{self.original_height} {before}"
+                f"~{self.tokens_before} tokens → {self.width}x{self.height} {self.mime.split('/')[-1]} "
+                f"{self.bytes / 1024:.0f} kB ~{self.tokens_after} tokens (detail {self.detail})")
+
+
+def _data_url(mime: str, size: int, chunks: Iterable[Any]) -> str:
+    prefix = f"data:{mime};base64,".encode("ascii")
+    out = bytearray(len(prefix) + 4 * math.ceil(size / 3))
+    out[:len(prefix)] = prefix
+    pos = len(prefix)
+    for chunk in chunks:
+        encoded = binascii.b2a_base64(chunk, newline=False)
+        out[pos:pos + len(encoded)] = encoded
+        pos += len(encoded)
+    # The request needs a str and CPython cannot turn bytes into one without a copy:
+    # for a moment the buffer and the string both exist (the peak), then the buffer is freed
+    return out.decode("ascii")
+
+
+def to_data_url(data: bytes, mime: str) -> str:
+    """``data:`` URL for bytes in memory, encoded chunk by chunk into one buffer, then one ``str`` copy."""
+    view = memoryview(data)
+    return _data_url(mime, len(view), (view[i:i + B64_CHUNK] for i in range(0, len(view), B64_CHUNK)))
+
+
+def file_to_data_url(path: Path, mime: str) -> str:
+    """``data:`` URL for a file, streamed: the raw bytes are never all in memory (peak: buffer + ``str``)."""
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        return _data_url(mime, size, iter(lambda: f.read(B64_CHUNK), b""))
+
+
+@dataclass
+class PreparedImage:
+    data: Optional[bytes]
+    report: ImageReport
+    path: Optional[Path] = None  # passed through unchanged: encode straight from the file
+
+    @property
+    def data_url(self) -> str:
+        if self.path is not None:
+            return file_to_data_url(self.path, self.report.mime)
+        return to_data_url(self.data, self.report.mime)
+
+
+def image_part(data_url: str, detail: Optional[str] = None) -> Dict[str, Any]:
+    """A chat ``content`` part for an image, with the detail level when there is one."""
+    image_url: Dict[str, Any] = {"url": data_url}
+    if detail:
+        image_url["detail"] = detail
+    return {"type": "image_url", "image_url": image_url}
+
+
+def _wants_png(image: Any) -> bool:
+    if image.mode in ("RGBA", "LA") or "transparency" in image.info:
+        return True
+    # Screenshots and diagrams: few distinct colours compress better (and sharper) as PNG
+    return image.convert("RGB").getcolors(maxcolors=256) is not None
+
+
+def _encode(image: Any, png: bool, quality: int) -> Tuple[bytes, str]:
+    buf = io.BytesIO()
+    if png:
+        image.save(buf, format="PNG", optimize=True)
+        return buf.getvalue(), "image/png"
+    image.convert("RGB").save(buf, format="JPEG", quality=quality, optimize=True, progressive=True)
+    return buf.getvalue(), "image/jpeg"
+
+
+def prepare_image(image: Any,
+                  policy: Optional[ImagePolicy] = None,
+                  original_bytes: Optional[int] = None,
+                  original_size: Optional[Tuple[int, int]] = None) -> PreparedImage:
+    """Resize and encode a PIL image for the vision model according to ``policy``.
+
+    ``original_size`` is the size before any scaling done while decoding.
+    """
+    from PIL import Image
+
+    policy = policy or ImagePolicy()
+    original_width, original_height = original_size or image.size
+    detail = policy.choose_detail(original_width, original_height)
+    width, height = detail_size(original_width, original_height, "low" if detail == "low" else "high")
+    if (width, height) != image.size:
+        image = image.resize((width, height), Image.LANCZOS)
+
+    png = _wants_png(image)
+    if not png and image.mode not in ("RGB", "L"):
+        image = image.convert("RGB")
+    while True:
+        qualities = (100,) if png else [q for q in JPEG_QUALITIES if q >= policy.min_quality] or [policy.min_quality]
+        for quality in qualities:
+            data, mime = _encode(image, png, quality)
+            if len(data) <= policy.max_bytes:
+                break
+        if len(data) <= policy.max_bytes or max(image.size) <= TILE // 2:
+            break
+        if png:
+            png = False  # try JPEG at the same size before shrinking
+            continue
+        # Still over budget at the lowest quality: shrink and try again
+        image = image.resize((max(1, image.width * 3 // 4), max(1, image.height * 3 // 4)), Image.LANCZOS)
+
+    return PreparedImage(data, ImageReport(
+        detail=detail,
+        mime=mime,
+        width=image.width,
+        height=image.height,
+        bytes=len(data),
+        original_width=original_width,
+        original_height=original_height,
+        original_bytes=original_bytes,
+    ))
+
+
+def _prepare_encoded(source: Any, size: int, policy: ImagePolicy, path: Optional[Path] = None) -> PreparedImage:
+    from PIL import Image, ImageOps
+
+    policy.check_size(size)
+    with Image.open(source) as image:  # reads the header only
+        width, height = image.size
+        orientation = image.getexif().get(EXIF_ORIENTATION, 1)
+        if orientation in (5, 6, 7, 8):  # stored sideways, shown upright
+            width, height = height, width
+        detail = policy.choose_detail(width, height)
+        billed = "low" if detail == "low" else "high"
+        mime = Image.MIME.get(image.format or "")
+        if (path is not None and mime in PASSTHROUGH_MIMES and size <= policy.max_bytes
+                and orientation == 1 and not getattr(image, "is_animated", False)
+                and detail_size(width, height, billed) == (width, height)):
+            # Already what the service would use: send the original bytes, no decode/encode
+            return PreparedImage(None, ImageReport(detail, mime, width, height, size, width, height, size), path)
+        # JPEG only: decode at 1/2, 1/4 or 1/8 scale when that still covers the target size
+        image.draft(None, detail_size(*image.size, billed))
+        # Phone photos are often stored sideways with an EXIF rotation flag
+        image = ImageOps.exif_transpose(image)
+        image.load()
+    return prepare_image(image, policy, original_bytes=size, original_size=(width, height))
+
+
+def prepare_bytes(data: bytes, policy: Optional[ImagePolicy] = None) -> PreparedImage:
+    """``prepare_image`` for an encoded image in memory (a download)."""
+    return _prepare_encoded(io.BytesIO(data), len(data), policy or ImagePolicy())
+
+
+def prepare_file(path: Path, policy: Optional[ImagePolicy] = None) -> PreparedImage:
+    """``prepare_image`` for a file; passes it through unchanged when it already meets ``policy``."""
+    path = Path(path)
+    return _prepare_encoded(path, path.stat().st_size, policy or ImagePolicy(), path)
@@ -0,0 +1,352 @@
+"""Managed storage for generated images.
+
+imdallegradio used to write every result as a new full-size
+``images/image_<timestamp>.png`` and keep it forever, then decode the whole
+file again just for the preview. ``ImageStore`` keeps the same folder under
+control:
+
+* files are named by the SHA-256 of their content
+  (``images/<hash>.png``), so the same image is stored once however often
+  it comes back,
+* a small WebP preview (``images/thumbs/``) is made when the image is
+  stored, so the UI never decodes a full-size file,
+* optional lossless recompression (``IMAGE_STORE_FORMAT``: ``original``,
+  ``png`` = optimized PNG, ``webp`` = lossless WebP), kept only when smaller,
+* a SQLite index (``images/store.sqlite``) with the prompt, creation and
+  last access time, size and dimensions,
+* a disk quota (``IMAGE_STORE_QUOTA_MB``, default 1024, thumbnails
+  included) and an optional age limit (``IMAGE_STORE_MAX_DAYS``); the
+  least recently used images go first.
+
+``IMAGE_STORE_DIR`` moves the folder. ``python image_store.py`` prints the
+usage; ``--import`` takes over the older ``image_*.png`` files and
+``--enforce`` applies the quota now.
+"""
+import argparse
+import hashlib
+import io
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from PIL import Image, ImageOps
+
+DEFAULT_DIR = Path("images")  # relative to the working directory
+FORMATS = ("original", "png", "webp")
+THUMB_SIZE = 512
+THUMB_QUALITY = 80
+NAME_CHARS = 24  # of the hex digest, for file names
+
+
+@dataclass
+class ImageStoreStats:
+    stored: int = 0
+    deduplicated: int = 0
+    recompressed_saved: int = 0  # bytes
+    evicted: int = 0
+    evicted_bytes: int = 0
+
+    def __str__(self) -> str:
+        return (f"image store: {self.stored} stored, {self.deduplicated} duplicates, "
+                f"{self.recompressed_saved / 1024 / 1024:.1f} MB saved by recompression, "
+                f"{self.evicted} evicted ({self.evicted_bytes / 1024 / 1024:.1f} MB)")
+
+
+@dataclass
+class StoredImage:
+    hash: str
+    path: str
+    thumb: str
+    width: int
+    height: int
+    bytes: int
+    duplicate: bool = False  # the content was already in the store
+
+
+def _write_atomic(path: Path, data: bytes) -> None:
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".part")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+
+
+def _extension(img: Image.Image) -> str:
+    return {"JPEG": "jpg"}.get(img.format or "", (img.format or "png").lower())
+
+
+def _recompress(img: Image.Image, data: bytes, ext: str, fmt: str) -> Tuple[bytes, str]:
+    """Lossless re-encode in ``fmt``; the original bytes when that is not smaller (or not lossless)."""
+    if fmt == "original" or ext not in ("png", "webp"):
+        return data, ext  # JPEG is already lossy: re-encoding it would only lose quality
+    buf = io.BytesIO()
+    if fmt == "png":
+        img.save(buf, "PNG", optimize=True)
+    else:
+        img.save(buf, "WEBP", lossless=True, quality=100, method=4)
+    if buf.tell() < len(data):
+        return buf.getvalue(), fmt
+    return data, ext
+
+
+def _thumbnail(img: Image.Image) -> bytes:
+    thumb = ImageOps.exif_transpose(img)
+    thumb.thumbnail((THUMB_SIZE, THUMB_SIZE), Image.Resampling.LANCZOS, reducing_gap=2.0)
+    if thumb.mode not in ("RGB", "RGBA"):
+        thumb = thumb.convert("RGBA" if "A" in thumb.getbands() else "RGB")
+    buf = io.BytesIO()
+    thumb.save(buf, "WEBP", quality=THUMB_QUALITY)
+    return buf.getvalue()
+
+
+class ImageStore:
+    def __init__(self,
+                 root: Path = DEFAULT_DIR,
+                 quota_bytes: int = 1024 * 1024 * 1024,
+                 max_age: float = 0,
+                 fmt: str = "original"):
+        if fmt not in FORMATS:
+            raise RuntimeError(f"IMAGE_STORE_FORMAT must be one of {', '.join(FORMATS)}, not {fmt!r}")
+        self.root = Path(root).resolve()
+        self.thumbs = self.root / "thumbs"
+        self.quota_bytes = quota_bytes
+        self.max_age = max_age  # seconds, 0 = no age limit
+        self.fmt = fmt
+        self.stats = ImageStoreStats()
+        self._lock = threading.Lock()
+        self.thumbs.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(str(self.root / "store.sqlite"), check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS blobs ("
+            " hash TEXT PRIMARY KEY, path TEXT NOT NULL, thumb TEXT NOT NULL,"
+            " bytes INTEGER NOT NULL, thumb_bytes INTEGER NOT NULL, original_bytes INTEGER NOT NULL,"
+            " width INTEGER NOT NULL, height INTEGER NOT NULL,"
+            " created REAL NOT NULL, last_access REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS blobs_path ON blobs(path)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS blobs_last_access ON blobs(last_access)")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS outputs ("
+            " id INTEGER PRIMARY KEY, hash TEXT NOT NULL, prompt TEXT NOT NULL, created REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS outputs_hash ON outputs(hash)")
+
+    @classmethod
+    def from_env(cls) -> "ImageStore":
+        root = os.getenv("IMAGE_STORE_DIR")
+        return cls(
+            root=Path(root).expanduser() if root else DEFAULT_DIR,
+            quota_bytes=int(float(os.getenv("IMAGE_STORE_QUOTA_MB", "1024")) * 1024 * 1024),
+            max_age=float(os.getenv("IMAGE_STORE_MAX_DAYS", "0")) * 24 * 3600,
+            fmt=os.getenv("IMAGE_STORE_FORMAT", "original").strip().lower(),
+        )
+
+    # --- storing -----------------------------------------------------------
+
+    def new_download_path(self) -> Path:
+        """A temporary file in the store folder for ``put_file`` (same file system, so it can be renamed)."""
+        fd, tmp = tempfile.mkstemp(dir=self.root, prefix=".download.", suffix=".part")
+        os.close(fd)
+        return Path(tmp)
+
+    def put_bytes(self, data: bytes, prompt: str = "") -> StoredImage:
+        """Store an encoded image (PNG, JPEG, WebP ...) given in memory."""
+        digest = hashlib.sha256(data).hexdigest()
+        existing = self._existing(digest, prompt)
+        if existing is not None:
+            return existing
+        return self._add(digest, data, prompt)
+
+    def put_file(self, path: Path, prompt: str = "") -> StoredImage:
+        """Store an image file; the file is consumed (moved into the store or deleted as a duplicate)."""
+        path = Path(path)
+        try:
+            data = path.read_bytes()  # read once: hashed, decoded for the preview, renamed into place
+            digest = hashlib.sha256(data).hexdigest()
+            existing = self._existing(digest, prompt)
+            if existing is not None:
+                return existing
+            return self._add(digest, data, prompt, source=path)
+        finally:
+            path.unlink(missing_ok=True)
+
+    def _existing(self, digest: str, prompt: str) -> Optional[StoredImage]:
+        with self._lock:
+            return self._reuse(digest, prompt)
+
+    def _reuse(self, digest: str, prompt: str) -> Optional[StoredImage]:
+        # Called with the lock held
+        row = self._db.execute("SELECT path, thumb, width, height, bytes FROM blobs WHERE hash = ?", (digest,)).fetchone()
+        if row is None or not os.path.exists(row[0]):
+            return None
+        now = time.time()
+        self._db.execute("UPDATE blobs SET last_access = ? WHERE hash = ?", (now, digest))
+        self._db.execute("INSERT INTO outputs (hash, prompt, created) VALUES (?, ?, ?)", (digest, prompt, now))
+        self.stats.deduplicated += 1
+        return StoredImage(digest, row[0], row[1], row[2], row[3], row[4], duplicate=True)
+
+    def _add(self, digest: str, data: bytes, prompt: str, source: Optional[Path] = None) -> StoredImage:
+        # Decoded once: recompression and the preview both come from this decode
+        with Image.open(io.BytesIO(data)) as img:
+            img.load()
+            ext = _extension(img)
+            width, height = img.size
+            stored, ext = _recompress(img, data, ext, self.fmt)
+            thumb = _thumbnail(img)
+        name = digest[:NAME_CHARS]
+        path = self.root / f"{name}.{ext}"
+        thumb_path = self.thumbs / f"{name}.webp"
+
+        with self._lock:
+            # The same content may have been stored by another thread while this one was encoding
+            existing = self._reuse(digest, prompt)
+            if existing is not None:
+                return existing
+            if source is not None and stored is data:
+                os.replace(source, path)  # kept as it is: rename the file instead of writing it again
+            else:
+                _write_atomic(path, stored)
+            _write_atomic(thumb_path, thumb)
+            now = time.time()
+            self._db.execute(
+                "INSERT OR REPLACE INTO blobs (hash, path, thumb, bytes, thumb_bytes, original_bytes,"
+                " width, height, created, last_access) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (digest, str(path), str(thumb_path), len(stored), len(thumb), len(data), width, height, now, now),
+            )
+            self._db.execute("INSERT INTO outputs (hash, prompt, created) VALUES (?, ?, ?)", (digest, prompt, now))
+            self.stats.stored += 1
+            self.stats.recompressed_saved += len(data) - len(stored)
+            self._evict(keep=digest)
+        return StoredImage(digest, str(path), str(thumb_path), width, height, len(stored))
+
+    # --- reading -----------------------------------------------------------
+
+    def thumbnail(self, path: str) -> str:
+        """The preview of a stored image (marked as used); other files get one made on the spot."""
+        with self._lock:
+            row = self._db.execute("SELECT hash, thumb FROM blobs WHERE path = ?", (str(path),)).fetchone()
+            if row is not None and os.path.exists(row[1]):
+                self._db.execute("UPDATE blobs SET last_access = ? WHERE hash = ?", (time.time(), row[0]))
+                return row[1]
+        thumb_path = self.thumbs / f"{hashlib.sha256(str(path).encode('utf-8')).hexdigest()[:NAME_CHARS]}.webp"
+        if not thumb_path.exists():
+            with Image.open(path) as img:
+                _write_atomic(thumb_path, _thumbnail(img))
+        return str(thumb_path)
+
+    def usage(self) -> Tuple[int, int]:
+        """(images, bytes on disk incl. thumbnails)."""
+        with self._lock:
+            count, size = self._db.execute("SELECT COUNT(*), COALESCE(SUM(bytes + thumb_bytes), 0) FROM blobs").fetchone()
+        return count, size
+
+    def recent(self, limit: int = 20) -> List[Dict[str, Any]]:
+        """The newest outputs with their prompt and file."""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT o.prompt, o.created, b.path, b.thumb, b.bytes, b.width, b.height"
+                " FROM outputs o JOIN blobs b ON b.hash = o.hash ORDER BY o.created DESC LIMIT ?",
+                (limit,),
+            ).fetchall()
+        keys = ("prompt", "created", "path", "thumb", "bytes", "width", "height")
+        return [dict(zip(keys, row)) for row in rows]
+
+    # --- retention ---------------------------------------------------------
+
+    def enforce(self) -> int:
+        """Apply the age limit and the quota now; returns the number of images removed."""
+        with self._lock:
+            return self._evict()
+
+    def _evict(self, keep: Optional[str] = None) -> int:
+        evicted = 0
+        if self.max_age:
+            for digest, path, thumb, size in self._db.execute(
+                    "SELECT hash, path, thumb, bytes + thumb_bytes FROM blobs WHERE last_access < ?",
+                    (time.time() - self.max_age,)).fetchall():
+                if digest != keep:
+                    self._remove(digest, path, thumb, size)
+                    evicted += 1
+        total = self._db.execute("SELECT COALESCE(SUM(bytes + thumb_bytes), 0) FROM blobs").fetchone()[0]
+        if total <= self.quota_bytes:
+            return evicted
+        # Least recently used first, until the folder is back under the quota
+        for digest, path, thumb, size in self._db.execute(
+                "SELECT hash, path, thumb, bytes + thumb_bytes FROM blobs ORDER BY last_access").fetchall():
+            if total <= self.quota_bytes:
+                break
+            if digest == keep:
+                continue
+            self._remove(digest, path, thumb, size)
+            total -= size
+            evicted += 1
+        return evicted
+
+    def _remove(self, digest: str, path: str, thumb: str, size: int) -> None:
+        for file_path in (path, thumb):
+            Path(file_path).unlink(missing_ok=True)
+        self._db.execute("DELETE FROM blobs WHERE hash = ?", (digest,))
+        self._db.execute("DELETE FROM outputs WHERE hash = ?", (digest,))
+        self.stats.evicted += 1
+        self.stats.evicted_bytes += size
+
+    def import_legacy(self) -> int:
+        """Move the older ``image_*.png`` files of the folder into the store."""
+        imported = 0
+        for path in sorted(self.root.glob("image_*.*")):
+            if path.suffix.lower() in (".png", ".jpg", ".jpeg", ".webp"):
+                self.put_file(path)
+                imported += 1
+        return imported
+
+
+_store: Optional[ImageStore] = None
+_store_lock = threading.Lock()
+
+
+def get_image_store() -> ImageStore:
+    """The process-wide store, configured from the environment on first use."""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = ImageStore.from_env()
+        return _store
+
+
+def main(argv: Optional[list] = None) -> int:
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Usage, import and cleanup of the generated images folder.")
+    parser.add_argument("--import", dest="import_legacy", action="store_true",
+                        help="move the older image_*.png files into the store")
+    parser.add_argument("--enforce", action="store_true", help="apply the quota and age limit now")
+    parser.add_argument("--recent", type=int, default=0, help="list the N newest images with their prompts")
+    args = parser.parse_args(argv)
+
+    store = get_image_store()
+    if args.import_legacy:
+        print(f"Imported {store.import_legacy()} files")
+    if args.enforce:
+        print(f"Removed {store.enforce()} images")
+    for item in store.recent(args.recent) if args.recent else []:
+        when = time.strftime("%Y-%m-%d %H:%M", time.localtime(item["created"]))
+        print(f"{when}  {item['width']}x{item['height']}  {item['bytes'] / 1024:>7.0f} kB  "
+              f"{os.path.basename(item['path'])}  {item['prompt']}")
+    count, size = store.usage()
+    print(f"{store.root}: {count} images, {size / 1024 / 1024:.1f} MB of {store.quota_bytes / 1024 / 1024:.0f} MB")
+    print(store.stats)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
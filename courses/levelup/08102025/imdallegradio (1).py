@@ -1,112 +1,274 @@
 # gradio_image_gen.py
 import os
-import io
+import base64
+import asyncio
 import time
-import json
-from datetime import datetime
-from typing import Tuple
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Set, Tuple
 
 from dotenv import load_dotenv
-from azure.identity import DefaultAzureCredential, get_bearer_token_provider
-from openai import AzureOpenAI
+from openai import BadRequestError
+
+from clients import get_async_azure_openai_client
+from fetcher import get_fetcher
+from generation_cache import GENERATED, GenerationResult, get_generation_cache
+from image_store import StoredImage, get_image_store
+from job_queue import DONE, FAILED, QUEUED, RUNNING, Job, JobQueue, Report
+from ratelimit import get_limiter
+from telemetry import stats_panel, stats_tab_enabled, track
 
-import requests
-from PIL import Image
 import gradio as gr
 
 
-def build_client():
+load_dotenv()
+IMAGE_VARIANTS = int(os.getenv("IMAGE_VARIANTS", "4"))        # default of the Variants slider
+IMAGE_WORKERS = int(os.getenv("IMAGE_WORKERS", "4"))          # queue workers = generations in flight
+MAX_VARIANTS = 8
+# auto: ask for inline base64 (no second download), falling back to URLs where the deployment refuses it
+IMAGE_RESPONSE_FORMAT = os.getenv("IMAGE_RESPONSE_FORMAT", "auto").strip().lower()
+_URL_ONLY: Set[str] = set()
+# Default of the "Reuse earlier results" checkbox (see generation_cache.py)
+IMAGE_REUSE = os.getenv("IMAGE_REUSE", "0").strip().lower() in {"1", "true", "yes", "on"}
+
+
+@lru_cache(maxsize=None)
+def _load_settings() -> Tuple[str, str, str]:
     load_dotenv()
     endpoint = os.getenv("IMAGE_GENERATION_ENDPOINT")
     model_deployment = os.getenv("IMAGE_GENERATION_MODEL_DEPLOYMENT")
     api_version = os.getenv("API_VERSION")
     if not endpoint or not model_deployment or not api_version:
         raise RuntimeError("Missing ENDPOINT / MODEL_DEPLOYMENT / API_VERSION in .env")
+    return endpoint, model_deployment, api_version
 
-    token_provider = get_bearer_token_provider(
-        DefaultAzureCredential(
-            exclude_environment_credential=True,
-            exclude_managed_identity_credential=True,
-        ),
-        "https://cognitiveservices.azure.com/.default",
-    )
 
-    client = AzureOpenAI(
-        api_version=api_version,
-        azure_endpoint=endpoint,
-        azure_ad_token_provider=token_provider,
-    )
+async def build_client():
+    # Async client (one per event loop, see clients.py), so a slow generation never holds a worker thread
+    endpoint, model_deployment, api_version = _load_settings()
+    client = await get_async_azure_openai_client(endpoint, model_deployment, api_version=api_version)
     return client, model_deployment
 
 
-client, MODEL_DEPLOYMENT = build_client()
+async def _save_image_from_url(url: str, prompt: str) -> StoredImage:
+    """
+    Download the image into the image store (deduplicated, with a preview; see image_store.py).
+    """
+    store = get_image_store()
+    tmp_path = store.new_download_path()
+    try:
+        # Download straight to the file: pooled connection, timeouts and a size limit (see fetcher.py)
+        await get_fetcher().adownload(url, tmp_path)
+        return await asyncio.to_thread(store.put_file, tmp_path, prompt)
+    finally:
+        tmp_path.unlink(missing_ok=True)
 
 
-def _save_image_from_url(url: str) -> Tuple[Image.Image, str]:
+def _save_image_from_b64(b64: str, prompt: str) -> StoredImage:
     """
-    Download the image and save it under ./images with a unique filename.
-    Returns (PIL.Image, file_path).
+    Decode an inline image once and hand the bytes to the image store.
     """
-    # Ensure folder
-    out_dir = os.path.join(os.getcwd(), "images")
-    os.makedirs(out_dir, exist_ok=True)
+    return get_image_store().put_bytes(base64.b64decode(b64), prompt)
+
+
+def _response_format(model_deployment: str) -> str:
+    if IMAGE_RESPONSE_FORMAT == "url" or model_deployment in _URL_ONLY:
+        return "url"
+    return "b64_json"
+
 
-    # Unique filename
-    ts = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
-    file_path = os.path.join(out_dir, f"image_{ts}.png")
+async def _images_generate(client, model_deployment: str, prompt: str, response_format: str):
+    # Call Azure OpenAI Images (rate-limited, 429s are retried with backoff; timed for the Stats tab)
+    with track("image", model_deployment, prompt):
+        return await get_limiter().acall(model_deployment, lambda: client.images.generate(
+            model=model_deployment,
+            prompt=prompt,
+            n=1,  # one image
+            response_format=response_format,
+        ))
+
+
+async def _generate_one(client, model_deployment: str, prompt: str) -> StoredImage:
+    response_format = _response_format(model_deployment)
+    try:
+        result = await _images_generate(client, model_deployment, prompt, response_format)
+    except BadRequestError as e:
+        # Deployments without inline images: remember it and use URLs from now on
+        if response_format != "b64_json" or IMAGE_RESPONSE_FORMAT != "auto" or "response_format" not in str(e):
+            raise
+        _URL_ONLY.add(model_deployment)
+        result = await _images_generate(client, model_deployment, prompt, "url")
+
+    # Inline image: one round trip, decoded off the event loop; otherwise download the URL
+    image = result.data[0]
+    if image.b64_json:
+        return await asyncio.to_thread(_save_image_from_b64, image.b64_json, prompt)
+    return await _save_image_from_url(image.url, prompt)
+
+
+async def _generate_cached(client,
+                           model_deployment: str,
+                           prompt: str,
+                           variant: int = 0,
+                           reuse: Optional[bool] = None) -> GenerationResult:
+    # Same prompt + deployment + variant number: reuse the saved file or join the request in flight
+    async def generate() -> Tuple[StoredImage, str]:
+        stored = await _generate_one(client, model_deployment, prompt)
+        return stored, stored.path
+
+    return await get_generation_cache().get_or_generate(
+        prompt,
+        generate,
+        reuse,
+        deployment=model_deployment,
+        variant=variant,
+    )
 
-    # Download + save
-    img_bytes = requests.get(url).content
-    with open(file_path, "wb") as f:
-        f.write(img_bytes)
 
-    # Load to PIL for Gradio preview
-    pil_img = Image.open(io.BytesIO(img_bytes)).convert("RGB")
-    return pil_img, file_path
+async def _preview(result: GenerationResult) -> str:
+    # The stored thumbnail; the full-size file is only offered for download
+    if result.value is not None:
+        return result.value.thumb
+    return await asyncio.to_thread(get_image_store().thumbnail, result.path)
 
 
-def generate_image(prompt: str):
+async def _run_job(job: Job, report: Report) -> Dict[str, Any]:
+    """One variant, run by a queue worker; the result is kept with the job."""
+    # Client is built on first use, on the queue's event loop
+    client, model_deployment = await build_client()
+    report(0.05, "generating")
+    params = job.params
+    result = await _generate_cached(client, model_deployment, params["prompt"], params["variant"], params.get("reuse"))
+    return {"path": result.path, "preview": await _preview(result), "source": result.source}
+
+
+@lru_cache(maxsize=None)
+def get_jobs() -> JobQueue:
+    path = os.getenv("IMAGE_JOBS_PATH", "")
+    if path.strip().lower() in {"0", "off", "false", "no"}:
+        db_path = None
+    else:
+        db_path = Path(path).expanduser() if path else Path("images") / "jobs.sqlite"
+    return JobQueue(_run_job, db_path, workers=IMAGE_WORKERS, keep_days=float(os.getenv("IMAGE_JOBS_KEEP_DAYS", "7")))
+
+
+async def generate_image(prompt: str, reuse: Optional[bool] = None):
     prompt = (prompt or "").strip()
     if not prompt:
         return None, None, "Please enter a prompt."
 
     try:
-        # Call Azure OpenAI Images
-        result = client.images.generate(
-            model=MODEL_DEPLOYMENT,
-            prompt=prompt,
-            n=1,  # one image
-        )
-
-        # Parse response -> URL, then download
-        json_response = json.loads(result.model_dump_json())
-        image_url = json_response["data"][0]["url"]
-        pil_img, file_path = _save_image_from_url(image_url)
+        # Goes through the same queue and workers as the UI
+        job = await get_jobs().wait(get_jobs().submit({"prompt": prompt, "variant": 0, "reuse": reuse}))
+        if job.status == FAILED:
+            return None, None, f"Error: {job.error}"
+        result = job.result
 
         # Success message
-        return pil_img, file_path, f"Image generated and saved: {file_path}"
+        if result["source"] == GENERATED:
+            return result["preview"], result["path"], f"Image generated and saved: {result['path']}"
+        return result["preview"], result["path"], f"Image {result['source']} for the same prompt: {result['path']}"
 
     except Exception as e:
         return None, None, f"Error: {e}"
 
 
+def submit_variants(prompt: str, variants: int, reuse: bool):
+    """Queue one job per variant; the ids live in the browser, so a reload (or a restart) finds them again."""
+    prompt = (prompt or "").strip()
+    if not prompt:
+        return gr.update(), "Please enter a prompt.", gr.Timer(active=False)
+    variants = max(1, min(int(variants), MAX_VARIANTS))
+    job_ids = [get_jobs().submit({"prompt": prompt, "variant": n, "reuse": reuse}) for n in range(1, variants + 1)]
+    return job_ids, f"Queued {variants} variants…", gr.Timer(active=True)
+
+
+def _job_status(job: Job, typical_run: Optional[float]) -> str:
+    if job.status == QUEUED:
+        return f"queued {job.wait_time:.0f} s"
+    if job.status == RUNNING:
+        # Generations report no progress of their own: estimate it from the typical run time
+        estimate = f" · ~{min(95, 100 * job.run_time / typical_run):.0f}%" if typical_run else ""
+        return f"{job.message} {job.run_time:.0f} s{estimate}"
+    if job.status == FAILED:
+        return f"Error: {job.error}"
+    return job.result["source"]
+
+
+def poll_jobs(job_ids: List[str]):
+    """Gallery, downloads, per-variant status and queue figures for the jobs of this browser."""
+    queue = get_jobs()
+    queue.start()  # after a restart: picks up the jobs that were interrupted
+    jobs = queue.get_many(job_ids or [])
+    stats = queue.stats()
+
+    gallery: List[Tuple[str, str]] = []  # (thumbnail, caption)
+    files: List[str] = []
+    lines = ["| Variant | Status | Wait | Run | Result |", "|---|---|---|---|---|"]
+    for job in jobs:
+        n = job.params["variant"]
+        run = f"{job.run_time:.1f} s" if job.run_time is not None else "–"
+        result = ""
+        if job.status == DONE:
+            path = job.result["path"]
+            if os.path.exists(path):
+                gallery.append((job.result["preview"], f"#{n} · {run}"))
+                files.append(path)
+                result = os.path.basename(path)
+            else:
+                result = "file removed by the image store quota"
+        lines.append(f"| {n} | {_job_status(job, stats.run_p50)} | {job.wait_time:.1f} s | {run} | {result} |")
+
+    if jobs:
+        # This click from its first submit to the last result (so far), against the work the variants did
+        done = sum(job.done for job in jobs)
+        wall = max(job.finished or time.time() for job in jobs) - min(job.submitted for job in jobs)
+        total = sum(job.run_time or 0.0 for job in jobs)
+        lines.append("")
+        lines.append(f"**{done}/{len(jobs)} done** · wall time {wall:.1f} s · "
+                     f"sum of variant times {total:.1f} s ({total / wall if wall else 0:.1f}x from running in parallel)")
+    table = "\n".join(lines) if jobs else ""
+    figures = f"{stats.to_markdown()}\n\n_{get_generation_cache().stats} · {get_image_store().stats}_"
+    pending = any(not job.done for job in jobs)
+    return gallery, files or None, table, figures, gr.Timer(active=pending)
+
+
 with gr.Blocks(css="footer {visibility: hidden}") as demo:
     gr.Markdown("# Generate Images with AI (LevelUP Program)")
     gr.Markdown(
-        "Enter a text prompt. The app generates an image using your Azure deployment, "
-        "previews it, and lets you download the file."
+        "Enter a text prompt. The app queues the image variants for background workers using your Azure "
+        "deployment, shows each one as soon as it is ready, and lets you download the files. "
+        "You can close or reload the page: the results are waiting when you come back."
     )
 
-    prompt = gr.Textbox(label="Prompt", placeholder="e.g., ultra-detailed dragon fruit photo, studio lighting", lines=2)
-    btn = gr.Button("Generate", variant="primary")
+    with gr.Tab("Generate"):
+        prompt = gr.Textbox(label="Prompt", placeholder="e.g., ultra-detailed dragon fruit photo, studio lighting", lines=2)
+        with gr.Row():
+            variants = gr.Slider(1, MAX_VARIANTS, value=IMAGE_VARIANTS, step=1, label="Variants")
+            btn = gr.Button("Generate", variant="primary")
+        reuse = gr.Checkbox(value=IMAGE_REUSE, label="Reuse earlier results for the same prompt (no new generation)")
+
+        gallery = gr.Gallery(label="Variants", columns=4, height="auto", interactive=False)
+        file_out = gr.File(label="Download images", file_count="multiple")
+
+        status = gr.Markdown()
+        jobs_table = gr.Markdown()
+        queue_figures = gr.Markdown()
+
+        # Job ids of the last click, kept in the browser's local storage
+        job_ids = gr.BrowserState([], storage_key="imagegen-jobs")
+        poller = gr.Timer(1.0, active=False)
+        poll_outputs = [gallery, file_out, jobs_table, queue_figures, poller]
 
-    with gr.Row():
-        img_out = gr.Image(label="Preview", interactive=False)
-        file_out = gr.File(label="Download image")
+        btn.click(fn=submit_variants, inputs=[prompt, variants, reuse], outputs=[job_ids, status, poller])
+        poller.tick(fn=poll_jobs, inputs=[job_ids], outputs=poll_outputs)
+        demo.load(fn=poll_jobs, inputs=[job_ids], outputs=poll_outputs)
 
-    status = gr.Markdown()
+    if stats_tab_enabled():
+        with gr.Tab("Stats"):
+            stats_panel()
 
-    btn.click(fn=generate_image, inputs=[prompt], outputs=[img_out, file_out, status])
+demo.queue(default_concurrency_limit=None)
 
 if __name__ == "__main__":
     demo.launch()
@@ -0,0 +1,314 @@
+"""Persistent background job queue with a worker pool.
+
+A Gradio click handler that awaits a 10-30 s generation holds the request
+for the whole time, and the result is lost when the tab closes or the
+server restarts. ``JobQueue`` decouples the two:
+
+* ``submit`` writes the job to SQLite (WAL) and returns its id at once,
+* ``workers`` asyncio workers on a background thread (with its own event
+  loop) claim queued jobs atomically and run the async ``handler``; the
+  handler reports progress through ``report(fraction, message)``,
+* the UI polls ``get_many`` (or awaits ``wait``) for status, progress and
+  the result,
+* finished jobs stay in the file (``keep_days``), so they survive
+  restarts; jobs that were running when the process stopped are queued
+  again on the next start (up to ``max_attempts``),
+* ``stats`` gives the queue depth and wait / run time percentiles.
+
+One process owns a queue file: on start it takes over every job it finds
+running.
+"""
+import asyncio
+import concurrent.futures
+import json
+import sqlite3
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+POLL_SECONDS = 1.0   # workers also look for work this often, without a wake-up
+RECENT_JOBS = 200    # for the wait / run time percentiles
+
+_COLUMNS = "id, params, status, progress, message, result, error, submitted, started, finished, attempts"
+
+
+@dataclass
+class Job:
+    id: str
+    params: Dict[str, Any]
+    status: str = QUEUED
+    progress: float = 0.0
+    message: str = ""
+    result: Optional[Dict[str, Any]] = None
+    error: Optional[str] = None
+    submitted: float = 0.0
+    started: Optional[float] = None
+    finished: Optional[float] = None
+    attempts: int = 0
+
+    @classmethod
+    def from_row(cls, row: tuple) -> "Job":
+        (job_id, params, status, progress, message, result, error,
+         submitted, started, finished, attempts) = row
+        return cls(job_id, json.loads(params), status, progress, message or "",
+                   json.loads(result) if result else None, error, submitted, started, finished, attempts)
+
+    @property
+    def done(self) -> bool:
+        return self.status in (DONE, FAILED)
+
+    @property
+    def wait_time(self) -> float:
+        """Seconds in the queue (so far, while still queued)."""
+        return (self.started if self.started is not None else time.time()) - self.submitted
+
+    @property
+    def run_time(self) -> Optional[float]:
+        if self.started is None or self.status == QUEUED:
+            return None
+        return (self.finished or time.time()) - self.started
+
+
+def _percentile(values: List[float], q: float) -> Optional[float]:
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def _seconds(value: Optional[float]) -> str:
+    return f"{value:.1f} s" if value is not None else "–"
+
+
+@dataclass
+class QueueStats:
+    workers: int
+    queued: int
+    running: int
+    done: int
+    failed: int
+    wait_p50: Optional[float]
+    wait_p95: Optional[float]
+    run_p50: Optional[float]
+    run_p95: Optional[float]
+
+    def to_markdown(self) -> str:
+        return (f"**Queue:** {self.queued} waiting · {self.running} running / {self.workers} workers · "
+                f"{self.done} done · {self.failed} failed\n\n"
+                f"**Wait** p50 {_seconds(self.wait_p50)}, p95 {_seconds(self.wait_p95)} · "
+                f"**Run** p50 {_seconds(self.run_p50)}, p95 {_seconds(self.run_p95)} "
+                f"(last {RECENT_JOBS} jobs)")
+
+
+Report = Callable[[float, str], None]
+Handler = Callable[[Job, Report], Awaitable[Dict[str, Any]]]
+
+
+class JobQueue:
+    def __init__(self,
+                 handler: Handler,
+                 path: Optional[Path] = None,
+                 workers: int = 4,
+                 max_attempts: int = 3,
+                 keep_days: float = 7):
+        self.handler = handler
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.keep_seconds = keep_days * 24 * 3600
+        self._lock = threading.Lock()
+        self._waiters: Dict[str, List[concurrent.futures.Future]] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wake: Optional[asyncio.Event] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stopping = False
+        if path is not None:
+            path.parent.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(str(path) if path is not None else ":memory:",
+                                   check_same_thread=False, isolation_level=None)
+        if path is not None:
+            self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            " id TEXT PRIMARY KEY, params TEXT NOT NULL, status TEXT NOT NULL,"
+            " progress REAL NOT NULL DEFAULT 0, message TEXT, result TEXT, error TEXT,"
+            " submitted REAL NOT NULL, started REAL, finished REAL, attempts INTEGER NOT NULL DEFAULT 0)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs(status, submitted)")
+
+    # --- lifecycle ---------------------------------------------------------
+
+    def start(self) -> None:
+        """Recover interrupted jobs and start the workers (once; ``submit`` calls it)."""
+        with self._lock:
+            if self._thread is not None:
+                if self._stopping:
+                    # Queuing now would leave the job waiting for workers that are about to exit
+                    raise RuntimeError("job queue is stopping: its workers have not exited yet")
+                return
+            self._recover()
+            self._loop = asyncio.new_event_loop()
+            self._wake = asyncio.Event()
+            self._thread = threading.Thread(target=self._run, name="job-queue", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout: float = 5.0) -> None:
+        """Let the workers finish their current job and exit; ``start`` (or ``submit``) runs them again."""
+        self._stopping = True
+        self._notify()
+        thread = self._thread
+        if thread is not None:
+            thread.join(timeout)
+            if thread.is_alive():
+                return  # still finishing a job: ``start`` refuses until it is done
+        with self._lock:
+            if self._loop is not None:
+                self._loop.close()
+            self._thread = self._loop = self._wake = None
+            self._stopping = False
+
+    def _run(self) -> None:
+        asyncio.set_event_loop(self._loop)
+        self._loop.run_until_complete(asyncio.gather(*(self._worker() for _ in range(self.workers))))
+
+    def _notify(self) -> None:
+        if self._loop is not None and self._wake is not None and not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._wake.set)
+
+    def _recover(self) -> None:
+        # Called with the lock held, before any worker runs
+        now = time.time()
+        self._db.execute(
+            "UPDATE jobs SET status = ?, error = 'interrupted by a restart', finished = ?"
+            " WHERE status = ? AND attempts >= ?",
+            (FAILED, now, RUNNING, self.max_attempts),
+        )
+        self._db.execute(
+            "UPDATE jobs SET status = ?, progress = 0, message = 'queued again after a restart', started = NULL"
+            " WHERE status = ?",
+            (QUEUED, RUNNING),
+        )
+        self._db.execute("DELETE FROM jobs WHERE finished IS NOT NULL AND finished < ?", (now - self.keep_seconds,))
+
+    # --- producer side -----------------------------------------------------
+
+    def submit(self, params: Dict[str, Any]) -> str:
+        self.start()  # first: a stopping queue refuses the job instead of keeping it
+        job_id = uuid.uuid4().hex
+        with self._lock:
+            self._db.execute(
+                "INSERT INTO jobs (id, params, status, message, submitted) VALUES (?, ?, ?, 'queued', ?)",
+                (job_id, json.dumps(params, ensure_ascii=False), QUEUED, time.time()),
+            )
+        self._notify()
+        return job_id
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            row = self._db.execute(f"SELECT {_COLUMNS} FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return Job.from_row(row) if row is not None else None
+
+    def get_many(self, job_ids: List[str]) -> List[Job]:
+        """The jobs that still exist, in the order asked for."""
+        if not job_ids:
+            return []
+        with self._lock:
+            rows = self._db.execute(
+                f"SELECT {_COLUMNS} FROM jobs WHERE id IN ({','.join('?' * len(job_ids))})", list(job_ids)
+            ).fetchall()
+        jobs = {row[0]: Job.from_row(row) for row in rows}
+        return [jobs[job_id] for job_id in job_ids if job_id in jobs]
+
+    async def wait(self, job_id: str, timeout: Optional[float] = None) -> Job:
+        """Wait (from any event loop) until the job is done or failed."""
+        future: concurrent.futures.Future = concurrent.futures.Future()
+        with self._lock:
+            self._waiters.setdefault(job_id, []).append(future)
+        try:
+            job = self.get(job_id)
+            if job is None:
+                raise KeyError(job_id)
+            if job.done:
+                return job
+            return await asyncio.wait_for(asyncio.wrap_future(future), timeout)
+        finally:
+            # A timed-out or cancelled wait must not stay registered for a job that may never finish
+            with self._lock:
+                waiters = self._waiters.get(job_id)
+                if waiters is not None and future in waiters:
+                    waiters.remove(future)
+                    if not waiters:
+                        del self._waiters[job_id]
+
+    def stats(self) -> QueueStats:
+        with self._lock:
+            counts = dict(self._db.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+            rows = self._db.execute(
+                "SELECT started - submitted, finished - started FROM jobs WHERE started IS NOT NULL"
+                " ORDER BY started DESC LIMIT ?",
+                (RECENT_JOBS,),
+            ).fetchall()
+        waits = [wait for wait, _ in rows]
+        runs = [run for _, run in rows if run is not None]
+        return QueueStats(self.workers, counts.get(QUEUED, 0), counts.get(RUNNING, 0), counts.get(DONE, 0),
+                          counts.get(FAILED, 0), _percentile(waits, 0.5), _percentile(waits, 0.95),
+                          _percentile(runs, 0.5), _percentile(runs, 0.95))
+
+    # --- worker side -------------------------------------------------------
+
+    def _claim(self) -> Optional[Job]:
+        with self._lock:
+            # One statement: two workers can never take the same job
+            row = self._db.execute(
+                f"UPDATE jobs SET status = ?, started = ?, attempts = attempts + 1, message = 'started'"
+                f" WHERE id = (SELECT id FROM jobs WHERE status = ? ORDER BY submitted, rowid LIMIT 1)"
+                f" RETURNING {_COLUMNS}",
+                (RUNNING, time.time(), QUEUED),
+            ).fetchone()
+        return Job.from_row(row) if row is not None else None
+
+    async def _worker(self) -> None:
+        while not self._stopping:
+            job = self._claim()
+            if job is None:
+                self._wake.clear()
+                job = self._claim()  # submitted between the claim and the clear
+            if job is None:
+                try:
+                    await asyncio.wait_for(self._wake.wait(), POLL_SECONDS)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            await self._execute(job)
+
+    async def _execute(self, job: Job) -> None:
+        def report(progress: float, message: str) -> None:
+            with self._lock:
+                self._db.execute("UPDATE jobs SET progress = ?, message = ? WHERE id = ?",
+                                 (max(0.0, min(progress, 1.0)), message, job.id))
+
+        try:
+            result = await self.handler(job, report)
+            self._finish(job.id, DONE, "done", result=json.dumps(result, ensure_ascii=False))
+        except Exception as e:
+            self._finish(job.id, FAILED, "failed", error=f"{type(e).__name__}: {e}")
+
+    def _finish(self, job_id: str, status: str, message: str,
+                result: Optional[str] = None, error: Optional[str] = None) -> None:
+        with self._lock:
+            row = self._db.execute(
+                f"UPDATE jobs SET status = ?, progress = ?, message = ?, result = ?, error = ?, finished = ?"
+                f" WHERE id = ? RETURNING {_COLUMNS}",
+                (status, 1.0 if status == DONE else 0.0, message, result, error, time.time(), job_id),
+            ).fetchone()
+            waiters = self._waiters.pop(job_id, [])
+        job = Job.from_row(row)
+        for future in waiters:
+            if future.set_running_or_notify_cancel():  # False when the waiter timed out
+                future.set_result(job)
@@ -0,0 +1,230 @@
+"""Client-side rate limiting and retries for Azure OpenAI calls.
+
+Two layers, shared by every call site in the process:
+
+* token buckets per deployment for requests/min (``AOAI_RPM``) and estimated
+  tokens/min (``AOAI_TPM``); a call reserves its share and waits for it
+  locally, so we stay under quota instead of collecting 429s (0 = no limit),
+* retries with exponential backoff and full jitter for 429, 408, 409, 5xx,
+  timeouts and connection errors, honouring ``Retry-After`` /
+  ``retry-after-ms`` when the service sends them (``AOAI_MAX_ATTEMPTS``).
+
+Per-deployment limits go in ``AOAI_RPM_<DEPLOYMENT>`` / ``AOAI_TPM_<DEPLOYMENT>``
+with the name upper-cased and ``-``/``.`` replaced by ``_``. The OpenAI clients
+are created with ``max_retries=0`` (see clients.py) so this module is the only
+place that retries. ``get_limiter().stats`` counts throttled time and retries.
+"""
+import asyncio
+import os
+import random
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, Optional, TypeVar
+
+T = TypeVar("T")
+
+RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504}
+COMPLETION_TOKENS_ESTIMATE = 500  # reserved for the answer until real usage is known
+
+
+class TokenBucket:
+    """Refills ``rate_per_minute`` units per minute up to one minute's worth.
+
+    ``reserve`` always takes the units, letting the bucket go into debt, and
+    returns how long the caller must wait. Callers are therefore served in
+    order of arrival and never wake up together to race for the same units.
+    """
+
+    def __init__(self, rate_per_minute: float, clock: Callable[[], float] = time.monotonic):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = rate_per_minute
+        self._clock = clock
+        self._level = self.capacity
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def reserve(self, amount: float) -> float:
+        with self._lock:
+            now = self._clock()
+            self._level = min(self.capacity, self._level + (now - self._updated) * self.rate)
+            self._updated = now
+            self._level -= min(amount, self.capacity)
+            return 0.0 if self._level >= 0 else -self._level / self.rate
+
+    def refund(self, amount: float) -> None:
+        with self._lock:
+            self._level = min(self.capacity, self._level + amount)
+
+
+@dataclass
+class LimiterStats:
+    calls: int = 0
+    throttled: int = 0            # calls that waited for a local bucket
+    throttled_seconds: float = 0.0
+    rate_limited: int = 0         # 429 responses from the service
+    retries: int = 0
+    backoff_seconds: float = 0.0
+    failures: int = 0             # calls that gave up
+
+    def __str__(self) -> str:
+        return (f"calls: {self.calls} · throttled locally: {self.throttled} ({self.throttled_seconds:.1f}s) · "
+                f"429s: {self.rate_limited} · retries: {self.retries} ({self.backoff_seconds:.1f}s backoff) · "
+                f"failed: {self.failures}")
+
+
+def _env_limit(name: str, deployment: str) -> float:
+    suffix = deployment.upper().replace("-", "_").replace(".", "_")
+    return float(os.getenv(f"{name}_{suffix}", os.getenv(name, "0")))
+
+
+def retry_after(error: BaseException) -> Optional[float]:
+    """Seconds the service asked us to wait, if it said so."""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    value = headers.get("retry-after-ms")
+    if value:
+        try:
+            return float(value) / 1000.0
+        except ValueError:
+            pass
+    value = headers.get("retry-after")
+    if value:
+        try:
+            return float(value)
+        except ValueError:
+            pass  # an HTTP date; fall back to our own backoff
+    return None
+
+
+def is_retryable(error: BaseException) -> bool:
+    import openai
+
+    if isinstance(error, (openai.APITimeoutError, openai.APIConnectionError)):
+        return True
+    return getattr(error, "status_code", None) in RETRYABLE_STATUS
+
+
+class RateLimiter:
+    def __init__(self,
+                 rpm: Optional[Dict[str, float]] = None,
+                 tpm: Optional[Dict[str, float]] = None,
+                 max_attempts: int = 6,
+                 base_delay: float = 0.5,
+                 max_delay: float = 30.0):
+        """``rpm``/``tpm`` map deployment -> limit; missing deployments are read from the environment."""
+        self._rpm = dict(rpm or {})
+        self._tpm = dict(tpm or {})
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.stats = LimiterStats()
+        self._buckets: Dict[str, tuple] = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls) -> "RateLimiter":
+        return cls(max_attempts=int(os.getenv("AOAI_MAX_ATTEMPTS", "6")))
+
+    def _buckets_for(self, deployment: str) -> tuple:
+        with self._lock:
+            if deployment not in self._buckets:
+                rpm = self._rpm.get(deployment, _env_limit("AOAI_RPM", deployment))
+                tpm = self._tpm.get(deployment, _env_limit("AOAI_TPM", deployment))
+                self._buckets[deployment] = (
+                    TokenBucket(rpm) if rpm > 0 else None,
+                    TokenBucket(tpm) if tpm > 0 else None,
+                )
+            return self._buckets[deployment]
+
+    def reserve(self, deployment: str, tokens: float) -> float:
+        """Take one request and ``tokens`` tokens from the buckets; return the wait in seconds."""
+        requests, token_bucket = self._buckets_for(deployment)
+        wait = 0.0
+        if requests is not None:
+            wait = requests.reserve(1)
+        if token_bucket is not None:
+            wait = max(wait, token_bucket.reserve(tokens))
+        # Callers run on several threads (``call`` inside ``to_thread`` workers)
+        with self._lock:
+            self.stats.calls += 1
+            if wait > 0:
+                self.stats.throttled += 1
+                self.stats.throttled_seconds += wait
+        return wait
+
+    def settle(self, deployment: str, estimated: float, actual: Optional[float]) -> None:
+        """Give back the part of the token estimate the call did not use."""
+        _, token_bucket = self._buckets_for(deployment)
+        if token_bucket is not None and actual is not None and actual < estimated:
+            token_bucket.refund(estimated - actual)
+
+    def backoff(self, attempt: int, error: BaseException) -> Optional[float]:
+        """Delay before the next attempt, or None to give up and re-raise."""
+        if attempt + 1 >= self.max_attempts or not is_retryable(error):
+            with self._lock:
+                self.stats.failures += 1
+            return None
+        delay = retry_after(error)
+        if delay is None:
+            # Full jitter: spread retries so throttled callers do not come back together
+            delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        with self._lock:
+            if getattr(error, "status_code", None) == 429:
+                self.stats.rate_limited += 1
+            self.stats.retries += 1
+            self.stats.backoff_seconds += delay
+        return delay
+
+    def call(self, deployment: str, fn: Callable[[], T], tokens: float = 0) -> T:
+        time.sleep(self.reserve(deployment, tokens))
+        attempt = 0
+        while True:
+            try:
+                return fn()
+            except Exception as e:
+                delay = self.backoff(attempt, e)
+                if delay is None:
+                    raise
+                time.sleep(delay)
+                attempt += 1
+
+    async def acall(self, deployment: str, fn: Callable[[], Awaitable[T]], tokens: float = 0) -> T:
+        await asyncio.sleep(self.reserve(deployment, tokens))
+        attempt = 0
+        while True:
+            try:
+                return await fn()
+            except Exception as e:
+                delay = self.backoff(attempt, e)
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+                attempt += 1
+
+
+_limiter: Optional[RateLimiter] = None
+_limiter_lock = threading.Lock()
+
+
+def get_limiter() -> RateLimiter:
+    """The process-wide limiter, configured from the environment on first use."""
+    global _limiter
+    with _limiter_lock:
+        if _limiter is None:
+            _limiter = RateLimiter.from_env()
+        return _limiter
+
+
+def estimate_tokens(messages: Any, completion_tokens: int = COMPLETION_TOKENS_ESTIMATE) -> int:
+    """Prompt tokens of a message list plus a reservation for the answer."""
+    from conversation import count_tokens
+
+    return count_tokens(messages) + completion_tokens
+
+
+def usage_tokens(response: Any) -> Optional[int]:
+    usage = getattr(response, "usage", None)
+    return getattr(usage, "total_tokens", None) if usage is not None else None
@@ -0,0 +1,227 @@
+"""Server-side conversation state for the Gradio chat apps.
+
+``gr.State`` kept every tab's full message list in RAM for as long as the
+process lived. ``SessionStore`` keeps it per ``request.session_hash`` instead:
+
+* hot sessions stay in memory in LRU order, capped by a total byte budget
+  (``CHAT_SESSIONS_MEMORY_MB``) and a session count (``CHAT_SESSIONS_MAX``),
+* sessions pushed out of memory, or idle for ``CHAT_SESSION_IDLE`` seconds,
+  are spilled as zlib-compressed JSON to a SQLite file
+  (``CHAT_SESSIONS_PATH``, ``0`` = memory only, evicted sessions are lost)
+  and loaded back on their next message,
+* sessions untouched for ``CHAT_SESSION_TTL`` seconds are deleted.
+
+Sizes are estimated from the Python objects (``deep_size``), so the budget
+tracks what the process actually holds. ``stats()`` and ``sizes()`` report the
+memory per session and in total for the status panel.
+"""
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+Messages = List[Dict[str, Any]]
+
+DEFAULT_PATH = Path.home() / ".cache" / "levelup" / "sessions.sqlite"
+SWEEP_EVERY = 30  # seconds between idle/TTL sweeps, done on the next access
+
+
+def deep_size(value: Any) -> int:
+    """Approximate bytes held by a JSON-like value (dicts, lists, strings, numbers)."""
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(deep_size(k) + deep_size(v) for k, v in value.items())
+    elif isinstance(value, (list, tuple)):
+        size += sum(deep_size(v) for v in value)
+    return size
+
+
+def _format_bytes(n: float) -> str:
+    for unit in ("B", "kB", "MB"):
+        if n < 1024:
+            return f"{n:.0f} {unit}" if unit == "B" else f"{n:.1f} {unit}"
+        n /= 1024
+    return f"{n:.1f} GB"
+
+
+@dataclass
+class SessionStats:
+    hot: int = 0
+    hot_bytes: int = 0
+    spilled: int = 0
+    spilled_bytes: int = 0   # compressed, on disk
+    rehydrated: int = 0
+    expired: int = 0
+
+    def to_markdown(self) -> str:
+        return (f"**Sessions in memory:** {self.hot} ({_format_bytes(self.hot_bytes)}) · "
+                f"**On disk:** {self.spilled} ({_format_bytes(self.spilled_bytes)}) · "
+                f"**Reloaded:** {self.rehydrated} · **Expired:** {self.expired}")
+
+
+class SessionStore:
+    def __init__(self,
+                 memory_budget: int = 64 * 1024 * 1024,
+                 max_sessions: int = 1000,
+                 idle_seconds: float = 600,
+                 ttl: float = 24 * 3600,
+                 path: Optional[Path] = DEFAULT_PATH,
+                 clock: Callable[[], float] = time.time):
+        self.memory_budget = memory_budget
+        self.max_sessions = max_sessions
+        self.idle_seconds = idle_seconds
+        self.ttl = ttl
+        self._clock = clock
+        # session id -> (messages, size in bytes, last access)
+        self._hot: "OrderedDict[str, Tuple[Messages, int, float]]" = OrderedDict()
+        self._hot_bytes = 0
+        self._rehydrated = 0
+        self._expired = 0
+        self._last_sweep = clock()
+        self._lock = threading.RLock()
+        self._db: Optional[sqlite3.Connection] = None
+        if path is not None:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            self._db = sqlite3.connect(str(path), check_same_thread=False, isolation_level=None)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS sessions ("
+                " id TEXT PRIMARY KEY, data BLOB NOT NULL,"
+                " size INTEGER NOT NULL, last_access REAL NOT NULL)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS sessions_last_access ON sessions(last_access)")
+
+    @classmethod
+    def from_env(cls) -> "SessionStore":
+        path = os.getenv("CHAT_SESSIONS_PATH", "")
+        if path.strip().lower() in {"0", "off", "false", "no"}:
+            db_path = None
+        else:
+            db_path = Path(path).expanduser() if path else DEFAULT_PATH
+        return cls(
+            memory_budget=int(float(os.getenv("CHAT_SESSIONS_MEMORY_MB", "64")) * 1024 * 1024),
+            max_sessions=int(os.getenv("CHAT_SESSIONS_MAX", "1000")),
+            idle_seconds=float(os.getenv("CHAT_SESSION_IDLE", "600")),
+            ttl=float(os.getenv("CHAT_SESSION_TTL", str(24 * 3600))),
+            path=db_path,
+        )
+
+    def get(self, session_id: str, default: Callable[[], Messages]) -> Messages:
+        """The session's message list, reloaded from disk if needed, or a new one from ``default``."""
+        now = self._clock()
+        with self._lock:
+            self._sweep(now)
+            entry = self._hot.get(session_id)
+            if entry is not None:
+                self._hot[session_id] = (entry[0], entry[1], now)
+                self._hot.move_to_end(session_id)
+                return entry[0]
+            messages = self._load(session_id, now)
+            if messages is None:
+                messages = default()
+            else:
+                self._rehydrated += 1
+            self._insert(session_id, messages, now)
+            return messages
+
+    def put(self, session_id: str, messages: Messages) -> None:
+        """Store the list after a turn; its size is measured again here."""
+        now = self._clock()
+        with self._lock:
+            self._discard_hot(session_id)
+            if self._db is not None:
+                # A copy spilled while the turn was running is now stale
+                self._db.execute("DELETE FROM sessions WHERE id = ?", (session_id,))
+            self._insert(session_id, messages, now)
+
+    def drop(self, session_id: str) -> None:
+        with self._lock:
+            self._discard_hot(session_id)
+            if self._db is not None:
+                self._db.execute("DELETE FROM sessions WHERE id = ?", (session_id,))
+
+    def sizes(self) -> List[Tuple[str, int, str]]:
+        """(session id, bytes, "memory" or "disk") for every session, largest first."""
+        with self._lock:
+            rows = [(sid, size, "memory") for sid, (_, size, _) in self._hot.items()]
+            if self._db is not None:
+                rows += [(sid, size, "disk") for sid, size in self._db.execute("SELECT id, size FROM sessions")]
+        return sorted(rows, key=lambda row: row[1], reverse=True)
+
+    def stats(self) -> SessionStats:
+        with self._lock:
+            spilled, spilled_bytes = (0, 0)
+            if self._db is not None:
+                spilled, spilled_bytes = self._db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM sessions").fetchone()
+            return SessionStats(
+                hot=len(self._hot),
+                hot_bytes=self._hot_bytes,
+                spilled=spilled,
+                spilled_bytes=spilled_bytes,
+                rehydrated=self._rehydrated,
+                expired=self._expired,
+            )
+
+    def to_markdown(self, top: int = 5) -> str:
+        lines = [self.stats().to_markdown()]
+        for sid, size, where in self.sizes()[:top]:
+            lines.append(f"- `{sid[:8]}` {_format_bytes(size)} ({where})")
+        return "\n".join(lines)
+
+    def _insert(self, session_id: str, messages: Messages, now: float) -> None:
+        size = deep_size(messages)
+        self._hot[session_id] = (messages, size, now)
+        self._hot_bytes += size
+        # Keep at least the session being served, even if it alone is over budget
+        while len(self._hot) > 1 and (self._hot_bytes > self.memory_budget or len(self._hot) > self.max_sessions):
+            oldest = next(iter(self._hot))
+            self._spill(oldest)
+
+    def _discard_hot(self, session_id: str) -> None:
+        entry = self._hot.pop(session_id, None)
+        if entry is not None:
+            self._hot_bytes -= entry[1]
+
+    def _spill(self, session_id: str) -> None:
+        messages, size, last_access = self._hot.pop(session_id)
+        self._hot_bytes -= size
+        if self._db is None:
+            return
+        data = zlib.compress(json.dumps(messages, ensure_ascii=False, separators=(",", ":")).encode("utf-8"))
+        self._db.execute(
+            "INSERT OR REPLACE INTO sessions (id, data, size, last_access) VALUES (?, ?, ?, ?)",
+            (session_id, data, len(data), last_access),
+        )
+
+    def _load(self, session_id: str, now: float) -> Optional[Messages]:
+        if self._db is None:
+            return None
+        row = self._db.execute(
+            "SELECT data FROM sessions WHERE id = ? AND last_access > ?", (session_id, now - self.ttl)
+        ).fetchone()
+        if row is None:
+            return None
+        self._db.execute("DELETE FROM sessions WHERE id = ?", (session_id,))
+        return json.loads(zlib.decompress(row[0]).decode("utf-8"))
+
+    def _sweep(self, now: float) -> None:
+        if now - self._last_sweep < SWEEP_EVERY:
+            return
+        self._last_sweep = now
+        for session_id, (_, _, last_access) in list(self._hot.items()):
+            if now - last_access > self.ttl:
+                self._discard_hot(session_id)
+                self._expired += 1
+            elif now - last_access > self.idle_seconds:
+                self._spill(session_id)
+        if self._db is not None:
+            self._expired += self._db.execute(
+                "DELETE FROM sessions WHERE last_access <= ?", (now - self.ttl,)
+            ).rowcount
@@ -0,0 +1,73 @@
+"""Helpers for streaming chat completions token by token.
+
+The chat apps use these so the first words of an answer show up as soon as
+the model produces them, instead of after the whole completion is ready.
+Set ``CHAT_STREAMING=0`` in ``.env`` to fall back to one blocking call.
+Streams ask for ``stream_options={"include_usage": True}`` so the last chunk
+carries the token usage, which goes to telemetry and the rate limiter.
+"""
+import os
+from typing import Any, AsyncIterable, AsyncIterator, Dict, Iterable, Iterator, List, Optional
+
+from ratelimit import estimate_tokens, get_limiter, usage_tokens
+from telemetry import Call, track
+
+STREAM_OPTIONS = {"include_usage": True}
+
+
+def streaming_enabled() -> bool:
+    return os.getenv("CHAT_STREAMING", "1").strip().lower() not in {"0", "false", "no", "off"}
+
+
+def iter_deltas(stream: Iterable[Any], call: Optional[Call] = None) -> Iterator[str]:
+    """Yield the text pieces of a ``stream=True`` chat completion."""
+    for chunk in stream:
+        # Azure sends a content-filter chunk without choices first, and the
+        # usage chunk at the end has no choices either.
+        if call is not None and getattr(chunk, "usage", None) is not None:
+            call.usage(chunk.usage)
+        if not chunk.choices:
+            continue
+        delta = chunk.choices[0].delta
+        if delta is not None and delta.content:
+            if call is not None:
+                call.first_token()
+            yield delta.content
+
+
+async def aiter_deltas(stream: AsyncIterable[Any], call: Optional[Call] = None) -> AsyncIterator[str]:
+    """Async variant of ``iter_deltas`` for the ``AsyncOpenAI`` client."""
+    async for chunk in stream:
+        if call is not None and getattr(chunk, "usage", None) is not None:
+            call.usage(chunk.usage)
+        if not chunk.choices:
+            continue
+        delta = chunk.choices[0].delta
+        if delta is not None and delta.content:
+            if call is not None:
+                call.first_token()
+            yield delta.content
+
+
+def stream_chat(client: Any,
+                model: str,
+                messages: List[Dict[str, Any]],
+                stream: bool = True,
+                operation: str = "chat",
+                **params: Any) -> Iterator[str]:
+    """Yield the assistant answer as deltas (or as one piece when ``stream`` is off)."""
+    limiter = get_limiter()
+    tokens = estimate_tokens(messages)
+    with track(operation, model, messages) as call:
+        if not stream:
+            resp = limiter.call(model, lambda: client.chat.completions.create(model=model, messages=messages, **params), tokens)
+            call.usage(resp.usage)
+            limiter.settle(model, tokens, usage_tokens(resp))
+            yield resp.choices[0].message.content or ""
+            return
+        # Throttling errors arrive with the response headers, before the first chunk
+        response = limiter.call(model, lambda: client.chat.completions.create(
+            model=model, messages=messages, stream=True, stream_options=STREAM_OPTIONS, **params
+        ), tokens)
+        yield from iter_deltas(response, call)
+        limiter.settle(model, tokens, call.total_tokens)
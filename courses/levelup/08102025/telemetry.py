@@ -0,0 +1,335 @@
+"""Latency and token-usage instrumentation for every model call.
+
+Wrap a call in ``track(operation, deployment, payload)``::
+
+    with track("chat", deployment, messages) as call:
+        for chunk in stream:
+            call.first_token()   # first content delta
+            ...
+        call.usage(chunk.usage)  # or call.usage(resp.usage)
+
+Each finished call becomes a ``CallRecord``: time to first token, total
+latency, prompt/completion tokens, completion tokens per second, request
+payload bytes (base64 images counted separately) and the error class, if any.
+Records go to
+
+* in-process counters and histograms, served in Prometheus text format by
+  ``serve_metrics`` on ``METRICS_PORT`` (unset or 0 = off),
+* a rotating JSONL log (``TELEMETRY_LOG``, default
+  ``~/.cache/levelup/calls.jsonl``, ``0`` = off; ``TELEMETRY_LOG_MB`` and
+  ``TELEMETRY_LOG_BACKUPS`` set the rotation),
+* a window of recent calls for the p50/p95/p99 table in the Gradio "Stats"
+  tab (``stats_panel``, hidden with ``STATS_TAB=0``).
+"""
+import json
+import logging
+import os
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from logging.handlers import RotatingFileHandler
+from pathlib import Path
+from typing import Any, Deque, Dict, Iterator, List, Optional, Tuple
+
+DEFAULT_LOG_PATH = Path.home() / ".cache" / "levelup" / "calls.jsonl"
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1, 2, 5, 10, 20, 30, 60, 120)
+RECENT_CALLS = 2000  # per operation, for the percentile table
+
+
+def _off(value: str) -> bool:
+    return value.strip().lower() in {"0", "off", "false", "no"}
+
+
+def payload_sizes(payload: Any) -> Tuple[int, int]:
+    """(request JSON bytes, bytes of base64 ``data:`` image URLs inside it)."""
+    if payload is None:
+        return 0, 0
+    if isinstance(payload, (str, bytes)):
+        return len(payload), 0
+    image_bytes = 0
+    stripped = []
+    for message in payload if isinstance(payload, list) else [payload]:
+        content = message.get("content") if isinstance(message, dict) else None
+        if isinstance(content, list):
+            parts = []
+            for part in content:
+                url = (part.get("image_url") or {}).get("url", "") if isinstance(part, dict) else ""
+                if url.startswith("data:"):
+                    image_bytes += len(url)
+                    # Serialized without the image: base64 is ASCII and needs no JSON escaping,
+                    # so its length adds up exactly and the multi-MB string is never copied
+                    part = {**part, "image_url": {**part["image_url"], "url": ""}}
+                parts.append(part)
+            message = {**message, "content": parts}
+        stripped.append(message)
+    body = json.dumps(stripped if isinstance(payload, list) else stripped[0], ensure_ascii=False, default=str)
+    return len(body.encode("utf-8")) + image_bytes, image_bytes
+
+
+@dataclass
+class CallRecord:
+    ts: float
+    operation: str
+    deployment: str
+    latency_s: float
+    ttft_s: Optional[float] = None
+    prompt_tokens: Optional[int] = None
+    completion_tokens: Optional[int] = None
+    payload_bytes: int = 0
+    image_bytes: int = 0
+    error: Optional[str] = None
+
+    @property
+    def tokens_per_s(self) -> Optional[float]:
+        """Completion tokens per second of generation (after the first token when streaming)."""
+        if not self.completion_tokens:
+            return None
+        generating = self.latency_s - (self.ttft_s or 0.0)
+        return self.completion_tokens / generating if generating > 0 else None
+
+
+class Call:
+    """Handle passed to the body of ``track``."""
+
+    def __init__(self, operation: str, deployment: str, payload: Any):
+        self.operation = operation
+        self.deployment = deployment
+        self.payload_bytes, self.image_bytes = payload_sizes(payload)
+        self.started = time.perf_counter()
+        self.ttft: Optional[float] = None
+        self.prompt_tokens: Optional[int] = None
+        self.completion_tokens: Optional[int] = None
+
+    def first_token(self) -> None:
+        if self.ttft is None:
+            self.ttft = time.perf_counter() - self.started
+
+    def usage(self, usage: Any) -> None:
+        """Take the token counts from ``resp.usage`` (or the last chunk of a stream)."""
+        if usage is None:
+            return
+        self.prompt_tokens = getattr(usage, "prompt_tokens", None)
+        self.completion_tokens = getattr(usage, "completion_tokens", None)
+
+    @property
+    def total_tokens(self) -> Optional[int]:
+        if self.prompt_tokens is None and self.completion_tokens is None:
+            return None
+        return (self.prompt_tokens or 0) + (self.completion_tokens or 0)
+
+    def record(self, error: Optional[str] = None) -> CallRecord:
+        return CallRecord(
+            ts=time.time(),
+            operation=self.operation,
+            deployment=self.deployment,
+            latency_s=time.perf_counter() - self.started,
+            ttft_s=self.ttft,
+            prompt_tokens=self.prompt_tokens,
+            completion_tokens=self.completion_tokens,
+            payload_bytes=self.payload_bytes,
+            image_bytes=self.image_bytes,
+            error=error,
+        )
+
+
+class _Histogram:
+    def __init__(self):
+        self.counts = [0] * len(LATENCY_BUCKETS)
+        self.total = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if value <= bound:
+                self.counts[i] += 1
+        self.total += 1
+        self.sum += value
+
+
+def _percentile(sorted_values: List[float], q: float) -> float:
+    index = min(len(sorted_values) - 1, max(0, round(q * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def _labels(**labels: str) -> str:
+    body = ",".join(f'{k}="{str(v)}"' for k, v in labels.items())
+    return "{" + body + "}"
+
+
+class Telemetry:
+    def __init__(self, log_path: Optional[Path] = None, log_bytes: int = 10 * 1024 * 1024, log_backups: int = 5):
+        self._lock = threading.Lock()
+        self._calls: Dict[Tuple[str, str, str], int] = defaultdict(int)        # (op, deployment, outcome)
+        self._tokens: Dict[Tuple[str, str, str], int] = defaultdict(int)       # (op, deployment, kind)
+        self._payload: Dict[Tuple[str, str], int] = defaultdict(int)
+        self._latency: Dict[Tuple[str, str], _Histogram] = defaultdict(_Histogram)
+        self._ttft: Dict[Tuple[str, str], _Histogram] = defaultdict(_Histogram)
+        self._recent: Dict[str, Deque[CallRecord]] = defaultdict(lambda: deque(maxlen=RECENT_CALLS))
+        self._log: Optional[logging.Logger] = None
+        if log_path is not None:
+            log_path.parent.mkdir(parents=True, exist_ok=True)
+            handler = RotatingFileHandler(log_path, maxBytes=log_bytes, backupCount=log_backups, encoding="utf-8")
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            self._log = logging.getLogger(f"levelup.telemetry.{id(self)}")
+            self._log.propagate = False
+            self._log.setLevel(logging.INFO)
+            self._log.addHandler(handler)
+
+    @classmethod
+    def from_env(cls) -> "Telemetry":
+        path = os.getenv("TELEMETRY_LOG", "")
+        return cls(
+            log_path=None if _off(path) else (Path(path).expanduser() if path else DEFAULT_LOG_PATH),
+            log_bytes=int(float(os.getenv("TELEMETRY_LOG_MB", "10")) * 1024 * 1024),
+            log_backups=int(os.getenv("TELEMETRY_LOG_BACKUPS", "5")),
+        )
+
+    def observe(self, record: CallRecord) -> None:
+        key = (record.operation, record.deployment)
+        with self._lock:
+            self._calls[key + ("error" if record.error else "ok",)] += 1
+            self._payload[key] += record.payload_bytes
+            self._latency[key].observe(record.latency_s)
+            if record.ttft_s is not None:
+                self._ttft[key].observe(record.ttft_s)
+            self._tokens[key + ("prompt",)] += record.prompt_tokens or 0
+            self._tokens[key + ("completion",)] += record.completion_tokens or 0
+            self._recent[record.operation].append(record)
+        if self._log is not None:
+            line = asdict(record)
+            line["tokens_per_s"] = record.tokens_per_s
+            self._log.info(json.dumps(line, ensure_ascii=False))
+
+    def prometheus(self) -> str:
+        """All counters in the Prometheus text exposition format."""
+        out: List[str] = []
+        with self._lock:
+            out += ["# HELP levelup_model_calls_total Model calls by outcome.",
+                    "# TYPE levelup_model_calls_total counter"]
+            for (op, dep, outcome), n in sorted(self._calls.items()):
+                out.append(f"levelup_model_calls_total{_labels(operation=op, deployment=dep, outcome=outcome)} {n}")
+            out += ["# HELP levelup_model_tokens_total Tokens reported by the service.",
+                    "# TYPE levelup_model_tokens_total counter"]
+            for (op, dep, kind), n in sorted(self._tokens.items()):
+                out.append(f"levelup_model_tokens_total{_labels(operation=op, deployment=dep, kind=kind)} {n}")
+            out += ["# HELP levelup_model_payload_bytes_total Request payload bytes, images included.",
+                    "# TYPE levelup_model_payload_bytes_total counter"]
+            for (op, dep), n in sorted(self._payload.items()):
+                out.append(f"levelup_model_payload_bytes_total{_labels(operation=op, deployment=dep)} {n}")
+            for name, help_text, histograms in (
+                ("levelup_model_call_seconds", "Total latency of a model call.", self._latency),
+                ("levelup_model_ttft_seconds", "Time to the first streamed token.", self._ttft),
+            ):
+                out += [f"# HELP {name} {help_text}", f"# TYPE {name} histogram"]
+                for (op, dep), h in sorted(histograms.items()):
+                    for bound, count in zip(LATENCY_BUCKETS, h.counts):
+                        out.append(f"{name}_bucket{_labels(operation=op, deployment=dep, le=bound)} {count}")
+                    out.append(f"{name}_bucket{_labels(operation=op, deployment=dep, le='+Inf')} {h.total}")
+                    out.append(f"{name}_sum{_labels(operation=op, deployment=dep)} {h.sum:.6f}")
+                    out.append(f"{name}_count{_labels(operation=op, deployment=dep)} {h.total}")
+        return "\n".join(out) + "\n"
+
+    def summary(self) -> List[Dict[str, Any]]:
+        """Per operation: calls, errors and p50/p95/p99 over the recent window."""
+        with self._lock:
+            recent = {op: list(records) for op, records in self._recent.items()}
+        rows = []
+        for op, records in sorted(recent.items()):
+            row: Dict[str, Any] = {"operation": op, "calls": len(records),
+                                   "errors": sum(1 for r in records if r.error)}
+            for name, values in (
+                ("latency", [r.latency_s for r in records if not r.error]),
+                ("ttft", [r.ttft_s for r in records if r.ttft_s is not None]),
+                ("tokens_per_s", [r.tokens_per_s for r in records if r.tokens_per_s]),
+            ):
+                values.sort()
+                for q in (50, 95, 99):
+                    row[f"{name}_p{q}"] = _percentile(values, q / 100) if values else None
+            rows.append(row)
+        return rows
+
+    def to_markdown(self) -> str:
+        rows = self.summary()
+        if not rows:
+            return "No model calls yet."
+
+        def fmt(value: Optional[float], unit: str = "s") -> str:
+            return "–" if value is None else (f"{value:.2f}{unit}" if unit == "s" else f"{value:.0f}")
+
+        lines = ["| operation | calls | errors | latency p50 / p95 / p99 | TTFT p50 / p95 / p99 | tokens/s p50 |",
+                 "|---|---:|---:|---|---|---:|"]
+        for r in rows:
+            latency = " / ".join(fmt(r[f"latency_p{q}"]) for q in (50, 95, 99))
+            ttft = " / ".join(fmt(r[f"ttft_p{q}"]) for q in (50, 95, 99))
+            lines.append(f"| {r['operation']} | {r['calls']} | {r['errors']} | {latency} | {ttft} | "
+                         f"{fmt(r['tokens_per_s_p50'], '')} |")
+        return "\n".join(lines)
+
+
+_telemetry: Optional[Telemetry] = None
+_telemetry_lock = threading.Lock()
+
+
+def get_telemetry() -> Telemetry:
+    """The process-wide recorder, configured from the environment on first use."""
+    global _telemetry
+    with _telemetry_lock:
+        if _telemetry is None:
+            _telemetry = Telemetry.from_env()
+            port = int(os.getenv("METRICS_PORT", "0") or 0)
+            if port:
+                serve_metrics(port, _telemetry)
+        return _telemetry
+
+
+@contextmanager
+def track(operation: str, deployment: str, payload: Any = None) -> Iterator[Call]:
+    """Time one model call; exceptions are recorded by class name and re-raised."""
+    call = Call(operation, deployment, payload)
+    try:
+        yield call
+    except BaseException as e:
+        get_telemetry().observe(call.record(error=type(e).__name__))
+        raise
+    get_telemetry().observe(call.record())
+
+
+def serve_metrics(port: int, telemetry: Optional[Telemetry] = None, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+    """Serve ``/metrics`` in the Prometheus text format from a daemon thread."""
+    telemetry = telemetry or get_telemetry()
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self) -> None:
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = telemetry.prometheus().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args: Any) -> None:
+            pass
+
+    server = ThreadingHTTPServer((os.getenv("METRICS_HOST", host), port), Handler)
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    return server
+
+
+def stats_tab_enabled() -> bool:
+    return not _off(os.getenv("STATS_TAB", "1"))
+
+
+def stats_panel(every: float = 5.0) -> None:
+    """Gradio components for the "Stats" tab; call inside ``gr.Tab("Stats")``."""
+    import gradio as gr
+
+    table = gr.Markdown(get_telemetry().to_markdown())
+    refresh = gr.Button("Refresh")
+    refresh.click(lambda: get_telemetry().to_markdown(), outputs=[table])
+    gr.Timer(every).tick(lambda: get_telemetry().to_markdown(), outputs=[table])
@@ -0,0 +1,124 @@
+"""Multi-turn conversations about images that send each image at most once.
+
+Keeping the raw chat history would repeat an image's base64 payload in
+every later request, so request size would grow with turns x image size.
+``VisionConversation`` stores an image in the history only as a reference,
+``{"type": "image_ref", "ref": "<path or url>", "description": ...}``, and
+``build`` expands it when the request is made:
+
+* the image in use (the most recent one) is attached once, to the newest
+  user message,
+* its earlier mentions become a short note that it is attached below,
+* older images are replaced by their textual description, which the model
+  writes once (``describe_messages``) when a newer image takes their place.
+
+The history is a plain message list, so ``SessionStore`` can keep and spill
+it like the text chats.
+"""
+from typing import Any, Callable, Dict, List, Optional
+
+from session_store import Messages
+
+IMAGE_REF = "image_ref"
+DESCRIBE_PROMPT = (
+    "Describe this image in 2-4 factual sentences: what is in it, colours, condition and any visible text. "
+    "The description will stand in for the image later in the conversation."
+)
+
+
+def describe_messages(part: Dict[str, Any]) -> Messages:
+    """Request for the description that replaces an image once a newer one is in use."""
+    return [{"role": "user", "content": [{"type": "text", "text": DESCRIBE_PROMPT}, part]}]
+
+
+class VisionConversation:
+    def __init__(self, messages: Messages):
+        self.messages = messages
+
+    @classmethod
+    def new(cls, system: str) -> "VisionConversation":
+        return cls([{"role": "system", "content": system}])
+
+    def set_system(self, system: str) -> None:
+        self.messages[0]["content"] = system
+
+    def add_user(self, text: str, ref: Optional[str] = None) -> None:
+        content: List[Dict[str, Any]] = []
+        if text:
+            content.append({"type": "text", "text": text})
+        if ref is not None:
+            content.append({"type": IMAGE_REF, "ref": ref, "description": self.description(ref)})
+        self.messages.append({"role": "user", "content": content})
+
+    def add_assistant(self, text: str) -> None:
+        self.messages.append({"role": "assistant", "content": text})
+
+    def _image_parts(self) -> List[Dict[str, Any]]:
+        return [part for message in self.messages if isinstance(message["content"], list)
+                for part in message["content"] if part.get("type") == IMAGE_REF]
+
+    def refs(self) -> List[str]:
+        """Images in the order they were first attached."""
+        return list(dict.fromkeys(part["ref"] for part in self._image_parts()))
+
+    @property
+    def active(self) -> Optional[str]:
+        parts = self._image_parts()
+        return parts[-1]["ref"] if parts else None
+
+    def description(self, ref: str) -> Optional[str]:
+        for part in self._image_parts():
+            if part["ref"] == ref and part.get("description"):
+                return part["description"]
+        return None
+
+    def undescribed(self) -> List[str]:
+        """Images that ``build`` will replace by text but that have no description yet."""
+        return [ref for ref in self.refs() if ref != self.active and not self.description(ref)]
+
+    def describe(self, ref: str, text: str) -> None:
+        for part in self._image_parts():
+            if part["ref"] == ref:
+                part["description"] = text
+
+    def build(self, part: Callable[[str], Dict[str, Any]]) -> Messages:
+        """The messages to send; ``part(ref)`` gives the ``image_url`` content part of the active image."""
+        numbers = {ref: n for n, ref in enumerate(self.refs(), start=1)}
+        active = self.active
+        last_user = max((i for i, m in enumerate(self.messages) if m["role"] == "user"), default=-1)
+        outgoing: Messages = []
+        for i, message in enumerate(self.messages):
+            if not isinstance(message["content"], list):
+                outgoing.append(dict(message))
+                continue
+            content = []
+            for piece in message["content"]:
+                if piece.get("type") != IMAGE_REF:
+                    content.append(piece)
+                elif piece["ref"] != active:
+                    description = piece.get("description") or "no description available"
+                    content.append({"type": "text", "text": f"[Image {numbers[piece['ref']]}, no longer attached: {description}]"})
+                elif i != last_user:
+                    content.append({"type": "text", "text": f"[Image {numbers[active]}, attached to the latest message]"})
+            if i == last_user and active is not None:
+                # The image in use always rides on the newest question, exactly once
+                content.append({"type": "text", "text": f"[Image {numbers[active]}]"})
+                content.append(part(active))
+            outgoing.append({"role": message["role"], "content": content})
+        return outgoing
+
+    def chat_history(self, show_images: bool = True) -> List[Dict[str, Any]]:
+        """The conversation as ``gr.Chatbot(type="messages")`` entries; local images are shown as files."""
+        history: List[Dict[str, Any]] = []
+        for message in self.messages[1:]:
+            if not isinstance(message["content"], list):
+                history.append({"role": message["role"], "content": message["content"]})
+                continue
+            for piece in message["content"]:
+                if piece.get("type") != IMAGE_REF:
+                    history.append({"role": message["role"], "content": piece["text"]})
+                elif show_images and not piece["ref"].startswith(("http://", "https://")):
+                    history.append({"role": message["role"], "content": {"path": piece["ref"]}})
+                else:
+                    history.append({"role": message["role"], "content": f"[image: {piece['ref']}]"})
+        return history
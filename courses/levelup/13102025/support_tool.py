@@ -1,49 +1,66 @@
 import json       # Moduł json — służy do kodowania/dekodowania danych w formacie JSON
-import uuid       # Moduł uuid — generuje unikalne identyfikatory, przydatne np. do numerów zgłoszeń
-from pathlib import Path   # Path — ułatwia pracę ze ścieżkami plików w sposób niezależny od systemu operacyjnego
-from typing import Any, Callable, Set  # Typy używane do oznaczenia typów zmiennych i zbiorów funkcji
+from typing import Any, Callable, Dict, List, Set  # Typy używane do oznaczenia typów zmiennych i zbiorów funkcji
+
+# Magazyn zgłoszeń (SQLite z indeksami albo dawne pliki tekstowe) i zapis grupowy — szczegóły w ticket_store.py
+from ticket_store import get_ticket_store, get_ticket_writer
 
 # Tworzymy funkcję do zgłaszania problemu technicznego (support ticket)
 def submit_support_ticket(email_address: str, description: str) -> str:
-    """Generate a support ticket file and return a confirmation message in JSON."""
-    # Pobieramy katalog, w którym znajduje się ten skrypt (plik .py)
-    # Dzięki temu plik zgłoszenia zostanie zapisany w tym samym folderze.
-    script_dir = Path(__file__).parent  
-    
-    # Generujemy unikalny numer zgłoszenia z UUID (uniwersalnego identyfikatora)
-    # Usuwamy myślniki i bierzemy tylko pierwsze 6 znaków dla czytelności.
-    ticket_number = str(uuid.uuid4()).replace("-", "")[:6]
-    
-    # Tworzymy nazwę pliku w formacie ticket-XXXXXX.txt
-    file_name = f"ticket-{ticket_number}.txt"
-    
-    # Łączymy katalog skryptu z nazwą pliku, aby uzyskać pełną ścieżkę do pliku.
-    file_path = script_dir / file_name
-
-    # Przygotowujemy treść zgłoszenia, zawierającą numer, adres e-mail i opis problemu.
-    text = (
-        f"Support ticket: {ticket_number}\n"
-        f"Submitted by: {email_address}\n"
-        f"Description:\n{description}"
-    )
-
-    # Zapisujemy treść zgłoszenia do pliku tekstowego.
-    # Jeśli plik nie istnieje, zostanie utworzony automatycznie.
-    file_path.write_text(text)
-
-    # Tworzymy komunikat zwrotny w formacie JSON,
+    """Save a support ticket in the ticket store and return a confirmation message in JSON."""
+    # Pobieramy magazyn zgłoszeń wybrany w TICKET_STORE (domyślnie plik tickets.sqlite obok skryptu).
+    store = get_ticket_store()
+
+    # Zapisujemy zgłoszenie. Otrzymuje numer: 26 znaków, rosnący w czasie
+    # i bez ryzyka kolizji (dawny 6-znakowy skrót UUID powtarzał się po kilku tysiącach zgłoszeń).
+    # Zapis idzie przez wspólny bufor: zgłoszenia z wielu wywołań naraz trafiają do bazy jednym commitem,
+    # a funkcja wraca dopiero, gdy nasze zgłoszenie jest zapisane.
+    ticket = get_ticket_writer().submit(email_address, description)
+
+    # Tworzymy komunikat zwrotny w formacie JSON (ten sam kształt co wcześniej),
     # informujący użytkownika, że zgłoszenie zostało przyjęte i zapisane.
     message_json = json.dumps({
-        "message": f"Support ticket {ticket_number} submitted. "
-                   f"The ticket file has been saved as {file_name}."
+        "message": f"Support ticket {ticket.id} submitted. {store.location(ticket)}"
     })
-    
+
+    # Zwracamy komunikat JSON jako wynik funkcji.
+    return message_json
+
+# Funkcja do zgłaszania wielu problemów naraz (np. podczas awarii, gdy zgłoszeń są setki na minutę)
+def submit_support_tickets(tickets: List[Dict[str, str]]) -> str:
+    """Save many support tickets in one batch and return their numbers in JSON.
+
+    :param tickets: list of tickets, each an object with "email_address" and "description".
+    """
+    # Sprawdzamy każde zgłoszenie osobno: błędne pomijamy i zgłaszamy, poprawne zapisujemy.
+    accepted = []
+    rejected = []
+    for index, item in enumerate(tickets or []):
+        item = item if isinstance(item, dict) else {}
+        email_address = str(item.get("email_address") or "").strip()
+        description = str(item.get("description") or "").strip()
+        if not email_address or not description:
+            rejected.append({"index": index, "error": "email_address and description are required"})
+            continue
+        accepted.append((email_address, description))
+
+    # Wszystkie poprawne zgłoszenia zapisujemy razem, jednym commitem (jedna synchronizacja dysku).
+    saved = get_ticket_writer().submit_many(accepted)
+
+    # Komunikat zwrotny w formacie JSON: podsumowanie i numer każdego zapisanego zgłoszenia.
+    message_json = json.dumps({
+        "message": f"{len(saved)} support tickets submitted"
+                   + (f", {len(rejected)} rejected." if rejected else "."),
+        "tickets": [{"ticket_id": t.id, "email_address": t.email} for t in saved],
+        "rejected": rejected,
+    })
+
     # Zwracamy komunikat JSON jako wynik funkcji.
     return message_json
 
 # Definiujemy zbiór funkcji, które można wywołać (callable functions).
-# W tym przypadku zawiera tylko jedną funkcję — submit_support_ticket.
+# Agent może zgłosić jeden problem (submit_support_ticket) albo wiele naraz (submit_support_tickets).
 # Set pozwala w przyszłości łatwo dodać więcej funkcji, np. do obsługi użytkowników.
 user_functions: Set[Callable[..., Any]] = {
-    submit_support_ticket
+    submit_support_ticket,
+    submit_support_tickets,
 }
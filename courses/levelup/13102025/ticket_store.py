@@ -0,0 +1,467 @@
+"""Storage backends for support tickets.
+
+``submit_support_ticket`` used to write one ``ticket-XXXXXX.txt`` per
+ticket, so listing, counting or finding a user's tickets meant opening and
+parsing every file, and the 6 hex characters taken from a UUID were never
+checked for collisions (a 50% chance of one after ~5,000 tickets).
+
+* ``SqliteTicketStore`` (the default) keeps tickets in one SQLite file in
+  WAL mode, indexed by id (primary key), e-mail and creation time,
+* ``FileTicketStore`` keeps the old text files, for anyone who reads them
+  directly,
+* ``new_ticket_id`` gives 26-character, time-sortable ids (48-bit
+  millisecond timestamp + 80 random bits, Crockford base32, like a ULID);
+  they are monotonic within a process and the store rejects a duplicate,
+* ``import_ticket_files`` moves the existing ``ticket-*.txt`` files into a
+  store once (their ids and file times are kept; running it again skips
+  what is already there),
+* ``GroupCommitWriter`` sits in front of a store: callers on any thread
+  hand over tickets and block until they are committed, while one writer
+  thread commits everything that queued up meanwhile in a single
+  transaction (group commit), so a burst of tickets costs one sync per
+  batch instead of one per ticket.
+
+Choose the backend with ``TICKET_STORE`` (``sqlite`` or ``files``) and the
+file with ``TICKET_DB_PATH`` (default: ``tickets.sqlite`` next to this
+script) or the folder with ``TICKET_FILES_DIR`` (default: this folder).
+``TICKET_DURABILITY`` sets what a commit waits for: ``full`` (default;
+fsync once per batch), ``normal`` (SQLite WAL syncs at checkpoints only;
+files are not synced: survives an app crash, not a power cut) or ``off``.
+``TICKET_BATCH_MAX`` caps a batch (default 512) and ``TICKET_BATCH_WAIT_MS``
+lets the writer wait for more tickets (default 0: a batch is whatever
+queued up during the previous commit). ``TICKET_COMMIT_TIMEOUT`` (default
+30 s) bounds how long a caller waits: tickets still queued by then are
+dropped and the caller gets a ``TimeoutError``. Standard library only.
+"""
+import os
+import queue
+import re
+import secrets
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Protocol, Sequence, Tuple
+
+SCRIPT_DIR = Path(__file__).parent
+DEFAULT_DB_PATH = SCRIPT_DIR / "tickets.sqlite"
+CROCKFORD = "0123456789ABCDEFGHJKMNPQRSTVWXYZ"
+DURABILITY = {"full": "FULL", "normal": "NORMAL", "off": "OFF"}  # -> PRAGMA synchronous
+LEGACY_PATTERN = re.compile(
+    r"\ASupport ticket: (?P<id>\S+)\nSubmitted by: (?P<email>.*)\nDescription:\n(?P<description>.*)\Z", re.S
+)
+
+
+class TicketIdCollision(RuntimeError):
+    """Raised when a new ticket id is already taken (practically never: 80 random bits per millisecond)."""
+
+
+@dataclass
+class Ticket:
+    id: str
+    email: str
+    description: str
+    created: float
+    status: str = "open"
+
+    def to_dict(self) -> Dict[str, Any]:
+        return asdict(self)
+
+
+# --- ids ---------------------------------------------------------------------
+
+_id_lock = threading.Lock()
+_last_ms = 0
+_last_random = 0
+
+
+def _base32(value: int, length: int) -> str:
+    chars = []
+    for _ in range(length):
+        value, digit = divmod(value, 32)
+        chars.append(CROCKFORD[digit])
+    return "".join(reversed(chars))
+
+
+def new_ticket_id(now: Optional[float] = None) -> str:
+    """A 26-character id that sorts by creation time (10 chars of ms timestamp + 16 of randomness)."""
+    global _last_ms, _last_random
+    ms = int((time.time() if now is None else now) * 1000)
+    with _id_lock:
+        if ms <= _last_ms:
+            # Same millisecond (or the clock went back): keep the order by counting up from the last id
+            ms, random_part = _last_ms, _last_random + 1
+            if random_part >> 80:
+                ms, random_part = ms + 1, secrets.randbits(80)
+        else:
+            random_part = secrets.randbits(80)
+        _last_ms, _last_random = ms, random_part
+    return _base32(ms, 10) + _base32(random_part, 16)
+
+
+def new_ticket(email: str, description: str) -> Ticket:
+    now = time.time()
+    return Ticket(new_ticket_id(now), email.strip(), description, now)
+
+
+def ticket_id_time(ticket_id: str) -> Optional[float]:
+    """Creation time encoded in a new-style id (None for the old 6-hex ids)."""
+    if len(ticket_id) != 26:
+        return None
+    ms = 0
+    for char in ticket_id[:10].upper():
+        ms = ms * 32 + CROCKFORD.index(char)
+    return ms / 1000
+
+
+# --- backends ----------------------------------------------------------------
+
+class TicketStore(Protocol):
+    def add(self, email: str, description: str) -> Ticket: ...
+
+    def insert(self, tickets: Iterable[Ticket], skip_existing: bool = False) -> int: ...
+
+    def get(self, ticket_id: str) -> Optional[Ticket]: ...
+
+    def by_email(self, email: str, limit: int = 100) -> List[Ticket]: ...
+
+    def recent(self, limit: int = 20) -> List[Ticket]: ...
+
+    def count(self, email: Optional[str] = None) -> int: ...
+
+    def location(self, ticket: Ticket) -> str: ...
+
+
+class SqliteTicketStore:
+    def __init__(self, path: Path = DEFAULT_DB_PATH, durability: str = "full"):
+        if durability not in DURABILITY:
+            raise RuntimeError(f"TICKET_DURABILITY must be one of {', '.join(DURABILITY)}, not {durability!r}")
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.durability = durability
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(str(self.path), check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        # FULL: every COMMIT (one per batch with the writer) is fsynced; NORMAL: only WAL checkpoints are
+        self._db.execute(f"PRAGMA synchronous={DURABILITY[durability]}")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS tickets ("
+            " id TEXT PRIMARY KEY, email TEXT NOT NULL COLLATE NOCASE, description TEXT NOT NULL,"
+            " created REAL NOT NULL, status TEXT NOT NULL DEFAULT 'open')"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS tickets_email ON tickets(email, created)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS tickets_created ON tickets(created)")
+
+    def add(self, email: str, description: str) -> Ticket:
+        ticket = new_ticket(email, description)
+        self.insert([ticket])
+        return ticket
+
+    def insert(self, tickets: Iterable[Ticket], skip_existing: bool = False) -> int:
+        """Write tickets in one transaction; returns how many were added."""
+        rows = [(t.id, t.email, t.description, t.created, t.status) for t in tickets]
+        verb = "INSERT OR IGNORE" if skip_existing else "INSERT"
+        with self._lock:
+            before = self._db.total_changes
+            try:
+                self._db.execute("BEGIN IMMEDIATE")
+                self._db.executemany(
+                    f"{verb} INTO tickets (id, email, description, created, status) VALUES (?, ?, ?, ?, ?)", rows
+                )
+                self._db.execute("COMMIT")
+            except sqlite3.IntegrityError as e:
+                self._db.execute("ROLLBACK")
+                raise TicketIdCollision(str(e)) from e
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+            return self._db.total_changes - before
+
+    def _select(self, where: str, params: Tuple[Any, ...]) -> List[Ticket]:
+        with self._lock:
+            rows = self._db.execute(
+                f"SELECT id, email, description, created, status FROM tickets {where}", params
+            ).fetchall()
+        return [Ticket(*row) for row in rows]
+
+    def get(self, ticket_id: str) -> Optional[Ticket]:
+        found = self._select("WHERE id = ?", (ticket_id.strip(),))
+        return found[0] if found else None
+
+    def by_email(self, email: str, limit: int = 100) -> List[Ticket]:
+        # The column is COLLATE NOCASE, so this is an index lookup that ignores case
+        return self._select("WHERE email = ? ORDER BY created DESC LIMIT ?", (email.strip(), limit))
+
+    def recent(self, limit: int = 20) -> List[Ticket]:
+        return self._select("ORDER BY created DESC LIMIT ?", (limit,))
+
+    def count(self, email: Optional[str] = None) -> int:
+        with self._lock:
+            if email is None:
+                return self._db.execute("SELECT COUNT(*) FROM tickets").fetchone()[0]
+            return self._db.execute("SELECT COUNT(*) FROM tickets WHERE email = ?", (email.strip(),)).fetchone()[0]
+
+    def location(self, ticket: Ticket) -> str:
+        return f"The ticket has been saved in {self.path.name}."
+
+
+def ticket_file_text(ticket: Ticket) -> str:
+    return f"Support ticket: {ticket.id}\nSubmitted by: {ticket.email}\nDescription:\n{ticket.description}"
+
+
+def parse_ticket_file(path: Path) -> Optional[Ticket]:
+    """A ticket from the old text format; None when the file does not look like one."""
+    match = LEGACY_PATTERN.match(path.read_text(encoding="utf-8", errors="replace"))
+    if match is None:
+        return None
+    created = ticket_id_time(match["id"]) or path.stat().st_mtime
+    return Ticket(match["id"], match["email"].strip(), match["description"], created)
+
+
+class FileTicketStore:
+    """The original layout, one ``ticket-<id>.txt`` per ticket; every query reads all the files."""
+
+    def __init__(self, folder: Path = SCRIPT_DIR, durability: str = "full"):
+        if durability not in DURABILITY:
+            raise RuntimeError(f"TICKET_DURABILITY must be one of {', '.join(DURABILITY)}, not {durability!r}")
+        self.folder = Path(folder)
+        self.durability = durability
+
+    def _path(self, ticket_id: str) -> Path:
+        return self.folder / f"ticket-{ticket_id}.txt"
+
+    def add(self, email: str, description: str) -> Ticket:
+        ticket = new_ticket(email, description)
+        self.insert([ticket])
+        return ticket
+
+    def insert(self, tickets: Iterable[Ticket], skip_existing: bool = False) -> int:
+        """Write one file per ticket, all or nothing.
+
+        With ``full`` durability the files and the folder are synced once per call.
+        """
+        created: List[Path] = []
+        descriptors: List[int] = []
+        try:
+            for ticket in tickets:
+                path = self._path(ticket.id)
+                try:
+                    # "x": never overwrite another ticket
+                    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+                except FileExistsError as e:
+                    if skip_existing:
+                        continue
+                    raise TicketIdCollision(ticket.id) from e
+                created.append(path)
+                descriptors.append(fd)
+                os.write(fd, ticket_file_text(ticket).encode("utf-8"))
+            if self.durability == "full":
+                for fd in descriptors:
+                    os.fsync(fd)
+                _fsync_dir(self.folder)
+        except BaseException:
+            # Like a rolled-back transaction: no file from this call is left behind,
+            # so the writer can retry the tickets that were not at fault
+            for fd in descriptors:
+                os.close(fd)
+            descriptors = []
+            for path in created:
+                try:
+                    path.unlink()
+                except OSError:
+                    pass
+            raise
+        finally:
+            for fd in descriptors:
+                os.close(fd)
+        return len(created)
+
+    def _all(self) -> List[Ticket]:
+        tickets = (parse_ticket_file(path) for path in self.folder.glob("ticket-*.txt"))
+        return sorted((t for t in tickets if t is not None), key=lambda t: t.created, reverse=True)
+
+    def get(self, ticket_id: str) -> Optional[Ticket]:
+        path = self._path(ticket_id.strip())
+        return parse_ticket_file(path) if path.exists() else None
+
+    def by_email(self, email: str, limit: int = 100) -> List[Ticket]:
+        return [t for t in self._all() if t.email.lower() == email.strip().lower()][:limit]
+
+    def recent(self, limit: int = 20) -> List[Ticket]:
+        return self._all()[:limit]
+
+    def count(self, email: Optional[str] = None) -> int:
+        return len(self._all()) if email is None else len(self.by_email(email, limit=1 << 62))
+
+    def location(self, ticket: Ticket) -> str:
+        return f"The ticket file has been saved as {self._path(ticket.id).name}."
+
+
+def _fsync_dir(folder: Path) -> None:
+    # New directory entries are only durable once the directory itself is synced (not possible on Windows)
+    if os.name == "nt":
+        return
+    fd = os.open(folder, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+# --- group commit -------------------------------------------------------------
+
+@dataclass
+class WriterStats:
+    tickets: int = 0
+    batches: int = 0
+    largest_batch: int = 0
+    commit_seconds: float = 0.0
+
+    def __str__(self) -> str:
+        average = self.tickets / self.batches if self.batches else 0
+        return (f"{self.tickets} tickets in {self.batches} commits (avg {average:.1f}, max {self.largest_batch}), "
+                f"{self.commit_seconds:.2f} s committing")
+
+
+class GroupCommitWriter:
+    def __init__(self, store: TicketStore, max_batch: int = 512, max_wait: float = 0.0, timeout: float = 30.0):
+        self.store = store
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.timeout = timeout
+        self.stats = WriterStats()
+        self._queue: "queue.Queue[Tuple[List[Ticket], Future]]" = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="ticket-writer", daemon=True)
+        self._thread.start()
+
+    def submit(self, email: str, description: str) -> Ticket:
+        """One ticket; returns once it is committed."""
+        return self.submit_many([(email, description)])[0]
+
+    def submit_many(self, items: Sequence[Tuple[str, str]]) -> List[Ticket]:
+        """Tickets for ``(email, description)`` pairs, committed together; returns once they are."""
+        tickets = [new_ticket(email, description) for email, description in items]
+        if tickets:
+            future: Future = Future()
+            self._queue.put((tickets, future))
+            try:
+                future.result(self.timeout)  # raises what the commit raised
+            except FutureTimeout:
+                if future.cancel():
+                    raise TimeoutError(f"ticket store did not take the tickets within {self.timeout:g} s; "
+                                       f"they were not saved") from None
+                # Already in a commit: give it as long again, then report that the outcome is unknown
+                try:
+                    future.result(self.timeout)
+                except FutureTimeout:
+                    raise TimeoutError(f"ticket commit still running after {2 * self.timeout:g} s; "
+                                       f"the tickets may or may not be saved") from None
+        return tickets
+
+    def _run(self) -> None:
+        while True:
+            requests = [self._queue.get()]
+            try:
+                size = len(requests[0][0])
+                deadline = time.monotonic() + self.max_wait
+                # Everything that queued up while the previous batch was committing goes into this one
+                while size < self.max_batch:
+                    try:
+                        remaining = deadline - time.monotonic()
+                        request = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    requests.append(request)
+                    size += len(request[0])
+                # Callers that gave up waiting have cancelled their request: it is not written
+                requests = [request for request in requests if request[1].set_running_or_notify_cancel()]
+                if requests:
+                    self._commit(requests)
+            except BaseException as e:
+                # Whatever went wrong, nobody is left waiting and the writer keeps serving
+                for _, future in requests:
+                    if not future.done():
+                        future.set_exception(e)
+
+    def _commit(self, requests: List[Tuple[List[Ticket], Future]]) -> None:
+        start = time.perf_counter()
+        try:
+            self.store.insert([ticket for tickets, _ in requests for ticket in tickets])
+        except BaseException as e:
+            if len(requests) == 1:
+                requests[0][1].set_exception(e)
+            else:
+                # One bad request must not fail the others: commit them one by one
+                for request in requests:
+                    self._commit([request])
+            return
+        size = sum(len(tickets) for tickets, _ in requests)
+        self.stats.commit_seconds += time.perf_counter() - start
+        self.stats.batches += 1
+        self.stats.tickets += size
+        self.stats.largest_batch = max(self.stats.largest_batch, size)
+        for _, future in requests:
+            future.set_result(None)
+
+
+# --- migration ---------------------------------------------------------------
+
+def import_ticket_files(store: SqliteTicketStore,
+                        folder: Path = SCRIPT_DIR,
+                        delete: bool = False) -> Tuple[int, int, List[Path]]:
+    """Copy ``ticket-*.txt`` into ``store`` in one transaction: (imported, already there, unreadable files)."""
+    tickets: List[Ticket] = []
+    paths: List[Path] = []
+    unreadable: List[Path] = []
+    for path in sorted(Path(folder).glob("ticket-*.txt")):
+        ticket = parse_ticket_file(path)
+        if ticket is None:
+            unreadable.append(path)
+            continue
+        tickets.append(ticket)
+        paths.append(path)
+    imported = store.insert(tickets, skip_existing=True)
+    if delete:
+        # Only after the commit, and only files that are now in the store
+        for path, ticket in zip(paths, tickets):
+            if store.get(ticket.id) is not None:
+                path.unlink()
+    return imported, len(tickets) - imported, unreadable
+
+
+_store: Optional[TicketStore] = None
+_writer: Optional[GroupCommitWriter] = None
+_store_lock = threading.Lock()
+
+
+def get_ticket_store() -> TicketStore:
+    """The process-wide store chosen by ``TICKET_STORE`` / ``TICKET_DB_PATH``."""
+    global _store
+    with _store_lock:
+        if _store is None:
+            backend = os.getenv("TICKET_STORE", "sqlite").strip().lower()
+            durability = os.getenv("TICKET_DURABILITY", "full").strip().lower()
+            if backend == "files":
+                folder = os.getenv("TICKET_FILES_DIR")
+                _store = FileTicketStore(Path(folder).expanduser() if folder else SCRIPT_DIR, durability)
+            elif backend == "sqlite":
+                path = os.getenv("TICKET_DB_PATH")
+                _store = SqliteTicketStore(Path(path).expanduser() if path else DEFAULT_DB_PATH, durability)
+            else:
+                raise RuntimeError(f"TICKET_STORE must be sqlite or files, not {backend!r}")
+        return _store
+
+
+def get_ticket_writer() -> GroupCommitWriter:
+    """The process-wide group-commit writer in front of ``get_ticket_store()``."""
+    global _writer
+    store = get_ticket_store()
+    with _store_lock:
+        if _writer is None:
+            _writer = GroupCommitWriter(store,
+                                        max_batch=int(os.getenv("TICKET_BATCH_MAX", "512")),
+                                        max_wait=float(os.getenv("TICKET_BATCH_WAIT_MS", "0")) / 1000,
+                                        timeout=float(os.getenv("TICKET_COMMIT_TIMEOUT", "30")))
+        return _writer
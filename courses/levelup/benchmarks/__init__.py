@@ -0,0 +1 @@
+"""Benchmarks for the LevelUP apps. Run from ``courses/levelup`` with ``python -m benchmarks.<name>``."""
@@ -0,0 +1,104 @@
+"""Checks ``fetcher.Fetcher`` against the local stand-in (``mock_server``).
+
+Starts the mock in-process and runs each case against a fetcher with short
+timeouts; prints one line per case with its time and exits with 1 if any
+case fails. No network access needed. Usage (from ``courses/levelup``)::
+
+    python -m benchmarks.fetch_check
+"""
+import asyncio
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Callable, List, Tuple
+
+from benchmarks.mock_server import MockConfig, MockServer
+
+ROOT = Path(__file__).resolve().parent.parent
+KB = 1024
+
+
+def run_checks(url: str, server: MockServer, workdir: Path) -> List[Tuple[str, bool, float, str]]:
+    from fetcher import FetchSettings, FetchTooLargeError, Fetcher
+
+    fetcher = Fetcher(FetchSettings(connect_timeout=1, read_timeout=0.5, total_timeout=1.5, max_bytes=512 * KB))
+    results: List[Tuple[str, bool, float, str]] = []
+
+    def case(name: str, fn: Callable[[], Any]) -> None:
+        start = time.perf_counter()
+        try:
+            detail = fn() or ""
+            ok = True
+        except AssertionError as e:
+            ok, detail = False, str(e)
+        except Exception as e:
+            ok, detail = False, f"{type(e).__name__}: {e}"
+        results.append((name, ok, time.perf_counter() - start, detail))
+
+    def raises(error: type, fn: Callable[[], Any]) -> str:
+        try:
+            fn()
+        except error as e:
+            return f"{type(e).__name__}: {e}"
+        raise AssertionError(f"expected {error.__name__}")
+
+    def small() -> str:
+        result = fetcher.get(f"{url}/files/a?size={100 * KB}")
+        assert len(result.content) == 100 * KB, len(result.content)
+        return f"{len(result.content)} bytes, ETag {result.headers.get('ETag')}"
+
+    def pooled() -> str:
+        before = server.stats.connections
+        for _ in range(50):
+            fetcher.get(f"{url}/files/b?size=100")
+        opened = server.stats.connections - before
+        assert opened <= 1, f"{opened} new connections for 50 requests"
+        return f"50 requests, {opened} new connection(s)"
+
+    def conditional() -> str:
+        first = fetcher.get(f"{url}/files/c?size=1000")
+        again = fetcher.get(f"{url}/files/c?size=1000", etag=first.headers.get("ETag"))
+        assert again.not_modified and not again.content, again.status
+        return "304 Not Modified"
+
+    def asynchronous() -> str:
+        async def main() -> List[int]:
+            results = await asyncio.gather(*(fetcher.aget(f"{url}/files/d{i}?size={10 * KB}") for i in range(20)))
+            await fetcher.adownload(f"{url}/files/e?size={300 * KB}", workdir / "e.bin")
+            with_limit = fetcher.adownload(f"{url}/files/f?size={900 * KB}&chunked=1", workdir / "f.bin")
+            try:
+                await with_limit
+            except FetchTooLargeError:
+                pass
+            return [len(r.content) for r in results]
+
+        sizes = asyncio.run(main())
+        assert sizes == [10 * KB] * 20, sizes
+        assert (workdir / "e.bin").stat().st_size == 300 * KB
+        assert not (workdir / "f.bin").exists() and not list(workdir.glob(".f.bin*")), "partial download left behind"
+        return "20 concurrent gets, download to file, no partial file after abort"
+
+    case("small file", small)
+    case("connection reuse", pooled)
+    case("conditional GET", conditional)
+    case("too large (Content-Length)", lambda: raises(FetchTooLargeError, lambda: fetcher.get(f"{url}/files/g?size={4096 * KB}")))
+    case("too large (chunked)", lambda: raises(FetchTooLargeError, lambda: fetcher.get(f"{url}/files/h?size={4096 * KB}&chunked=1")))
+    case("slow drip past deadline", lambda: raises(TimeoutError, lambda: fetcher.get(f"{url}/files/i?size={400 * KB}&delay=0.3")))
+    case("stalled server", lambda: raises(TimeoutError, lambda: fetcher.get(f"{url}/files/j?size={200 * KB}&delay=2")))
+    case("async", asynchronous)
+    return results
+
+
+def main() -> int:
+    sys.path.insert(0, str(ROOT / "08102025"))
+    server = MockServer(MockConfig())
+    with server as url, tempfile.TemporaryDirectory(prefix="levelup-fetch-") as workdir:
+        results = run_checks(url, server, Path(workdir))
+    for name, ok, seconds, detail in results:
+        print(f"{'ok  ' if ok else 'FAIL'} {name:<28}{seconds * 1000:>8.0f} ms  {detail}")
+    return 0 if all(ok for _, ok, _, _ in results) else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,133 @@
+"""Peak memory of turning a large local image into a vision request payload.
+
+Each variant runs in a fresh interpreter on the same test photo (random
+noise, so JPEG cannot compress it away) and reports the peak RSS above the
+process's RSS after imports:
+
+* ``read-b64``  – the old ``chatimage2`` path: ``read`` + ``b64encode`` +
+  ``decode`` + f-string,
+* ``pil``       – the old ``chatimagegradio`` path: full decode to PIL,
+  re-encode as full-size JPEG, then ``read-b64``,
+* ``stream``    – ``image_prep.file_to_data_url``: chunked base64 into one
+  preallocated buffer, then one ``str`` copy of it (what a pass-through
+  file costs; the buffer and the string are the floor for a str payload),
+* ``prepare``   – ``image_prep.prepare_file`` with the default policy:
+  reduced-scale JPEG decode, resize, re-encode.
+
+Usage (from ``courses/levelup``)::
+
+    python -m benchmarks.image_memory --megapixels 12
+    python -m levelup bench-memory --megapixels 24
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+from typing import Dict, List, Optional
+
+ROOT = Path(__file__).resolve().parent.parent
+VARIANTS = ("read-b64", "pil", "stream", "prepare")
+
+PROBE = """
+import base64, io, json, sys
+sys.path.insert(0, "08102025")
+from PIL import Image
+from benchmarks.image_memory import peak_mb, reset_peak
+from benchmarks.loadtest import rss_mb
+from image_prep import ImagePolicy, file_to_data_url, prepare_file
+
+variant, path = sys.argv[1], sys.argv[2]
+reset_peak()
+baseline = rss_mb()
+if variant == "read-b64":
+    with open(path, "rb") as f:
+        data = f.read()
+    url = f"data:image/jpeg;base64,{base64.b64encode(data).decode('utf-8')}"
+elif variant == "pil":
+    image = Image.open(path).convert("RGB")
+    buf = io.BytesIO()
+    image.save(buf, format="JPEG")
+    url = f"data:image/jpeg;base64,{base64.b64encode(buf.getvalue()).decode('ascii')}"
+elif variant == "stream":
+    url = file_to_data_url(path, "image/jpeg")
+else:
+    url = prepare_file(path, ImagePolicy(max_input_bytes=1 << 40)).data_url
+print(json.dumps({"baseline": baseline, "peak": peak_mb(), "payload": len(url)}))
+"""
+
+
+def reset_peak() -> None:
+    """Start the high-water mark from here, so start-up and imports do not count (Linux only)."""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+def peak_mb() -> float:
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    from benchmarks.loadtest import peak_rss_mb
+
+    return peak_rss_mb()
+
+
+def make_photo(path: Path, megapixels: float) -> None:
+    from PIL import Image
+
+    width = int((megapixels * 1e6 * 4 / 3) ** 0.5)
+    height = width * 3 // 4
+    Image.frombytes("RGB", (width, height), os.urandom(width * height * 3)).save(path, quality=92)
+
+
+def measure(variant: str, path: Path) -> Dict[str, float]:
+    proc = subprocess.run([sys.executable, "-c", PROBE, variant, str(path)], cwd=ROOT, capture_output=True, text=True)
+    if proc.returncode != 0:
+        raise RuntimeError(f"{variant} failed:\n{proc.stderr.strip()}")
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("variants", nargs="*", help=f"variants to run (default: all of {', '.join(VARIANTS)})")
+    parser.add_argument("--megapixels", type=float, default=12.0, help="size of the test photo (default: 12)")
+    parser.add_argument("--image", type=Path, default=None, help="use this file instead of a generated photo")
+    args = parser.parse_args(argv)
+    unknown = set(args.variants) - set(VARIANTS)
+    if unknown:
+        parser.error(f"unknown variant(s): {', '.join(sorted(unknown))}")
+
+    with tempfile.TemporaryDirectory(prefix="levelup-mem-") as workdir:
+        path = args.image.resolve() if args.image else Path(workdir) / "photo.jpg"
+        if args.image is None:
+            make_photo(path, args.megapixels)
+        print(f"input: {path.name}, {path.stat().st_size / 1024 / 1024:.1f} MB")
+        print(f"{'variant':<10}{'peak ΔRSS MB':>14}{'payload MB':>12}")
+        results = {}
+        for variant in args.variants or VARIANTS:
+            try:
+                result = measure(variant, path)
+            except RuntimeError as e:
+                print(f"{variant:<10}error: {e}")
+                return 1
+            results[variant] = result["peak"] - result["baseline"]
+            print(f"{variant:<10}{results[variant]:>14.1f}{result['payload'] / 1024 / 1024:>12.1f}")
+
+    # The new path against the old one it replaces
+    for new, old in (("stream", "read-b64"), ("prepare", "pil")):
+        if new in results and old in results and results[old] > 0:
+            print(f"{new} vs {old}: {1 - results[new] / results[old]:.0%} less peak memory")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,273 @@
+"""Offline load test of the Gradio handlers against the mock server.
+
+Starts ``benchmarks.mock_server`` in a child process, points the apps at it
+(``AOAI_ENDPOINT_OVERRIDE``, ``AOAI_API_KEY``; no Azure sign-in, no network)
+and drives the real handlers the browser would call:
+
+* ``chat``   – ``chatgradio2.send_message`` (streamed answers, TTFT measured),
+* ``vision`` – ``chatimagegradio.answer`` with an uploaded JPEG file (a multi-turn conversation),
+* ``image``  – ``imdallegradio.generate_image`` (an async handler).
+
+Each of ``--sessions`` simulated tabs sends ``--requests`` messages in turn.
+Reports throughput, latency percentiles, errors, client retries, mock-server
+counters and this process's RSS. Exits with 1 when the error rate is above
+``--max-error-rate``, so it can gate CI runs. Usage (from ``courses/levelup``)::
+
+    python -m benchmarks.loadtest --sessions 50 --requests 4 --rate-limit 0.05
+    python -m levelup bench-load chat --sessions 200 --latency fixed:0.5
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Any, Awaitable, Callable, List, Optional
+from urllib.request import urlopen
+
+from benchmarks import mock_server
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+ROOT = Path(__file__).resolve().parent.parent
+SCENARIOS = ("chat", "vision", "image")
+
+
+def rss_mb() -> float:
+    """Current resident set size of this process."""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return peak_rss_mb()
+
+
+def peak_rss_mb() -> float:
+    if resource is None:
+        return float("nan")
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+@dataclass
+class ScenarioResult:
+    name: str
+    latencies: List[float] = field(default_factory=list)
+    ttfts: List[float] = field(default_factory=list)
+    errors: List[str] = field(default_factory=list)
+    wall: float = 0.0
+    rss_before: float = 0.0
+    rss_after: float = 0.0
+
+    @property
+    def requests(self) -> int:
+        return len(self.latencies) + len(self.errors)
+
+    def line(self) -> str:
+        def pct(values: List[float], q: int) -> str:
+            if not values:
+                return "–"
+            ordered = sorted(values)
+            return f"{ordered[min(len(ordered) - 1, round(q / 100 * len(ordered)) - 1)] * 1000:.0f}"
+
+        throughput = len(self.latencies) / self.wall if self.wall else 0.0
+        return (f"{self.name:<8}{self.requests:>6}{len(self.errors):>7}{throughput:>9.1f}"
+                f"{pct(self.latencies, 50):>8}{pct(self.latencies, 95):>8}{pct(self.latencies, 99):>8}"
+                f"{pct(self.ttfts, 50):>9}{pct(self.ttfts, 95):>9}"
+                f"{self.rss_after:>9.0f}{self.rss_after - self.rss_before:>+8.0f}")
+
+
+HEADER = (f"{'scenario':<8}{'reqs':>6}{'errors':>7}{'req/s':>9}{'p50 ms':>8}{'p95 ms':>8}{'p99 ms':>8}"
+          f"{'ttft50':>9}{'ttft95':>9}{'RSS MB':>9}{'ΔRSS':>8}")
+
+
+def start_mock(args: argparse.Namespace) -> "tuple[subprocess.Popen, str]":
+    cmd = [sys.executable, "-m", "benchmarks.mock_server", "--port", "0",
+           "--latency", args.latency, "--token-rate", str(args.token_rate),
+           "--completion-tokens", str(args.completion_tokens), "--rate-limit", str(args.rate_limit),
+           "--retry-after-ms", str(args.retry_after_ms), "--image-latency", args.image_latency,
+           "--image-size", str(args.image_size)]
+    proc = subprocess.Popen(cmd, cwd=ROOT, stdout=subprocess.PIPE, text=True)
+    url = proc.stdout.readline().strip()
+    if not url.startswith("http"):
+        proc.kill()
+        raise RuntimeError("mock server did not start")
+    return proc, url
+
+
+def configure_env(url: str, workdir: Path) -> None:
+    os.environ.update({
+        "AOAI_ENDPOINT_OVERRIDE": url,
+        "AOAI_API_KEY": "mock",
+        "PROJECT_ENDPOINT": f"{url}/api/projects/mock",
+        "MODEL_DEPLOYMENT": "mock-chat",
+        "IMAGE_GENERATION_ENDPOINT": url,
+        "IMAGE_GENERATION_MODEL_DEPLOYMENT": "mock-image",
+        "API_VERSION": "2024-10-21",
+        # Keep the run self-contained: no caches, spill files or logs left behind
+        "AZURE_TOKEN_CACHE": "0",
+        "CHAT_CACHE": "0",
+        "CHAT_SESSIONS_PATH": "0",
+        "IMAGE_CACHE_PATH": "0",
+        "IMAGE_INDEX_PATH": "0",
+        "IMAGE_JOBS_PATH": "0",
+        "TELEMETRY_LOG": "0",
+        "STATS_TAB": "0",
+    })
+    os.chdir(workdir)  # imdallegradio saves into ./images
+
+
+async def run_sessions(name: str,
+                       sessions: int,
+                       requests: int,
+                       turn: Callable[[int, int], Awaitable[Optional[float]]]) -> ScenarioResult:
+    """Run ``sessions`` tabs concurrently; ``turn`` returns the TTFT (or None) and raises on failure."""
+    result = ScenarioResult(name, rss_before=rss_mb())
+
+    async def session(sid: int) -> None:
+        for n in range(requests):
+            start = time.perf_counter()
+            try:
+                ttft = await turn(sid, n)
+            except Exception as e:
+                result.errors.append(f"{type(e).__name__}: {e}")
+                continue
+            result.latencies.append(time.perf_counter() - start)
+            if ttft is not None:
+                result.ttfts.append(ttft)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(session(i) for i in range(sessions)))
+    result.wall = time.perf_counter() - start
+    result.rss_after = rss_mb()
+    return result
+
+
+def chat_turn() -> Callable[[int, int], Awaitable[Optional[float]]]:
+    from levelup.cli import load
+
+    app = load("chat-ui")
+
+    async def turn(sid: int, n: int) -> Optional[float]:
+        request = SimpleNamespace(session_hash=f"chat-{sid}")
+        start = time.perf_counter()
+        ttft = None
+        history: List[Any] = []
+        async for history, _ in app.send_message(f"Question {n}: what fruit is in season?", [], app.SYSTEM_DEFAULT, request):
+            if ttft is None and history and history[-1].get("role") == "assistant" and history[-1]["content"]:
+                ttft = time.perf_counter() - start
+        answer = history[-1]["content"] if history else ""
+        if answer.startswith("Error:") or "\n\nError:" in answer:
+            raise RuntimeError(answer.split("Error:", 1)[1].strip())
+        return ttft
+
+    return turn
+
+
+def vision_turn(image_size: int) -> Callable[[int, int], Awaitable[Optional[float]]]:
+    from PIL import Image
+    from levelup.cli import load
+
+    app = load("vision-ui")
+    image = str(Path.cwd() / "vision.jpg")  # the temporary working directory
+    Image.new("RGB", (image_size, image_size), (240, 140, 20)).save(image, quality=90)
+
+    async def turn(sid: int, n: int) -> Optional[float]:
+        request = SimpleNamespace(session_hash=f"vision-{sid}")
+        history, _ = await app.answer(f"Question {n}: is this orange ripe?", image, "", request)
+        answer = history[-1]["content"]
+        if answer.startswith("Error:"):
+            raise RuntimeError(answer[len("Error:"):].strip())
+        return None
+
+    return turn
+
+
+def image_turn() -> Callable[[int, int], Awaitable[Optional[float]]]:
+    from levelup.cli import load
+
+    app = load("imagegen-ui")
+
+    async def turn(sid: int, n: int) -> Optional[float]:
+        outputs = await app.generate_image(f"dragon fruit {sid}-{n}")
+        status = outputs[-1]
+        if status.startswith("Error"):
+            raise RuntimeError(status[len("Error:"):].strip())
+        return None
+
+    return turn
+
+
+async def run(args: argparse.Namespace) -> List[ScenarioResult]:
+    builders = {"chat": chat_turn, "vision": lambda: vision_turn(args.vision_image_size), "image": image_turn}
+    results = []
+    for name in args.scenarios:
+        turn = builders[name]()
+        # One warm-up turn: module imports and client construction are not part of the measurement
+        await turn(-1, 0)
+        results.append(await run_sessions(name, args.sessions, args.requests, turn))
+    return results
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Offline load test of the chat, vision and image handlers.")
+    parser.add_argument("scenarios", nargs="*", help=f"scenarios to run (default: all of {', '.join(SCENARIOS)})")
+    parser.add_argument("--sessions", type=int, default=32, help="concurrent simulated tabs (default: 32)")
+    parser.add_argument("--requests", type=int, default=4, help="messages per tab (default: 4)")
+    parser.add_argument("--vision-image-size", type=int, default=1024, help="side of the vision test image in px")
+    parser.add_argument("--max-error-rate", type=float, default=0.0, help="fail above this share of errors")
+    mock_server.add_arguments(parser)
+    args = parser.parse_args(argv)
+    args.scenarios = args.scenarios or list(SCENARIOS)
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenario(s): {', '.join(sorted(unknown))}")
+
+    sys.path.insert(0, str(ROOT))
+    proc, url = start_mock(args)
+    try:
+        with tempfile.TemporaryDirectory(prefix="levelup-load-") as workdir:
+            cwd = os.getcwd()
+            configure_env(url, Path(workdir))
+            try:
+                results = asyncio.run(run(args))
+            finally:
+                os.chdir(cwd)
+        server_stats = json.loads(urlopen(f"{url}/stats").read())
+    finally:
+        proc.terminate()
+        proc.wait()
+
+    from ratelimit import get_limiter
+
+    print(f"{args.sessions} sessions x {args.requests} requests · latency {args.latency} · "
+          f"{args.token_rate:g} tokens/s · 429 rate {args.rate_limit:g}")
+    print(HEADER)
+    for result in results:
+        print(result.line())
+    print(f"client: {get_limiter().stats}")
+    print(f"mock server: {server_stats}")
+    print(f"peak RSS: {peak_rss_mb():.0f} MB")
+
+    failed = False
+    for result in results:
+        rate = len(result.errors) / result.requests if result.requests else 0.0
+        if rate > args.max_error_rate:
+            print(f"{result.name}: error rate {rate:.1%} above {args.max_error_rate:.1%}, e.g. {result.errors[0]}")
+            failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,356 @@
+"""Local stand-in for the Azure OpenAI endpoints the apps call.
+
+Implements, on plain ``http.server`` (no dependencies):
+
+* ``POST /openai/deployments/<name>/chat/completions`` – JSON or SSE
+  streaming (with the usage chunk when ``stream_options.include_usage``),
+* ``POST /openai/deployments/<name>/images/generations`` – ``url`` or
+  ``b64_json`` responses; the URL points back at ``GET /images/<id>.png``
+  (``--no-b64-json`` answers ``b64_json`` with a 400, like deployments
+  that only return URLs),
+* the same paths under ``/v1/`` for plain OpenAI clients,
+* ``GET /files/<name>?size=N&delay=S&chunked=1`` – ``size`` bytes in 64 kB
+  chunks ``delay`` seconds apart, without ``Content-Length`` when
+  ``chunked``, with an ``ETag`` (``If-None-Match`` gives a ``304``); for
+  checking fetch timeouts and size limits,
+* ``GET /stats`` – request counters as JSON (``connections`` counts TCP
+  connections, so keep-alive reuse shows up).
+
+Latency is drawn per request from a distribution (``fixed:0.2``,
+``uniform:0.1,0.5`` or ``lognormal:0.3,0.5`` = median, sigma), streamed
+answers are paced at ``--token-rate`` tokens/s, and ``--rate-limit`` injects
+that share of 429 responses with a ``retry-after-ms`` header. Point the apps
+at it with ``AOAI_ENDPOINT_OVERRIDE=<url>`` and ``AOAI_API_KEY=anything``::
+
+    python -m benchmarks.mock_server --port 8010 --latency lognormal:0.3,0.4 --rate-limit 0.05
+"""
+import argparse
+import base64
+import json
+import math
+import random
+import struct
+import threading
+import time
+import uuid
+import zlib
+from dataclasses import asdict, dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+WORDS = ("fresh ripe orange citrus fruit sweet juicy bright peel segment vitamin "
+         "store shelf price season harvest grower crate basket market produce").split()
+
+
+def parse_distribution(spec: str) -> Callable[[], float]:
+    """``fixed:x``, ``uniform:a,b`` or ``lognormal:median,sigma`` -> sampler in seconds."""
+    kind, _, args = spec.partition(":")
+    values = [float(v) for v in args.split(",") if v]
+    if kind == "fixed":
+        return lambda: values[0]
+    if kind == "uniform":
+        return lambda: random.uniform(values[0], values[1])
+    if kind == "lognormal":
+        median, sigma = values
+        return lambda: random.lognormvariate(math.log(median), sigma)
+    raise ValueError(f"unknown distribution {spec!r}")
+
+
+def tiny_png(size: int = 64, seed: int = 0) -> bytes:
+    """A solid-colour RGB PNG built with zlib only."""
+    rng = random.Random(seed)
+    pixel = bytes(rng.randrange(256) for _ in range(3))
+    raw = b"".join(b"\x00" + pixel * size for _ in range(size))
+
+    def chunk(tag: bytes, data: bytes) -> bytes:
+        return struct.pack(">I", len(data)) + tag + data + struct.pack(">I", zlib.crc32(tag + data) & 0xFFFFFFFF)
+
+    header = struct.pack(">IIBBBBB", size, size, 8, 2, 0, 0, 0)
+    return b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", header) + chunk(b"IDAT", zlib.compress(raw)) + chunk(b"IEND", b"")
+
+
+@dataclass
+class MockConfig:
+    latency: Callable[[], float] = field(default=lambda: 0.2)  # before the first byte
+    token_rate: float = 200.0       # streamed completion tokens per second (0 = no pacing)
+    completion_tokens: int = 60
+    rate_limit: float = 0.0         # share of requests answered with 429
+    retry_after_ms: int = 200
+    image_latency: Callable[[], float] = field(default=lambda: 1.0)
+    image_size: int = 256
+    b64_json: bool = True           # False: response_format=b64_json is a 400
+
+
+@dataclass
+class MockStats:
+    requests: int = 0
+    rate_limited: int = 0
+    chat: int = 0
+    streamed: int = 0
+    images: int = 0
+    files: int = 0
+    not_modified: int = 0
+    connections: int = 0
+
+
+class _HTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 256  # the default backlog of 5 drops connections under a load test
+
+
+class MockServer:
+    """Runs the stand-in on a background thread: ``with MockServer(config) as url: ...``."""
+
+    def __init__(self, config: Optional[MockConfig] = None, host: str = "127.0.0.1", port: int = 0):
+        self.config = config or MockConfig()
+        self.stats = MockStats()
+        self._images: Dict[str, bytes] = {}
+        self._lock = threading.Lock()
+        self.httpd = _HTTPServer((host, port), self._handler())
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> str:
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name="mock-openai", daemon=True)
+        self._thread.start()
+        return self.url
+
+    def stop(self) -> None:
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self) -> str:
+        return self.start()
+
+    def __exit__(self, *exc: Any) -> None:
+        self.stop()
+
+    def _count(self, name: str) -> None:
+        with self._lock:
+            setattr(self.stats, name, getattr(self.stats, name) + 1)
+
+    def _handler(self):
+        server = self
+        config = self.config
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"  # keep-alive, like the real service
+            disable_nagle_algorithm = True  # headers and body go out as separate writes
+
+            def log_message(self, *args: Any) -> None:
+                pass
+
+            def setup(self) -> None:
+                super().setup()
+                server._count("connections")
+
+            def _json(self, status: int, body: Dict[str, Any], headers: Optional[Dict[str, str]] = None) -> None:
+                data = json.dumps(body).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _chunk(self, data: bytes) -> None:
+                self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+                self.wfile.flush()
+
+            def do_GET(self) -> None:
+                if self.path == "/stats":
+                    with server._lock:
+                        self._json(200, asdict(server.stats))
+                    return
+                if self.path.startswith("/files/"):
+                    self._file()
+                    return
+                image_id = self.path.rsplit("/", 1)[-1].split("?")[0].removesuffix(".png")
+                with server._lock:
+                    data = server._images.get(image_id)
+                if not self.path.startswith("/images/") or data is None:
+                    self._json(404, {"error": {"code": "NotFound", "message": self.path}})
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", "image/png")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_POST(self) -> None:
+                length = int(self.headers.get("Content-Length") or 0)
+                body = json.loads(self.rfile.read(length) or b"{}")
+                path = self.path.split("?")[0]
+                server._count("requests")
+                if random.random() < config.rate_limit:
+                    server._count("rate_limited")
+                    self._json(
+                        429,
+                        {"error": {"code": "429", "message": "Rate limit is exceeded. Try again later."}},
+                        {"retry-after-ms": str(config.retry_after_ms), "retry-after": str(math.ceil(config.retry_after_ms / 1000))},
+                    )
+                    return
+                if path.endswith("/chat/completions"):
+                    self._chat(body)
+                elif path.endswith("/images/generations"):
+                    self._image(body)
+                else:
+                    self._json(404, {"error": {"code": "NotFound", "message": path}})
+
+            def _file(self) -> None:
+                parts = urlsplit(self.path)
+                query = {k: v[0] for k, v in parse_qs(parts.query).items()}
+                size = int(query.get("size", "1024"))
+                delay = float(query.get("delay", "0"))
+                etag = f'"{parts.path.rsplit("/", 1)[-1]}-{size}"'
+                server._count("files")
+                if self.headers.get("If-None-Match") == etag:
+                    server._count("not_modified")
+                    self.send_response(304)
+                    self.send_header("ETag", etag)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                chunked = query.get("chunked") == "1"
+                self.send_response(200)
+                self.send_header("Content-Type", "application/octet-stream")
+                self.send_header("ETag", etag)
+                self.send_header("Cache-Control", "max-age=0")
+                if chunked:
+                    self.send_header("Transfer-Encoding", "chunked")
+                else:
+                    self.send_header("Content-Length", str(size))
+                self.end_headers()
+                block = bytes(range(256)) * 256  # 64 kB
+                try:
+                    for start in range(0, size, len(block)):
+                        piece = block[:min(len(block), size - start)]
+                        if chunked:
+                            self._chunk(piece)
+                        else:
+                            self.wfile.write(piece)
+                            self.wfile.flush()
+                        if delay:
+                            time.sleep(delay)
+                    if chunked:
+                        self._chunk(b"")
+                except (BrokenPipeError, ConnectionResetError):
+                    pass  # the client gave up (size limit or timeout)
+
+            def _answer(self) -> Tuple[str, ...]:
+                return tuple(random.choice(WORDS) + " " for _ in range(config.completion_tokens))
+
+            def _chat(self, body: Dict[str, Any]) -> None:
+                server._count("chat")
+                prompt_tokens = max(1, len(json.dumps(body.get("messages", []))) // 4)
+                model = body.get("model", "mock")
+                completion_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+                usage = {"prompt_tokens": prompt_tokens, "completion_tokens": config.completion_tokens,
+                         "total_tokens": prompt_tokens + config.completion_tokens}
+                time.sleep(config.latency())
+                words = self._answer()
+                if not body.get("stream"):
+                    self._json(200, {
+                        "id": completion_id, "object": "chat.completion", "created": int(time.time()), "model": model,
+                        "choices": [{"index": 0, "finish_reason": "stop",
+                                     "message": {"role": "assistant", "content": "".join(words)}}],
+                        "usage": usage,
+                    })
+                    return
+                server._count("streamed")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+
+                def event(choices: Any, extra: Optional[Dict[str, Any]] = None) -> None:
+                    payload = {"id": completion_id, "object": "chat.completion.chunk",
+                               "created": int(time.time()), "model": model, "choices": choices}
+                    payload.update(extra or {})
+                    self._chunk(b"data: " + json.dumps(payload).encode("utf-8") + b"\n\n")
+
+                # Azure sends the prompt content-filter results first, without choices
+                event([])
+                for word in words:
+                    event([{"index": 0, "delta": {"content": word}, "finish_reason": None}])
+                    if config.token_rate:
+                        time.sleep(1.0 / config.token_rate)
+                event([{"index": 0, "delta": {}, "finish_reason": "stop"}])
+                if (body.get("stream_options") or {}).get("include_usage"):
+                    event([], {"usage": usage})
+                self._chunk(b"data: [DONE]\n\n")
+                self._chunk(b"")
+
+            def _image(self, body: Dict[str, Any]) -> None:
+                server._count("images")
+                time.sleep(config.image_latency())
+                image_id = uuid.uuid4().hex
+                png = tiny_png(config.image_size, seed=hash(body.get("prompt", "")))
+                if body.get("response_format") == "b64_json" and not config.b64_json:
+                    self._json(400, {"error": {"code": "invalid_request_error", "param": "response_format",
+                                               "message": "response_format 'b64_json' is not supported by this deployment"}})
+                    return
+                if body.get("response_format") == "b64_json":
+                    item = {"b64_json": base64.b64encode(png).decode("ascii")}
+                else:
+                    with server._lock:
+                        server._images[image_id] = png
+                    item = {"url": f"{server.url}/images/{image_id}.png"}
+                item["revised_prompt"] = body.get("prompt", "")
+                self._json(200, {"created": int(time.time()), "data": [item]})
+
+        return Handler
+
+
+def config_from_args(args: argparse.Namespace) -> MockConfig:
+    return MockConfig(
+        latency=parse_distribution(args.latency),
+        token_rate=args.token_rate,
+        completion_tokens=args.completion_tokens,
+        rate_limit=args.rate_limit,
+        retry_after_ms=args.retry_after_ms,
+        image_latency=parse_distribution(args.image_latency),
+        image_size=args.image_size,
+        b64_json=args.b64_json,
+    )
+
+
+def add_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument("--latency", default="lognormal:0.25,0.4", help="time to first byte (default: lognormal:0.25,0.4)")
+    parser.add_argument("--token-rate", type=float, default=200.0, help="streamed tokens/s (default: 200, 0 = unpaced)")
+    parser.add_argument("--completion-tokens", type=int, default=60)
+    parser.add_argument("--rate-limit", type=float, default=0.0, help="share of requests answered with 429 (default: 0)")
+    parser.add_argument("--retry-after-ms", type=int, default=200)
+    parser.add_argument("--image-latency", default="uniform:0.5,1.5", help="image generation time (default: uniform:0.5,1.5)")
+    parser.add_argument("--image-size", type=int, default=256)
+    parser.add_argument("--no-b64-json", dest="b64_json", action="store_false",
+                        help="reject response_format=b64_json with a 400 (URL-only deployments)")
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Local stand-in for the Azure OpenAI chat and image endpoints.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8010)
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    server = MockServer(config_from_args(args), host=args.host, port=args.port)
+    print(server.url, flush=True)
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.httpd.server_close()
+        print(server.stats)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,82 @@
+"""Cold-start benchmark for the ``levelup`` subcommands.
+
+Each run starts a fresh interpreter, so nothing is cached in ``sys.modules``:
+
+* ``cli``    – importing ``levelup.cli`` (should stay a few milliseconds),
+* ``import`` – importing the subcommand's app module,
+* ``ready``  – from the first line of the script until the app is ready to
+  run (Gradio ``demo`` built, or ``main`` resolved),
+* ``wall``   – the whole process, interpreter start-up included.
+
+No Azure credentials are needed: the apps create their clients on the first
+request. Usage (from ``courses/levelup``)::
+
+    python -m benchmarks.startup [command ...] [--repeat N]
+    python -m levelup bench-startup
+"""
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import Dict, List
+
+ROOT = Path(__file__).resolve().parent.parent
+
+PROBE = """
+import json, sys, time
+t0 = time.perf_counter()
+from levelup import cli
+t1 = time.perf_counter()
+cli.load(sys.argv[1])
+t2 = time.perf_counter()
+cli.prepare(sys.argv[1])
+t3 = time.perf_counter()
+print(json.dumps({"cli": t1 - t0, "import": t2 - t1, "ready": t3 - t0}))
+"""
+
+
+def measure(command: str) -> Dict[str, float]:
+    start = time.perf_counter()
+    proc = subprocess.run(
+        [sys.executable, "-c", PROBE, command],
+        cwd=ROOT, capture_output=True, text=True,
+    )
+    wall = time.perf_counter() - start
+    if proc.returncode != 0:
+        raise RuntimeError(f"{command} failed to start:\n{proc.stderr.strip()}")
+    result = json.loads(proc.stdout.strip().splitlines()[-1])
+    result["wall"] = wall
+    return result
+
+
+def run(commands: List[str], repeat: int = 5) -> int:
+    print(f"{'command':<14}{'cli ms':>10}{'import ms':>12}{'ready ms':>11}{'wall ms':>10}   (median of {repeat})")
+    failed = False
+    for command in commands:
+        try:
+            samples = [measure(command) for _ in range(repeat)]
+        except RuntimeError as e:
+            print(f"{command:<14}error: {e}")
+            failed = True
+            continue
+        median = {k: statistics.median(s[k] for s in samples) * 1000 for k in samples[0]}
+        print(f"{command:<14}{median['cli']:>10.1f}{median['import']:>12.1f}{median['ready']:>11.1f}{median['wall']:>10.1f}")
+    return 1 if failed else 0
+
+
+def main() -> int:
+    sys.path.insert(0, str(ROOT))
+    from levelup.cli import COMMANDS
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("commands", nargs="*", help="subcommands to measure (default: all)")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    return run(args.commands or list(COMMANDS), repeat=args.repeat)
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
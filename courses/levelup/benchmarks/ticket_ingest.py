@@ -0,0 +1,122 @@
+"""Throughput of support ticket ingestion, one at a time and in bulk.
+
+Each path runs in a fresh interpreter against an empty store in a temporary
+folder and reports committed tickets per second:
+
+* ``legacy``  – the old ``submit_support_ticket``: one ``write_text`` per
+  ticket, never synced,
+* ``single``  – ``submit_support_ticket`` called one after another from one
+  thread (every ticket is its own commit),
+* ``burst``   – ``submit_support_ticket`` called from ``--threads`` threads
+  at once, as during an outage; the group-commit writer batches them,
+* ``bulk``    – ``submit_support_tickets`` with ``--bulk-size`` tickets per
+  call.
+
+Every path except ``legacy`` runs for each ``--store`` and
+``--durability``; ``full`` syncs every commit to disk, so on a fast disk
+(or tmpfs) the gap to ``normal`` is small. The ``files`` store creates one
+file per ticket whatever the batch, so batching helps it little.
+
+Usage (from ``courses/levelup``)::
+
+    python -m benchmarks.ticket_ingest --tickets 5000
+    python -m levelup bench-tickets single bulk --store sqlite --durability full normal
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+from typing import Dict, List, Optional
+
+ROOT = Path(__file__).resolve().parent.parent
+PATHS = ("legacy", "single", "burst", "bulk")
+STORES = ("sqlite", "files")
+DURABILITIES = ("full", "normal")
+
+PROBE = """
+import json, sys, time, uuid
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+sys.path.insert(0, "13102025")
+import ticket_store
+from support_tool import submit_support_ticket, submit_support_tickets
+
+path, count, threads, bulk_size, folder = sys.argv[1], int(sys.argv[2]), int(sys.argv[3]), int(sys.argv[4]), Path(sys.argv[5])
+items = [(f"user{i % 500}@example.com", f"Problem number {i}: the app does not start.") for i in range(count)]
+start = time.perf_counter()
+if path == "legacy":
+    for email, description in items:
+        ticket_id = str(uuid.uuid4()).replace("-", "")[:6]
+        (folder / f"ticket-{ticket_id}.txt").write_text(
+            f"Support ticket: {ticket_id}\\nSubmitted by: {email}\\nDescription:\\n{description}")
+elif path == "single":
+    for email, description in items:
+        submit_support_ticket(email, description)
+elif path == "burst":
+    with ThreadPoolExecutor(threads) as pool:
+        list(pool.map(lambda item: submit_support_ticket(*item), items))
+else:
+    for i in range(0, count, bulk_size):
+        submit_support_tickets([{"email_address": email, "description": description}
+                                for email, description in items[i:i + bulk_size]])
+seconds = time.perf_counter() - start
+stats = ticket_store.get_ticket_writer().stats if path != "legacy" else None
+print(json.dumps({"seconds": seconds, "batches": stats.batches if stats else count,
+                  "stored": len(list(folder.glob("ticket-*.txt"))) if path == "legacy"
+                  else ticket_store.get_ticket_store().count()}))
+"""
+
+
+def measure(path: str, store: str, durability: str, args: argparse.Namespace) -> Dict[str, float]:
+    with tempfile.TemporaryDirectory(prefix="levelup-tickets-") as folder:
+        env = dict(os.environ, TICKET_STORE=store, TICKET_DURABILITY=durability,
+                   TICKET_DB_PATH=str(Path(folder) / "tickets.sqlite"), TICKET_FILES_DIR=folder)
+        proc = subprocess.run(
+            [sys.executable, "-c", PROBE, path, str(args.tickets), str(args.threads), str(args.bulk_size), folder],
+            cwd=ROOT, env=env, capture_output=True, text=True,
+        )
+    if proc.returncode != 0:
+        raise RuntimeError(f"{path} failed:\n{proc.stderr.strip()}")
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("paths", nargs="*", help=f"paths to run (default: all of {', '.join(PATHS)})")
+    parser.add_argument("--tickets", type=int, default=2000, help="tickets per run (default: 2000)")
+    parser.add_argument("--threads", type=int, default=32, help="concurrent callers for burst (default: 32)")
+    parser.add_argument("--bulk-size", type=int, default=100, help="tickets per bulk call (default: 100)")
+    parser.add_argument("--store", nargs="+", choices=STORES, default=list(STORES), help="backends (default: both)")
+    parser.add_argument("--durability", nargs="+", choices=DURABILITIES, default=list(DURABILITIES),
+                        help="durability levels (default: both)")
+    args = parser.parse_args(argv)
+    unknown = set(args.paths) - set(PATHS)
+    if unknown:
+        parser.error(f"unknown path(s): {', '.join(sorted(unknown))}")
+
+    runs = []
+    for path in args.paths or PATHS:
+        if path == "legacy":
+            runs.append((path, "files", "-"))
+        else:
+            runs.extend((path, store, durability) for store in args.store for durability in args.durability)
+    print(f"{args.tickets} tickets per run")
+    print(f"{'path':<8}{'store':<8}{'durability':<12}{'tickets/s':>11}{'commits':>9}{'per commit':>12}")
+    for path, store, durability in runs:
+        try:
+            result = measure(path, store, durability, args)
+        except RuntimeError as e:
+            print(f"{path:<8}error: {e}")
+            return 1
+        lost = args.tickets - result["stored"]
+        print(f"{path:<8}{store:<8}{durability:<12}{args.tickets / result['seconds']:>11,.0f}"
+              f"{result['batches']:>9}{args.tickets / max(result['batches'], 1):>12.1f}"
+              + (f"  ({lost} overwritten: id collisions)" if lost else ""))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
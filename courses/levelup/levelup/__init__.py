@@ -0,0 +1,8 @@
+"""One command line entry point for the LevelUP course apps.
+
+Run from ``courses/levelup``::
+
+    python -m levelup chat
+    python -m levelup chat-ui --port 7860
+    python -m levelup tickets submit user@example.com "Cannot log in"
+"""
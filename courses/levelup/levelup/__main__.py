@@ -0,0 +1,3 @@
+from levelup.cli import main
+
+raise SystemExit(main())
@@ -0,0 +1,170 @@
+"""``python -m levelup <command>`` – subcommands for every course app.
+
+Only the standard library is imported up front. A subcommand imports its app
+module (and with it gradio, PIL, openai and azure.*) when it runs, and the
+apps create their Azure clients on the first request, so ``--help`` and the
+startup benchmark never wait on heavy imports or sign-in.
+"""
+import argparse
+import importlib
+import json
+import sys
+import time
+from pathlib import Path
+from types import ModuleType
+from typing import Any, Dict, List, NamedTuple, Optional
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+class Command(NamedTuple):
+    folder: str  # course folder with the app module
+    module: str
+    kind: str    # "cli", "args" (a cli taking its own arguments), "ui" or "tickets"
+    help: str
+
+
+COMMANDS: Dict[str, Command] = {
+    "chat": Command("08102025", "chat", "cli", "text chat in the terminal"),
+    "batch": Command("08102025", "batch", "args", "run a JSONL file of prompts concurrently"),
+    "chat-ui": Command("08102025", "chatgradio2", "ui", "text chat in the browser"),
+    "vision": Command("08102025", "chatimage2", "cli", "questions about a local or remote image in the terminal"),
+    "vision-batch": Command("08102025", "batch_vision", "args", "ask the same question about every image in a folder"),
+    "vision-ui": Command("08102025", "chatimagegradio", "ui", "questions about an uploaded image in the browser"),
+    "imagegen-ui": Command("08102025", "imdallegradio", "ui", "image generation in the browser"),
+    "image-store": Command("08102025", "image_store", "args", "disk usage, import and cleanup of generated images"),
+    "tickets": Command("13102025", "support_tool", "tickets", "support tickets"),
+}
+
+
+def load(name: str, module: Optional[str] = None) -> ModuleType:
+    """Import the app module behind a subcommand."""
+    command = COMMANDS[name]
+    folder = str(ROOT / command.folder)
+    if folder not in sys.path:
+        # The app modules import their neighbours (clients, streaming, ...) by plain name
+        sys.path.insert(0, folder)
+    return importlib.import_module(module or command.module)
+
+
+def prepare(name: str, module: Optional[str] = None) -> Any:
+    """Import a subcommand and return what it runs: ``main``, the Gradio ``demo`` or the ticket API."""
+    app = load(name, module)
+    kind = COMMANDS[name].kind
+    if kind == "ui":
+        return app.demo
+    if kind in ("cli", "args"):
+        return app.main
+    return app.submit_support_ticket
+
+
+def _add_ui_options(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument("--host", default=None, help="interface to listen on (Gradio default: 127.0.0.1)")
+    parser.add_argument("--port", type=int, default=None, help="port to listen on (Gradio default: 7860)")
+    parser.add_argument("--share", action="store_true", help="create a public Gradio link")
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="levelup", description="LevelUP course apps")
+    sub = parser.add_subparsers(dest="command", required=True)
+    for name, command in COMMANDS.items():
+        p = sub.add_parser(name, help=command.help)
+        if command.kind == "ui":
+            _add_ui_options(p)
+        if command.kind == "args":
+            p.add_argument("args", nargs=argparse.REMAINDER, help=f"arguments for {command.module}.py")
+        if name == "chat-ui":
+            p.add_argument("--plain", action="store_true", help="use the plain layout (chatgradio.py)")
+        if command.kind == "tickets":
+            tickets = p.add_subparsers(dest="action", required=True)
+            submit = tickets.add_parser("submit", help="submit one ticket")
+            submit.add_argument("email")
+            submit.add_argument("description")
+            listing = tickets.add_parser("list", help="newest tickets, or one user's tickets")
+            listing.add_argument("--email", default=None)
+            listing.add_argument("--limit", type=int, default=20)
+            show = tickets.add_parser("show", help="one ticket by id")
+            show.add_argument("ticket_id")
+            migrate = tickets.add_parser("import", help="move the old ticket-*.txt files into the ticket store")
+            migrate.add_argument("--folder", type=Path, default=None, help="where the files are (default: 13102025)")
+            migrate.add_argument("--delete", action="store_true", help="delete each file once it is in the store")
+
+    bench = sub.add_parser("bench-startup", help="measure import and time-to-ready of each subcommand")
+    bench.add_argument("commands", nargs="*", help="subcommands to measure (default: all)")
+    bench.add_argument("--repeat", type=int, default=5)
+
+    load_test = sub.add_parser("bench-load", help="load-test the app handlers against a local mock server")
+    load_test.add_argument("args", nargs=argparse.REMAINDER, help="arguments for benchmarks/loadtest.py")
+
+    memory = sub.add_parser("bench-memory", help="peak memory of encoding a large local image for the vision model")
+    memory.add_argument("args", nargs=argparse.REMAINDER, help="arguments for benchmarks/image_memory.py")
+    tickets = sub.add_parser("bench-tickets", help="tickets per second, one at a time and in bulk")
+    tickets.add_argument("args", nargs=argparse.REMAINDER, help="arguments for benchmarks/ticket_ingest.py")
+    return parser
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = build_parser()
+    args, extra = parser.parse_known_args(argv)
+    # REMAINDER only collects what follows a positional; options such as --sessions land in extra
+    if extra and not hasattr(args, "args"):
+        parser.error(f"unrecognized arguments: {' '.join(extra)}")
+    if extra:
+        args.args = extra + args.args
+
+    if args.command == "bench-startup":
+        from benchmarks import startup
+        return startup.run(args.commands or list(COMMANDS), repeat=args.repeat)
+    if args.command == "bench-load":
+        from benchmarks import loadtest
+        return loadtest.main(args.args)
+    if args.command == "bench-memory":
+        from benchmarks import image_memory
+        return image_memory.main(args.args)
+    if args.command == "bench-tickets":
+        from benchmarks import ticket_ingest
+        return ticket_ingest.main(args.args)
+
+    command = COMMANDS[args.command]
+    module = "chatgradio" if getattr(args, "plain", False) else None
+    target = prepare(args.command, module)
+    if command.kind == "ui":
+        target.launch(server_name=args.host, server_port=args.port, share=args.share)
+    elif command.kind == "cli":
+        target()
+    elif command.kind == "args":
+        return target(args.args)
+    elif args.action == "submit":
+        print(target(args.email, args.description))
+    else:
+        return _tickets(args)
+    return 0
+
+
+def _tickets(args: argparse.Namespace) -> int:
+    store_module = load("tickets", "ticket_store")
+    store = store_module.get_ticket_store()
+    if args.action == "import":
+        if not isinstance(store, store_module.SqliteTicketStore):
+            print("TICKET_STORE=files: nothing to import")
+            return 1
+        folder = args.folder or ROOT / COMMANDS["tickets"].folder
+        imported, existing, unreadable = store_module.import_ticket_files(store, folder, delete=args.delete)
+        print(f"Imported {imported} tickets into {store.path} ({existing} already there)")
+        for path in unreadable:
+            print(f"Skipped {path.name}: not in the ticket format")
+        return 0
+    if args.action == "show":
+        ticket = store.get(args.ticket_id)
+        if ticket is None:
+            print(f"No ticket {args.ticket_id}")
+            return 1
+        print(json.dumps(ticket.to_dict(), ensure_ascii=False, indent=2))
+        return 0
+    tickets = store.by_email(args.email, args.limit) if args.email else store.recent(args.limit)
+    for ticket in tickets:
+        when = time.strftime("%Y-%m-%d %H:%M", time.localtime(ticket.created))
+        summary = " ".join(ticket.description.split())
+        print(f"{ticket.id}  {when}  {ticket.email}  {summary[:60]}")
+    print(f"{len(tickets)} shown, {store.count(args.email)} in total")
+    return 0